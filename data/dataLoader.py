@@ -41,6 +41,24 @@ class DataLoader(object):
         whitespaces, and lowercasing all words in the line. Finally, adds
         the line to the self.lyrics list, where a line is a list of words.
         """
+        for songFile in self.lyricsFiles(dirName):
+            self.loadLyricsFile(songFile)
+
+    def iterLyrics(self, dirName):
+        """
+        Yields the cleaned lines of the lyrics in the directory specified
+        by dirName one at a time, as loadLyrics would add them to
+        self.lyrics, without keeping them.
+        """
+        for songFile in self.lyricsFiles(dirName):
+            for line in self.iterLyricsFile(songFile):
+                yield line
+
+    def lyricsFiles(self, dirName):
+        """
+        Returns the paths of the lyrics files in the directory specified
+        by dirName, or an empty list if that directory does not exist.
+        """
         scriptDir = os.path.dirname(os.path.abspath(__file__))
         musicDir = os.path.join(scriptDir, "lyrics/")
         dirs = [normalize('NFC', unicode(item, 'utf-8')) for \
@@ -50,25 +68,37 @@ class DataLoader(object):
         if normalize('NFC', dirName) not in dirs:
         # check if this artist has a directory in the lyrics directory
             print "No artist named", dirName, "in directory", musicDir
-            return
+            return []
 
         artistDir = musicDir + dirName + "/"
         songs = os.listdir(artistDir)
-        for song in songs:
-            songFile = open(artistDir + song)
-            songLines = songFile.readlines()
-            songFile.close()
-
-            # clean each line in each song and add it to self.lyrics
-            for line in songLines:
-                line = re.sub(self.bracketRegex, "", line)
-                line = re.sub(self.punctuationRegex, "", line)
-                line = re.sub(self.spaceRegex, " ", line)
-                line = line.lower()
-                line = line.strip().split()
-                line = [word for word in line if word != ""]
-                if line:
-                    self.lyrics.append(line)
+        return [artistDir + song for song in songs]
+
+    def loadLyricsFile(self, path):
+        """
+        Cleans each line of the lyrics file at path, as loadLyrics
+        does, and adds the lines to the self.lyrics list.
+        """
+        self.lyrics.extend(self.iterLyricsFile(path))
+
+    def iterLyricsFile(self, path):
+        """
+        Yields the cleaned lines of the lyrics file at path, each a list
+        of words, reading the file a line at a time.
+        """
+        songFile = open(path)
+
+        # clean each line in each song
+        for line in songFile:
+            line = re.sub(self.bracketRegex, "", line)
+            line = re.sub(self.punctuationRegex, "", line)
+            line = re.sub(self.spaceRegex, " ", line)
+            line = line.lower()
+            line = line.strip().split()
+            line = [word for word in line if word != ""]
+            if line:
+                yield line
+        songFile.close()
 
 
     def loadMusic(self, platform):
@@ -78,42 +108,65 @@ class DataLoader(object):
         data into PySynth tuple format, then adding each song's list of
         tuples to the self.songs list.
         """
+        for midiFile in self.musicFiles(platform):
+            self.loadMusicFile(midiFile)
+
+    def iterMusic(self, platform):
+        """
+        Yields the songs of the specified platform one at a time, as
+        loadMusic would add them to self.songs, without keeping them.
+        """
+        for midiFile in self.musicFiles(platform):
+            before = len(self.songs)
+            self.loadMusicFile(midiFile)
+            if len(self.songs) > before:
+                yield self.songs.pop()
+
+    def musicFiles(self, platform):
+        """
+        Returns the paths of the midi .txt files of the specified
+        platform, or an empty list if there is no such platform.
+        """
         midiDir = os.path.dirname(os.path.abspath(__file__)) + "/midi/"
         platformDir = midiDir + platform
 
         if platform not in os.listdir(midiDir):
             print "No platform named", platform, "in directory", midiDir
-            return
+            return []
 
         midiFiles = os.listdir(platformDir)
-        midiFiles = [platformDir + "/" + midiFile for midiFile in midiFiles]
-
-        for midiFile in midiFiles:
-            F = open(midiFile, "r")
-            lines = F.readlines()
-            F.close()
-
-            song = []
-            for line in lines:
-                line = line.split()
-
-                # extract pitch and duration from .txt song data, convert
-                # those values to pysynth format, and add the
-                # (pitch, duration) tuple to the song list
-                if "TR" in line and line[line.index("TR") + 1] == "1" \
-                        and "NT" in line:
-                    noteIndex = line.index("NT")
-                    pitch = line[noteIndex + 1]
-                    pitch = self.formatPitch(pitch)
-
-                    duration = line[noteIndex + 2]
-                    duration = self.formatDuration(duration)
-
-                    pysynthTuple = (pitch, duration)
-                    song.append(pysynthTuple)
-
-            if song:
-                self.songs.append(song)
+        return [platformDir + "/" + midiFile for midiFile in midiFiles]
+
+    def loadMusicFile(self, midiFile):
+        """
+        Converts the notes of one midi .txt file to PySynth tuples, as
+        loadMusic does, and adds the song to the self.songs list.
+        """
+        F = open(midiFile, "r")
+        lines = F.readlines()
+        F.close()
+
+        song = []
+        for line in lines:
+            line = line.split()
+
+            # extract pitch and duration from .txt song data, convert
+            # those values to pysynth format, and add the
+            # (pitch, duration) tuple to the song list
+            if "TR" in line and line[line.index("TR") + 1] == "1" \
+                    and "NT" in line:
+                noteIndex = line.index("NT")
+                pitch = line[noteIndex + 1]
+                pitch = self.formatPitch(pitch)
+
+                duration = line[noteIndex + 2]
+                duration = self.formatDuration(duration)
+
+                pysynthTuple = (pitch, duration)
+                song.append(pysynthTuple)
+
+        if song:
+            self.songs.append(song)
 
 
     def formatPitch(self, asciiPitch):
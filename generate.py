@@ -5,19 +5,25 @@ sys.path.append('./language-models')
 sys.path.append('./data')
 sys.path.append('./pysynth')
 import pysynth
+import render_cache
+import io
 import random
+import math
+import heapq
+import hashlib
 from dataLoader import *
 from unigramModel import *
 from bigramModel import *
 from trigramModel import *
 from musicData import *
+from backoffIndex import *
 
 # -----------------------------------------------------------------------------
 # Core ------------------------------------------------------------------------
 # Functions to implement: trainLyricsModels, selectNGramModel,
 # generateSentence, and runLyricsGenerator
 
-def trainLyricsModels(lyricsDirectory):
+def trainLyricsModels(lyricsDirectory, workers=1):
     """
     Requires: nothing
     Modifies: nothing
@@ -26,9 +32,13 @@ def trainLyricsModels(lyricsDirectory):
               instance of each of the NGramModel child classes and trains
               them using the text loaded from the data loader. The list
               should be in tri-, then bi-, then unigramModel order.
+              With workers other than 1, the training is done by
+              trainModelsSharded.
 
               Returns the list of trained models.
     """
+    if workers != 1:
+        return trainModelsSharded('lyrics', lyricsDirectory, workers)
 
     dataLoader = DataLoader()
 
@@ -74,42 +84,120 @@ def selectNGramModel(models, sentence):
         return models[2]
 
 
-def sentenceTooLong(desiredLength, currentLength):
+# backoff indexes built so far, by the ids of the models they were built from
+backoffIndexes = {}
+
+def getBackoffIndex(models):
     """
-    Requires: nothing
-    Modifies: nothing
+    Requires: models is a list of trained NGramModel objects sorted by
+              descending priority: tri-, then bi-, then unigrams, or an
+              index of its own such as a SuffixArrayIndex.
+    Modifies: backoffIndexes
+    Effects:  returns the BackoffIndex for models, building it the first
+              time, or models if it is an index already. The index keeps
+              the models alive, so their ids stay valid as a key.
+    """
+    if hasattr(models, 'lookup'):
+        return models
+    key = tuple(id(model) for model in models)
+    if key not in backoffIndexes:
+        backoffIndexes[key] = BackoffIndex(models)
+    return backoffIndexes[key]
+
+# packed models built so far, by the ids of the models they were built from
+packedModels = {}
+
+def getPackedModel(models):
+    """
+    Requires: models is a list of trained NGramModel objects sorted by
+              descending priority: tri-, then bi-, then unigrams, or a
+              PackedModel
+    Modifies: packedModels
+    Effects:  returns the PackedModel for models, packing their backoff
+              index the first time, or models if it is a PackedModel
+              already, such as a frozen one from freezeModels.
+    """
+    from packedModel import PackedModel
+    if isinstance(models, PackedModel):
+        return models
+    key = tuple(id(model) for model in models)
+    if key not in packedModels:
+        packedModels[key] = PackedModel(getBackoffIndex(models))
+    return packedModels[key]
+
+def sentenceTooLong(desiredLength, currentLength, rng=random):
+    """
+    Requires: rng is a random.Random (the random module by default)
+    Modifies: the state of rng
     Effects:  returns a bool indicating whether or not this sentence should
               be ended based on its length. This function has been done for
               you.
     """
     STDEV = 1
-    val = random.gauss(currentLength, STDEV)
+    val = rng.gauss(currentLength, STDEV)
     return val > desiredLength
 
-def generateSentence(models, desiredLength):
+def sentenceTooLongProbability(desiredLength, currentLength):
+    """
+    Requires: nothing
+    Modifies: nothing
+    Effects:  returns the probability that sentenceTooLong returns True.
+              This is the default length policy of the sentence generators;
+              any function of the same two arguments returning a
+              probability can take its place.
+    """
+    STDEV = 1
+    return 0.5 * math.erfc((desiredLength - currentLength) / (STDEV * math.sqrt(2)))
+
+def sentenceEnds(tooLong, drawsEnd, rng=random):
+    """
+    Requires: tooLong is the probability the length policy gives for the
+              sentence, drawsEnd the probability of drawing '$:::$' next;
+              rng is a random.Random (the random module by default)
+    Modifies: the state of rng
+    Effects:  returns a bool indicating whether or not the sentence ends
+              here, with one draw. Drawing '$:::$' does not add a token
+              but starts the next round of checking the length, so
+              summed over all rounds the sentence ends with probability
+              tooLong / (tooLong + (1 - tooLong) * (1 - drawsEnd)), and
+              otherwise gets a token drawn without '$:::$'. A sentence that
+              can only go on with '$:::$' ends.
+    """
+    goOn = (1 - tooLong) * (1 - drawsEnd)
+    return goOn <= 0 or rng.random() * (tooLong + goOn) < tooLong
+
+def generateSentence(models, desiredLength, rng=random,
+                     lengthPolicy=sentenceTooLongProbability, mode=None):
     """
     Requires: models is a list of trained NGramModel objects sorted by
               descending priority: tri-, then bi-, then unigrams.
               desiredLength is the desired length of the sentence.
-    Modifies: nothing
+              rng is a random.Random (the random module by default).
+              lengthPolicy is a function like sentenceTooLongProbability.
+              mode, if given, is a SamplingMode.
+    Modifies: the state of rng
     Effects:  returns a list of strings where each string is a word in the
               generated sentence. The returned list should NOT include
               any of the special starting or ending symbols.
 
               For more details about generating a sentence using the
-              NGramModels, see the spec.
+              NGramModels, see the spec. With mode, the end and every word
+              are drawn as mode describes.
     """
     sentence = ['^::^', '^:::^']
     length = 0
-    newtoken = ''
-
-    # if sentence is too long, sentence is done
-    while not sentenceTooLong(desiredLength, length):
-    	modelchoice = selectNGramModel(models, sentence)
-    	newtoken = modelchoice.getNextToken(sentence)
-      # if next token is $:::$, sentence is done
-    	if newtoken != '$:::$':
-    		sentence.append(newtoken)
+
+    # one walk of the backoff index finds the context selectNGramModel
+    # would choose
+    index = getBackoffIndex(models)
+
+    # instead of drawing '$:::$' and checking the length again, decide at
+    # once whether the sentence is done, else draw one of the other words
+    while True:
+        sampler = index.lookup(sentence, rng)
+        if sentenceEnds(lengthPolicy(desiredLength, length), sampler.drawsEnd(mode), rng):
+            break
+        sentence.append(sampler.drawNonEnd(rng, mode))
         # subtract 2 to not count special symbols
         length = len(sentence) - 2
 
@@ -120,6 +208,105 @@ def generateSentence(models, desiredLength):
 
     return sentence
 
+def generateSentences(models, desiredLength, count, rng=random,
+                      lengthPolicy=sentenceTooLongProbability):
+    """
+    Requires: models is a list of trained NGramModel objects sorted by
+              descending priority: tri-, then bi-, then unigrams.
+              rng is a random.Random (the random module by default).
+              lengthPolicy is a function like sentenceTooLongProbability.
+    Modifies: the state of rng
+    Effects:  returns a list of count sentences, each generated like
+              generateSentence does, but all at once: every step draws the
+              next word of all unfinished sentences with NumPy.
+    """
+    from packedModel import numpyRandom
+    return getPackedModel(models).generate(count, desiredLength, lengthPolicy,
+                                           rng = numpyRandom(rng))
+
+def nextWordLogProbabilities(samplers, width):
+    """
+    Requires: samplers is what BackoffIndex.samplers returns for a
+              sentence, width >= 1
+    Modifies: nothing
+    Effects:  returns the log-probability of the end symbol after the
+              sentence (None if it cannot end there) and a list of the
+              width most probable other words with their log-probabilities,
+              most probable first. A word's probability is its share of
+              the counts of the longest context, mixed with the shorter
+              contexts by their backoffProbability where a model has one.
+    """
+    probabilities = {}
+    reach = 1.
+    for i, sampler in enumerate(samplers):
+        backoff = sampler.backoffProbability if i + 1 < len(samplers) else 0.
+        share = reach * (1 - backoff) / sampler.cumulative[-1]
+        for word, count in sampler.candidates.items():
+            probabilities[word] = probabilities.get(word, 0.) + share * count
+        reach *= backoff
+        if not reach:
+            break
+    end = probabilities.pop('$:::$', 0.)
+    best = heapq.nlargest(width, probabilities.items(), key = lambda item: (item[1], item[0]))
+    return (math.log(end) if end else None), [(math.log(p), word) for word, p in best]
+
+def beamSearch(models, seed=(), count=10, beamWidth=16, maxLength=20, lengthPenalty=0.7):
+    """
+    Requires: models is a list of trained NGramModel objects sorted by
+              descending priority: tri-, then bi-, then unigrams; seed is
+              a list of words to start the lines with; count, beamWidth
+              and maxLength are >= 1
+    Modifies: nothing
+    Effects:  returns the count most probable lines that start with seed,
+              with their scores, best first, as (words, score) pairs.
+              Each step extends the beamWidth best unfinished lines by
+              their best words, keeping the beamWidth best extensions in a
+              heap. A line is finished when it draws '$:::$', and scored by
+              the log-probability of its words after seed and the end
+              symbol, divided by their number to the power lengthPenalty
+              (0 for no normalization, 1 for the mean per word). Lines not
+              finished after maxLength words after seed are dropped.
+              There is no randomness: the same models give the same lines.
+    """
+    index = getBackoffIndex(models)
+    start = ['^::^', '^:::^'] + list(seed)
+    frontier = [(0., tuple(start))]
+    finished = []
+    expansions = {}
+    # one step more than maxLength, so lines of maxLength words can end
+    for step in range(maxLength + 1):
+        # the beamWidth best extensions, the worst first
+        extended = []
+        for logProbability, sentence in frontier:
+            samplers = index.samplers(sentence)
+            key = tuple(id(sampler) for sampler in samplers)
+            if key not in expansions:
+                expansions[key] = nextWordLogProbabilities(samplers, beamWidth)
+            end, words = expansions[key]
+            if end is not None:
+                length = len(sentence) - len(start) + 1
+                score = (logProbability + end) / length ** lengthPenalty
+                line = (score, sentence[2:])
+                if len(finished) < count:
+                    heapq.heappush(finished, line)
+                elif line > finished[0]:
+                    heapq.heapreplace(finished, line)
+            if step == maxLength:
+                continue
+            for wordLogProbability, word in words:
+                candidate = (logProbability + wordLogProbability, sentence + (word,))
+                if len(extended) < beamWidth:
+                    heapq.heappush(extended, candidate)
+                elif candidate > extended[0]:
+                    heapq.heapreplace(extended, candidate)
+                else:
+                    # the other words of this line are even less probable
+                    break
+        frontier = extended
+        if not frontier:
+            break
+    return [(list(line), score) for score, line in sorted(finished, reverse = True)]
+
 def printSongLyrics(title, verseOne, verseTwo, chorus):
     """
     Requires: verseOne, verseTwo, and chorus are lists of lists of strings
@@ -136,33 +323,22 @@ def printSongLyrics(title, verseOne, verseTwo, chorus):
             print (' '.join(line)).capitalize()
         print '\n',
 
-def runLyricsGenerator(models):
+def runLyricsGenerator(models, rng=random):
     """
-    Requires: models is a list of a trained nGramModel child class objects
-    Modifies: nothing
+    Requires: models is a list of a trained nGramModel child class objects,
+              rng is a random.Random (the random module by default)
+    Modifies: the state of rng
     Effects:  generates a verse one, a verse two, and a chorus, then
               calls printSongLyrics to print the song out.
     """
-    verseOne = []
-    verseTwo = []
-    chorus = []
-
-    # each verse/chorus contains four sentences of desired length 6
-    verseOne.append(generateSentence(models, 6))
-    verseOne.append(generateSentence(models, 6))
-    verseOne.append(generateSentence(models, 6))
-    verseOne.append(generateSentence(models, 6))
-
-    verseTwo.append(generateSentence(models, 6))
-    verseTwo.append(generateSentence(models, 6))
-    verseTwo.append(generateSentence(models, 6))
-    verseTwo.append(generateSentence(models, 6))
-
-    chorus.append(generateSentence(models, 6))
-    chorus.append(generateSentence(models, 6))
-    chorus.append(generateSentence(models, 6))
-
-    lastLine = generateSentence(models, 6)
+    # each verse/chorus contains four sentences of desired length 6,
+    # all twelve are generated together
+    lines = generateSentences(models, 6, 12, rng)
+    verseOne = lines[0:4]
+    verseTwo = lines[4:8]
+    chorus = lines[8:11]
+
+    lastLine = lines[11]
     length = len(lastLine)
     chorus.append(lastLine)
 
@@ -171,7 +347,7 @@ def runLyricsGenerator(models):
 
     title3 = [title1, title2]
 
-    title = random.choice(title3)
+    title = rng.choice(title3)
 
     printSongLyrics(title, verseOne, verseTwo, chorus)
 
@@ -184,7 +360,7 @@ def runLyricsGenerator(models):
 # Functions to implement: trainMusicModels, generateMusicalSentence, and
 # runMusicGenerator
 
-def trainMusicModels(musicDirectory):
+def trainMusicModels(musicDirectory, workers=1, byKey=False, transpose=False):
     """
     Requires: nothing
     Modifies: nothing
@@ -193,9 +369,25 @@ def trainMusicModels(musicDirectory):
               and takes a music directory name instead of an artist name.
               Returns a list of trained models in order of tri-, then bi-, then
               unigramModel objects.
+
+              With byKey, returns a KeyedMusicModels of the songs instead,
+              which trains the models of each key the first time it is
+              asked for them, so workers is not used. With transpose, the
+              models are trained on the songs in all twelve keys, counted
+              in one pass by trainTransposedModels, or for byKey on the
+              songs of each mode transposed into the key.
     """
+    if workers != 1 and not byKey and not transpose:
+        return trainModelsSharded('music', musicDirectory, workers)
+
     dataLoader = DataLoader()
     dataLoader.loadMusic(musicDirectory) # music stored in dataLoader.songs
+    if byKey:
+        from keyedMusicModels import KeyedMusicModels
+        return KeyedMusicModels(dataLoader.songs, transpose = transpose)
+    if transpose:
+        from keyedMusicModels import trainTransposedModels
+        return trainTransposedModels(dataLoader.songs)
     models = [TrigramModel(), BigramModel(), UnigramModel()]
 
     # add rest of trainMusicModels implementation here
@@ -212,148 +404,484 @@ def trainMusicModels(musicDirectory):
     models = [trigram, bigram, unigram]
     return models
 
-def generateMusicalSentence(models, desiredLength, possiblePitches):
+def generateConstrainedSentence(models, desiredLength, possiblePitches, fits,
+                                durations, rng=random,
+                                lengthPolicy=sentenceTooLongProbability, mode=None):
     """
-    Requires: possiblePitches is a list of pitches for a musical key
-    Modifies: nothing
-    Effects:  works exactly like generateSentence from the core, except
-              now we call the NGramModel child class' getNextNote()
-              function instead of getNextToken(). Everything else
-              should be exactly the same as the core.
+    Requires: possiblePitches is a list of pitches for a musical key, fits
+              is one of the note filters of nGramModel, or None for models
+              that only know notes in key, and durations the note
+              durations to fall back on; rng is a random.Random (the
+              random module by default), lengthPolicy a function like
+              sentenceTooLongProbability; mode, if given, is a
+              SamplingMode
+    Modifies: the state of rng
+    Effects:  generates a musical sentence like generateSentence does, but
+              each note is chosen as getNextNote and its variants choose
+              it: only from the candidates that fit, or, if none does, as
+              a random pitch with a random duration from durations. The
+              candidates that fit each context are only found once. With
+              mode, the end and the notes that fit are drawn as mode
+              describes.
     """
     sentence = ['^::^', '^:::^']
-
-    # add rest of generateMusicalSentence implementation here
-    newnote = ()
     length = 0
-    while not sentenceTooLong(desiredLength, length):
-    	modelchoice = selectNGramModel(models, sentence)
-    	newnote = modelchoice.getNextNote(sentence, possiblePitches)
-
-    	if newnote != '$:::$':
-        	sentence.append(newnote)
-      # subtract 2 to not count special symbols
+    index = getBackoffIndex(models)
+    while True:
+        sampler = index.lookup(sentence, rng)
+        if fits is not None and sampler is not None:
+            sampler = sampler.restrict(fits, possiblePitches)
+        drawsEnd = 0.
+        if sampler is not None:
+            drawsEnd = sampler.drawsEnd(mode)
+        if sentenceEnds(lengthPolicy(desiredLength, length), drawsEnd, rng):
+            break
+        if sampler is None:
+            sentence.append((rng.choice(possiblePitches), rng.choice(durations)))
+        else:
+            sentence.append(sampler.drawNonEnd(rng, mode))
+        # subtract 2 to not count special symbols
         length = len(sentence) - 2
 
     # final list doesn't contain symbols
-    sentence.remove("^::^")
-    sentence.remove('^:::^')
-    # '$:::$' is never added so it doesn't need to be removed
-    return sentence
-
-# generates song that sounds more consonant using getNextGoodNote
-def generateGoodMusicalSentence(models, desiredLength, possiblePitches):
-    
-    sentence = ['^::^', '^:::^']
+    return sentence[2:]
 
-    newnote = ()
-    length = 0
-    while not sentenceTooLong(desiredLength, length):
-    	modelchoice = selectNGramModel(models, sentence)
-    	newnote = modelchoice.getNextGoodNote(sentence, possiblePitches)
+def generateMusicalSentence(models, desiredLength, possiblePitches, rng=random, mode=None):
+    """
+    Requires: possiblePitches is a list of pitches for a musical key,
+              rng is a random.Random (the random module by default),
+              mode, if given, is a SamplingMode
+    Modifies: the state of rng
+    Effects:  works exactly like generateSentence from the core, except
+              now we call the NGramModel child class' getNextNote()
+              function instead of getNextToken(). Everything else
+              should be exactly the same as the core.
+    """
+    return generateConstrainedSentence(models, desiredLength, possiblePitches,
+                                       noteFits, NOTE_DURATIONS, rng, mode = mode)
 
-    	if newnote != '$:::$':
-    		sentence.append(newnote)
-      # subtract 2 to not count special symbols
-        length = len(sentence) - 2
+def generateMusicalSentences(models, desiredLength, possiblePitches, count, rng=random):
+    """
+    Requires: possiblePitches is a list of pitches for a musical key,
+              rng is a random.Random (the random module by default)
+    Modifies: the state of rng
+    Effects:  returns a list of count musical sentences, each generated like
+              generateMusicalSentence does, but all at once: every step
+              draws the next note of all unfinished sentences with NumPy.
+    """
+    from packedModel import numpyRandom
+    packedModel = getPackedModel(models)
+    pitches = list(possiblePitches)
+    allowed = packedModel.allowedTokens(lambda note: note == '$:::$' or
+        (isinstance(note, tuple) and noteFits(note, pitches)))
+    fallback = [(pitch, duration) for pitch in pitches for duration in NOTE_DURATIONS]
+    return packedModel.generate(count, desiredLength, sentenceTooLongProbability,
+                                allowed, fallback, rng = numpyRandom(rng))
 
-    # final list doesn't contain symbols
-    sentence.remove("^::^")
-    sentence.remove('^:::^')
-    # '$:::$' is never added so it doesn't need to be removed
-    return sentence
+# generates song that sounds more consonant using getNextGoodNote
+def generateGoodMusicalSentence(models, desiredLength, possiblePitches, rng=random, mode=None):
+    return generateConstrainedSentence(models, desiredLength, possiblePitches,
+                                       goodNoteFits, OTHER_NOTE_DURATIONS, rng, mode = mode)
 
 # makes the beginning and end of songs (if the user selects option 2 or 4) slower 
 # notes are either quarter or half notes at beginning
-def generateSlowMusicalSentence(models, desiredLength, possiblePitches):
-
-    sentence = ['^::^', '^:::^']
-
-    newnote = ()
-    length = 0
-
-    while not sentenceTooLong(desiredLength, length):
-     	modelchoice = selectNGramModel(models, sentence)
-     	newnote = modelchoice.getSlowNote(sentence, possiblePitches)
+def generateSlowMusicalSentence(models, desiredLength, possiblePitches, rng=random, mode=None):
+    return generateConstrainedSentence(models, desiredLength, possiblePitches,
+                                       slowNoteFits, SLOW_DURATIONS, rng, mode = mode)
 
-     	if newnote != '$:::$':
-    		sentence.append(newnote)
-      # subtract 2 to not count special symbols
-    	length = len(sentence) - 2
+def generateNotes(models, possiblePitches, fits=noteFits,
+                  durations=NOTE_DURATIONS, rng=random, context=(), mode=None):
+    """
+    Requires: possiblePitches is a list of pitches for a musical key, fits
+              is one of the note filters of nGramModel, or None for models
+              that only know notes in key, and durations the note
+              durations to fall back on; rng is a random.Random (the
+              random module by default); context is a list of notes;
+              mode, if given, is a SamplingMode to draw the notes with
+    Modifies: the state of rng
+    Effects:  yields notes without end, each chosen as
+              generateConstrainedSentence chooses the next note but never
+              '$:::$'. The context of every note is the notes before it,
+              starting from the start symbols followed by context, so the
+              melody does not go back to the start of a song between
+              phrases. Where nothing but '$:::$' fits, a note is made up
+              like where nothing fits.
+    """
+    index = getBackoffIndex(models)
+    depth = max(index.order - 1, 1)
+    sentence = (['^::^', '^:::^'] + list(context))[-depth:]
+    while True:
+        sampler = index.lookup(sentence, rng)
+        if fits is not None and sampler is not None:
+            sampler = sampler.restrict(fits, possiblePitches)
+        if sampler is None or not sampler.tokensNoEnd:
+            note = (rng.choice(possiblePitches), rng.choice(durations))
+        else:
+            note = sampler.drawNonEnd(rng, mode)
+        yield note
+        # only the notes the models can look back on are kept
+        sentence.append(note)
+        del sentence[:-depth]
+
+def noteDuration(note):
+    """
+    Requires: note is a PySynth tuple
+    Modifies: nothing
+    Effects:  returns the length of note in whole notes: 1/4 for a quarter
+              note, and half again as much for a negative (dotted) one.
+    """
+    if note[1] < 0:
+        return -1.5 / note[1]
+    return 1. / note[1]
 
-    # final list doesn't contain symbols
-    sentence.remove("^::^")
-    sentence.remove('^:::^')
-    # '$:::$' is never added so it doesn't need to be removed
-    return sentence
+def takeNotes(notes, count=None, duration=None):
+    """
+    Requires: notes is an iterator of PySynth tuples such as generateNotes
+              returns, and count or duration is given
+    Modifies: notes
+    Effects:  returns a list of the next count notes, or of as many as it
+              takes to last duration whole notes; with both, of as many
+              as it takes to reach either.
+    """
+    song = []
+    total = 0.
+    while (count is None or len(song) < count) and (duration is None or total < duration):
+        note = next(notes)
+        song.append(note)
+        total += noteDuration(note)
+    return song
+
+def modelsForKey(models, keyName, fits=noteFits):
+    """
+    Requires: models is a list of trained models or a KeyedMusicModels,
+              keyName a key of KEY_SIGNATURES or OTHER_KEY and fits one of
+              the note filters of nGramModel
+    Modifies: models, if it is a KeyedMusicModels
+    Effects:  returns the models to generate notes in keyName with and the
+              filter to pass generateNotes for them: for a KeyedMusicModels
+              the index of that key, whose candidates all fit noteFits, so
+              noteFits becomes None; otherwise models and fits.
+    """
+    if not hasattr(models, 'songsFor'):
+        return models, fits
+    if fits is noteFits:
+        fits = None
+    return models.index(keyName), fits
 
-def runMusicGenerator(models, songName):
+def runMusicGenerator(models, songName, rng=random):
     """
-    Requires: models is a list of trained models
-    Modifies: nothing
+    Requires: models is a list of trained models, rng is a random.Random
+              (the random module by default)
+    Modifies: the state of rng
     Effects:  runs the music generator as following the details in the spec.
 
               Note: For the core, this should print "Under construction".
     """
 
-    i = 0
-    possiblePitches = KEY_SIGNATURES[random.choice(KEY_SIGNATURES.keys())]
+    keyName = rng.choice(KEY_SIGNATURES.keys())
+    possiblePitches = KEY_SIGNATURES[keyName]
+    keyModels, fits = modelsForKey(models, keyName)
 
-    song = (generateMusicalSentence(models, 2, possiblePitches))
-    tonic = (generateSlowMusicalSentence(models, 2, possiblePitches[0]))
+    # the melody is one stream of notes, each following on the ones before
+    melody = takeNotes(generateNotes(keyModels, possiblePitches, fits, rng=rng), 30)
+    tonic = (generateSlowMusicalSentence(keyModels, 2, possiblePitches[0], rng))
 
-    while (len(song) < 30):
-    	song = song + (generateMusicalSentence(models, 2, possiblePitches)) 
-    
-    song = tonic + song + tonic
-    
-    pysynth.make_wav(song, fn = songName)
+    # the song is kept as a list of phrases, so the tonic and any phrase
+    # that was heard before are rendered only once
+    song = [tonic, melody, tonic]
+
+    render_cache.default().make_wav('a', song, fn = songName)
 
 
 # function if the user selects option 4 from the main menu
 # if the user selects 1, will play a song only using major keys
 # if the user selects 2, will play a song only using minor keys
 # if the user selects something other than 1 or 2, will play a song using a combination of major and minor keys
-def runMajorMinorMusicGenerator(models, songName, majorOrMinor):
-
-    i = 0
-    possiblePitches = KEY_SIGNATURES[random.choice(KEY_SIGNATURES.keys())]
-    majorPitches = MAJOR_KEYS[random.choice(MAJOR_KEYS.keys())]
-    minorPitches = MINOR_KEYS[random.choice(MINOR_KEYS.keys())]
-
+def runMajorMinorMusicGenerator(models, songName, majorOrMinor, rng=random):
 
-    song = (generateMusicalSentence(models, 2, possiblePitches))
-    tonic = (generateSlowMusicalSentence(models, 2, possiblePitches[0]))
+    keyName = rng.choice(KEY_SIGNATURES.keys())
+    majorKey = rng.choice(MAJOR_KEYS.keys())
+    minorKey = rng.choice(MINOR_KEYS.keys())
+    possiblePitches = KEY_SIGNATURES[keyName]
 
     if majorOrMinor == 1:
-        while (len(song) < 30):
-        	song = song + (generateMusicalSentence(models, 2, majorPitches))
+        melodyKey = majorKey
     elif majorOrMinor == 2:
-        while (len(song) < 30):
-        	song = song + (generateMusicalSentence(models, 2, minorPitches))    
+        melodyKey = minorKey
     else:
-        while (len(song) < 30):
-        	song = song + (generateMusicalSentence(models, 2, possiblePitches)) 
-    
-    song = tonic + song + tonic
-    
-    pysynth.make_wav(song, fn = songName)
+        melodyKey = keyName
+    melodyModels, fits = modelsForKey(models, melodyKey)
+    melody = takeNotes(generateNotes(melodyModels, KEY_SIGNATURES[melodyKey], fits, rng=rng), 30)
+    tonicModels, fits = modelsForKey(models, keyName)
+    tonic = (generateSlowMusicalSentence(tonicModels, 2, possiblePitches[0], rng))
+
+    song = [tonic, melody, tonic]
+
+    render_cache.default().make_wav('a', song, fn = songName)
 
 # function if the user selects option 3 from the main menu
 # generates music that is based off the c major pentatonix scale
 # song is then mixed with a ready made bassline using a popular chord progression
-def runGoodMusicGenerator(models, songName):
-    i = 0
-    possiblePitches = OTHER_KEY[random.choice(OTHER_KEY.keys())]
-    song = (generateGoodMusicalSentence(models, 2, possiblePitches))
-    tonic = (generateGoodMusicalSentence(models, 2, possiblePitches[0]))
-    while (len(song) < 30):
-        
-        song = song + (generateGoodMusicalSentence(models, 2, possiblePitches))
-            
-    song = tonic + song + tonic
-    pysynth.make_wav(song, fn = "out2.wav")
-    pysynth.mix_files("out.wav", "out2.wav", songName, chann = 2, phase = -1.)
+def runGoodMusicGenerator(models, songName, rng=random):
+    keyName = rng.choice(OTHER_KEY.keys())
+    possiblePitches = OTHER_KEY[keyName]
+    keyModels, fits = modelsForKey(models, keyName, goodNoteFits)
+    melody = takeNotes(generateNotes(keyModels, possiblePitches, fits,
+                                     OTHER_NOTE_DURATIONS, rng), 30)
+    tonic = (generateGoodMusicalSentence(keyModels, 2, possiblePitches[0], rng))
+
+    song = [tonic, melody, tonic]
+
+    # the melody is rendered in memory and mixed straight from there
+    melody = io.BytesIO()
+    render_cache.default().make_wav('a', song, fn = melody)
+    melody.seek(0)
+    pysynth.mix_files("out.wav", melody, songName, chann = 2, phase = -1.)
+
+
+# -----------------------------------------------------------------------------
+# Sharded training ------------------------------------------------------------
+
+def countShard(job):
+    """
+    Requires: job is a pair (kind, files) of 'lyrics' or 'music' and a list
+              of data files of that kind
+    Modifies: nothing
+    Effects:  loads only the given files and returns the nGramCounts of a
+              trigram, a bigram and a unigram model trained on them. Runs
+              in a worker process of trainModelsSharded.
+    """
+    kind, files = job
+    dataLoader = DataLoader()
+    for path in files:
+        if kind == 'lyrics':
+            dataLoader.loadLyricsFile(path)
+        else:
+            dataLoader.loadMusicFile(path)
+    text = dataLoader.lyrics if kind == 'lyrics' else dataLoader.songs
+    models = [TrigramModel(), BigramModel(), UnigramModel()]
+    for model in models:
+        model.trainModel(text)
+    return [model.nGramCounts for model in models]
+
+def mergeShards(pair):
+    """
+    Requires: pair holds two results of countShard (or of mergeShards)
+    Modifies: the first of the pair
+    Effects:  returns the sum of the two, model by model.
+    """
+    left, right = pair
+    return [addCounts(a, b) for a, b in zip(left, right)]
+
+def trainModelsSharded(kind, name, workers=None, shardsPerWorker=2):
+    """
+    Requires: kind is 'lyrics' or 'music' and name an artist or platform
+              directory of that kind; workers, if given, is positive
+    Modifies: nothing
+    Effects:  trains the models as trainLyricsModels or trainMusicModels
+              do, with the data files split into shardsPerWorker shards for
+              each of workers processes (one per core by default). Every
+              shard is loaded and counted by one process, which only holds
+              that shard, and the count tables are merged in pairs, in
+              parallel, until one is left. The counts equal those of
+              training in one process.
+    """
+    import multiprocessing
+    dataLoader = DataLoader()
+    if kind == 'lyrics':
+        files = dataLoader.lyricsFiles(name)
+    else:
+        files = dataLoader.musicFiles(name)
+    models = [TrigramModel(), BigramModel(), UnigramModel()]
+    if not files:
+        return models
+
+    workers = workers or multiprocessing.cpu_count()
+    count = min(len(files), workers * shardsPerWorker)
+    shards = [files[i * len(files) // count:(i + 1) * len(files) // count]
+              for i in range(count)]
+    pool = multiprocessing.Pool(workers)
+    try:
+        tables = pool.map(countShard, [(kind, shard) for shard in shards])
+        while len(tables) > 1:
+            merged = pool.map(mergeShards, zip(tables[0::2], tables[1::2]))
+            if len(tables) % 2:
+                merged.append(tables[-1])
+            tables = merged
+        pool.close()
+    finally:
+        pool.terminate()
+
+    for model, counts in zip(models, tables[0]):
+        model.nGramCounts = counts
+    return models
+
+
+# -----------------------------------------------------------------------------
+# Evaluation ------------------------------------------------------------------
+
+# the packed model the evaluation workers of this process score with
+evaluationModel = None
+
+def initEvaluationWorker(packedModel):
+    global evaluationModel
+    evaluationModel = packedModel
+
+def scoreShard(sentences):
+    """
+    Requires: initEvaluationWorker has been called; sentences is a list of
+              lists of tokens
+    Modifies: nothing
+    Effects:  scores every token of sentences and its end symbol, as
+              evaluate describes, and returns the sum of their
+              log-probabilities, their number, the number of them the
+              model could not have drawn, and the number of the others
+              scored at each order.
+    """
+    import numpy as np
+    packedModel = evaluationModel
+    depth = max(packedModel.order - 1, 2)
+    stream = []
+    scored = []
+    for sentence in sentences:
+        start = len(stream) + depth
+        stream.extend(['^::^'] * (depth - 1) + ['^:::^'] + list(sentence) + ['$:::$'])
+        scored.extend(range(start, len(stream)))
+    ids = np.array([packedModel.tokenIds.get(token, -1) for token in stream], np.int64)
+    positions = np.array(scored, np.int64)
+    history = ids[positions[:, None] - np.arange(depth, 0, -1)]
+    logProbabilities, orders = packedModel.logProbabilities(history, ids[positions])
+    hits = np.bincount(orders, minlength = packedModel.order + 1)
+    return logProbabilities.sum(), len(positions), int(hits[0]), hits[1:].tolist()
+
+def evaluate(models, sentences, workers=1, shardSize=10000):
+    """
+    Requires: models is a list of trained NGramModel objects sorted by
+              descending priority: tri-, then bi-, then unigrams, or a
+              PackedModel; sentences is a list of held-out lists of words
+              or notes
+    Modifies: nothing
+    Effects:  scores every token of sentences, and the end symbol after
+              each, by the probability the generators draw it with: its
+              share of the counts of the longest context the models know,
+              whether or not it was seen there, mixed with the shorter
+              contexts by their backoffProbability where a model has one
+              (see PackedModel.logProbabilities). Returns a dictionary of:
+                  tokens: the number of tokens scored
+                  missRate: the share of them the generators could not
+                      have drawn, unknown tokens included
+                  perplexity: exp of minus the mean log-probability of
+                      the others
+                  logLikelihood: the sum of their log-probabilities
+                  hitRates: for each order from the unigrams up, the share
+                      of the others scored after a context of that order
+              The misses have probability 0 and are left out of the
+              perplexity, so models are compared on both. The tokens are
+              scored with NumPy a shard of shardSize sentences at a time;
+              with workers other than 1 (None for one per CPU) the shards
+              are scored in that many processes.
+    """
+    import multiprocessing
+    import numpy as np
+    packedModel = getPackedModel(models)
+    packedModel.entryIndex()
+    shards = [sentences[i:i + shardSize] for i in range(0, len(sentences), shardSize)]
+    if not shards:
+        results = []
+    elif workers == 1:
+        initEvaluationWorker(packedModel)
+        results = [scoreShard(shard) for shard in shards]
+    else:
+        pool = multiprocessing.Pool(workers, initEvaluationWorker, (packedModel,))
+        try:
+            results = pool.map(scoreShard, shards)
+            pool.close()
+        finally:
+            pool.terminate()
+    logLikelihood = sum(result[0] for result in results)
+    tokens = sum(result[1] for result in results)
+    misses = sum(result[2] for result in results)
+    hits = np.zeros(packedModel.order, np.int64)
+    for result in results:
+        hits += result[3]
+    known = max(tokens - misses, 1)
+    return {'tokens': tokens,
+            'missRate': misses / float(max(tokens, 1)),
+            'perplexity': math.exp(-logLikelihood / known),
+            'logLikelihood': logLikelihood,
+            'hitRates': [hit / float(known) for hit in hits]}
+
+
+# -----------------------------------------------------------------------------
+# Batch -----------------------------------------------------------------------
+
+def jobRandom(seed, job):
+    """
+    Requires: seed and job are integers
+    Modifies: nothing
+    Effects:  returns the random.Random for job number job of a batch run
+              with seed. Every job gets its own stream, seeded from a hash
+              of seed and job, so what a job generates depends neither on
+              the other jobs nor on which worker runs it or when.
+    """
+    digest = hashlib.sha256('%d:%d' % (seed, job)).hexdigest()
+    return random.Random(int(digest, 16))
+
+def freezeModels(models, directory):
+    """
+    Requires: models is a list of trained NGramModel objects sorted by
+              descending priority: tri-, then bi-, then unigrams
+    Modifies: the files in directory
+    Effects:  writes the packed model of models to directory and returns
+              it loaded back frozen, its arrays mapped read-only from the
+              files (see PackedModel.load). Passed to runBatch in shared,
+              in place of the models, workers generate with
+              generateSentences and generateMusicalSentences from one copy
+              of it in memory, however many of them there are.
+    """
+    from packedModel import PackedModel
+    getPackedModel(models).save(directory)
+    return PackedModel.load(directory)
+
+# the function and shared arguments of the batch this process runs
+batchWork = None
+
+def initBatchWorker(function, shared):
+    global batchWork
+    batchWork = (function, shared)
+
+def runBatchJob(job):
+    function, shared = batchWork
+    number, seed, args = job
+    return function(*(shared + tuple(args)), rng = jobRandom(seed, number))
+
+def runBatch(function, jobs, seed=0, workers=1, shared=()):
+    """
+    Requires: function is a module-level function that takes an rng
+              keyword argument, jobs is a list of argument tuples for it
+              and shared is a tuple of arguments that go before those of
+              every job, such as the trained models
+    Modifies: nothing
+    Effects:  calls function once per job, each time with the job's own
+              random stream from jobRandom, and returns the results in the
+              order of jobs. With workers other than 1 (None for one per
+              CPU) the jobs run in that many processes, with the same
+              results. For example, runBatch(generateSentence,
+              [(6,)] * 1000, 42, None, (models,)) gives the same 1000
+              lines on every run.
+    """
+    import multiprocessing
+    jobs = [(number, seed, args) for number, args in enumerate(jobs)]
+    if workers == 1:
+        initBatchWorker(function, shared)
+        return [runBatchJob(job) for job in jobs]
+    pool = multiprocessing.Pool(workers, initBatchWorker, (function, shared))
+    try:
+        results = pool.map(runBatchJob, jobs)
+        pool.close()
+    finally:
+        pool.terminate()
+    return results
 
 
 # -----------------------------------------------------------------------------
@@ -414,7 +942,7 @@ def main():
 
     print 'Starting program and loading data...'
     lyricsModels = trainLyricsModels(lyricsDirectory)
-    musicModels = trainMusicModels(musicDirectory)
+    musicModels = trainMusicModels(musicDirectory, byKey = True, transpose = True)
     print 'Data successfully loaded\n'
 
     userInput = getUserInput(teamName, lyricsSource, musicSource)
@@ -0,0 +1,347 @@
+import os
+import heapq
+import shutil
+import tempfile
+import cPickle
+import numpy as np
+from nGramModel import *
+
+# -----------------------------------------------------------------------------
+# ArrayTrieModel class --------------------------------------------------------
+# An n-gram model that keeps its counts in a trie of sorted NumPy arrays
+# instead of nested dictionaries. Level d holds the ids of the d + 1st
+# tokens of all n-grams, sorted within each parent; offsets[d][i] and
+# offsets[d][i + 1] delimit the children of entry i at level d + 1, and the
+# last level holds the counts. A lookup is one binary search per level, and
+# the arrays can be saved and memory-mapped back in.
+
+class ArrayTrieModel(NGramModel):
+
+    def __init__(self, n):
+        """
+        Requires: n >= 1 is the order of the model: 1 for unigrams, 2 for
+                  bigrams and 3 for trigrams
+        Modifies: self
+        Effects:  sets up an empty model. self.nGramCounts stays empty;
+                  the counts live in self.ids, self.offsets and self.counts.
+        """
+        super(ArrayTrieModel, self).__init__()
+        self.n = n
+        self.tokens = []
+        self.tokenIds = {}
+        self.ids = [np.zeros(0, np.int64) for i in range(n)]
+        self.offsets = [np.zeros(1, np.int64) for i in range(n - 1)]
+        self.counts = np.zeros(0, np.int64)
+
+    def __str__(self):
+        return 'This is an ArrayTrieModel object of order %d' % self.n
+
+    def trainModel(self, text):
+        """
+        Requires: text is a list of lists of strings
+        Modifies: self
+        Effects:  counts the n-grams of text like the UnigramModel,
+                  BigramModel or TrigramModel of the same order would, and
+                  packs them into the trie, replacing what was there. Only
+                  the token ids of the n-grams are held at once, not a
+                  dictionary entry for each.
+        """
+        self.ranked.clear()
+        self.tokens = []
+        self.tokenIds = {}
+        # like UnigramModel, unigrams do not count the start symbols
+        start = 2 if self.n == 1 else 0
+        columns = [[] for i in range(self.n)]
+        for sentence in self.prepData(text):
+            ids = [self.addToken(token) for token in sentence]
+            for d in range(self.n):
+                columns[d].extend(ids[start + d:len(ids) - self.n + 1 + d])
+        grams = np.array(columns, np.int64).reshape(self.n, -1).T
+        self.pack(grams)
+
+    def addToken(self, token):
+        """
+        Requires: nothing
+        Modifies: self.tokens, self.tokenIds
+        Effects:  returns the id of token, giving it the next free id if it
+                  does not have one yet.
+        """
+        if token not in self.tokenIds:
+            self.tokenIds[token] = len(self.tokens)
+            self.tokens.append(token)
+        return self.tokenIds[token]
+
+    def pack(self, grams):
+        """
+        Requires: grams is an array of token ids with one row per n-gram
+                  occurrence and n columns
+        Modifies: self.ids, self.offsets, self.counts
+        Effects:  sorts and counts the n-grams and builds the trie of them
+                  with packSorted.
+        """
+        grams = grams[np.lexsort(grams.T[::-1])] if len(grams) else grams
+        changed = np.zeros(len(grams), bool)
+        if len(grams):
+            changed[0] = True
+        changed[1:] = (grams[1:] != grams[:-1]).any(axis = 1)
+        starts = np.flatnonzero(changed)
+        self.packSorted(grams[starts], np.diff(np.append(starts, len(grams))))
+
+    def packSorted(self, grams, counts):
+        """
+        Requires: grams is an array of distinct n-grams of token ids in
+                  sorted order, one per row, and counts their counts
+        Modifies: self.ids, self.offsets, self.counts
+        Effects:  builds the levels of the trie. Entry i of level d stands
+                  for a distinct prefix of length d + 1, and the entries of
+                  each level are in the order of their prefixes, so the
+                  children of an entry are contiguous.
+        """
+        changed = np.zeros(len(grams), bool)
+        if len(grams):
+            changed[0] = True
+        starts = []
+        for d in range(self.n):
+            changed[1:] |= grams[1:, d] != grams[:-1, d]
+            starts.append(np.flatnonzero(changed))
+            self.ids[d] = grams[starts[d], d]
+        for d in range(self.n - 1):
+            self.offsets[d] = np.append(np.searchsorted(starts[d + 1], starts[d]),
+                                        len(starts[d + 1]))
+        self.counts = np.array(counts, np.int64)
+
+    def trainStream(self, sentences, maxEntries=1 << 20, directory=None):
+        """
+        Requires: sentences is an iterable of lists of tokens, such as
+                  DataLoader.iterLyrics returns; directory, if given, is
+                  where to put the temporary files
+        Modifies: self
+        Effects:  trains the model like trainModel, for corpora that do not
+                  fit in memory: the sentences are read one at a time and
+                  their n-grams counted in a dictionary of at most
+                  maxEntries entries. Whenever it fills up, its counts are
+                  written to a file as a sorted run of (n-gram, count)
+                  records and it starts over. The runs are then merged, in
+                  one pass over all of them, into the records of the trie.
+                  Only the tokens, the dictionary and the finished trie are
+                  ever held in memory.
+        """
+        self.ranked.clear()
+        self.tokens = []
+        self.tokenIds = {}
+        start = 2 if self.n == 1 else 0
+        temporary = tempfile.mkdtemp(dir = directory)
+        try:
+            runs = []
+            counts = {}
+            for sentence in sentences:
+                ids = [self.addToken(token) for token in self.prepData([sentence])[0]]
+                for i in range(start, len(ids) - self.n + 1):
+                    gram = tuple(ids[i:i + self.n])
+                    counts[gram] = counts.get(gram, 0) + 1
+                if len(counts) >= maxEntries:
+                    runs.append(self.writeRun(counts, temporary, len(runs)))
+                    counts = {}
+            runs.append(self.writeRun(counts, temporary, len(runs)))
+            counts = None
+
+            merged = os.path.join(temporary, 'merged')
+            mergeRuns(runs, self.n + 1, merged)
+            records = np.fromfile(merged, np.int64).reshape(-1, self.n + 1)
+            self.packSorted(records[:, :-1], records[:, -1])
+        finally:
+            shutil.rmtree(temporary)
+
+    def writeRun(self, counts, directory, number):
+        """
+        Requires: counts is a dictionary of {n-gram of ids: count}
+        Modifies: the file written
+        Effects:  writes the n-grams of counts in sorted order, each with
+                  its count, as rows of 64-bit integers to a new file in
+                  directory and returns its path.
+        """
+        path = os.path.join(directory, 'run%d' % number)
+        records = [gram + (counts[gram],) for gram in sorted(counts)]
+        np.array(records, np.int64).reshape(-1, self.n + 1).tofile(path)
+        return path
+
+    def findContext(self, sentence):
+        """
+        Requires: sentence is a list of tokens
+        Modifies: nothing
+        Effects:  returns the range (lo, hi) of the last level that holds
+                  the candidates following the last n - 1 tokens of
+                  sentence, or None if the model has not seen them.
+        """
+        lo, hi = 0, len(self.ids[0])
+        if self.n > 1 and len(sentence) < self.n - 1:
+            return None
+        for d in range(self.n - 1):
+            tokenId = self.tokenIds.get(sentence[d - self.n + 1])
+            if tokenId is None:
+                return None
+            pos = lo + np.searchsorted(self.ids[d][lo:hi], tokenId)
+            if pos == hi or self.ids[d][pos] != tokenId:
+                return None
+            lo, hi = self.offsets[d][pos], self.offsets[d][pos + 1]
+        if lo == hi:
+            return None
+        return lo, hi
+
+    def trainingDataHasNGram(self, sentence):
+        """
+        Requires: sentence is a list of strings
+        Modifies: nothing
+        Effects:  returns True if this n-gram model can be used to choose
+                  the next token for the sentence: it has seen the last
+                  n - 1 tokens of sentence followed by some token.
+        """
+        return self.findContext(sentence) is not None
+
+    def getCandidateDictionary(self, sentence):
+        """
+        Requires: sentence is a list of strings, and trainingDataHasNGram
+                  has returned True for it
+        Modifies: nothing
+        Effects:  returns a new dictionary of candidate next tokens and
+                  their counts, with the same contents the dictionary
+                  model of the same order would return.
+        """
+        lo, hi = self.findContext(sentence)
+        return self.candidates(lo, hi)
+
+    def candidates(self, lo, hi):
+        """
+        Requires: lo and hi delimit a range of the last level
+        Modifies: nothing
+        Effects:  returns the {token: count} dictionary of that range.
+        """
+        ids = self.ids[-1][lo:hi].tolist()
+        counts = self.counts[lo:hi].tolist()
+        return dict((self.tokens[i], c) for i, c in zip(ids, counts))
+
+    def iterContexts(self):
+        """
+        Requires: nothing
+        Modifies: nothing
+        Effects:  yields (context, candidates) for every context the model
+                  knows, with context a tuple of its n - 1 tokens, as
+                  BackoffIndex reads them from nested dictionaries.
+        """
+        nodes = [((), 0, 0, len(self.ids[0]))]
+        while nodes:
+            context, d, lo, hi = nodes.pop()
+            if d == self.n - 1:
+                yield context, self.candidates(lo, hi)
+                continue
+            for i in range(lo, hi):
+                nodes.append((context + (self.tokens[self.ids[d][i]],), d + 1,
+                              self.offsets[d][i], self.offsets[d][i + 1]))
+
+    def save(self, directory):
+        """
+        Requires: nothing
+        Modifies: the files in directory
+        Effects:  writes the model to directory: one .npy file per array
+                  and the tokens, pickled.
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(os.path.join(directory, 'tokens.pkl'), 'wb') as f:
+            cPickle.dump((self.n, self.tokens), f, 2)
+        for d in range(self.n):
+            np.save(os.path.join(directory, 'ids%d.npy' % d), self.ids[d])
+        for d in range(self.n - 1):
+            np.save(os.path.join(directory, 'offsets%d.npy' % d), self.offsets[d])
+        np.save(os.path.join(directory, 'counts.npy'), self.counts)
+
+    @staticmethod
+    def load(directory, mmap=True):
+        """
+        Requires: directory holds a model written by save
+        Modifies: nothing
+        Effects:  returns the model. With mmap, the arrays are mapped
+                  read-only from their files instead of read, so loading
+                  takes the same time for any size of model and the pages
+                  are shared between processes that load the same files.
+        """
+        mode = 'r' if mmap else None
+        with open(os.path.join(directory, 'tokens.pkl'), 'rb') as f:
+            n, tokens = cPickle.load(f)
+        model = ArrayTrieModel(n)
+        for token in tokens:
+            model.addToken(token)
+        model.ids = [np.load(os.path.join(directory, 'ids%d.npy' % d), mode)
+                     for d in range(n)]
+        model.offsets = [np.load(os.path.join(directory, 'offsets%d.npy' % d), mode)
+                         for d in range(n - 1)]
+        model.counts = np.load(os.path.join(directory, 'counts.npy'), mode)
+        return model
+
+    def nbytes(self):
+        """
+        Requires: nothing
+        Modifies: nothing
+        Effects:  returns the number of bytes the arrays of the trie take.
+        """
+        return sum(a.nbytes for a in self.ids + self.offsets + [self.counts])
+
+def readRun(path, width, rows=1 << 16):
+    """
+    Requires: path is a file of rows of width 64-bit integers
+    Modifies: nothing
+    Effects:  yields the rows of the file as lists, reading rows of them
+              at a time.
+    """
+    with open(path, 'rb') as f:
+        while True:
+            block = np.fromfile(f, np.int64, rows * width)
+            if not len(block):
+                return
+            for record in block.reshape(-1, width).tolist():
+                yield record
+
+def mergeRuns(paths, width, output, rows=1 << 16):
+    """
+    Requires: paths are files written by ArrayTrieModel.writeRun for
+              n-grams with width - 1 tokens
+    Modifies: the file output
+    Effects:  merges the sorted runs into one sorted run in output, in
+              which records for the same n-gram are added up. Memory holds
+              a block of rows of every run and of the output.
+    """
+    block = []
+    last = None
+    with open(output, 'wb') as f:
+        for record in heapq.merge(*[readRun(path, width, rows) for path in paths]):
+            if last is not None and record[:-1] == last[:-1]:
+                last[-1] += record[-1]
+                continue
+            if last is not None:
+                block.append(last)
+            last = record
+            if len(block) >= rows:
+                np.array(block, np.int64).tofile(f)
+                block = []
+        if last is not None:
+            block.append(last)
+        np.array(block, np.int64).reshape(-1, width).tofile(f)
+
+# -----------------------------------------------------------------------------
+# Testing code ----------------------------------------------------------------
+
+if __name__ == '__main__':
+    import tempfile
+    from trigramModel import *
+    text = [ ['the', 'quick', 'brown', 'fox'], ['the', 'lazy', 'dog'] ]
+    arrayModel = ArrayTrieModel(3)
+    arrayModel.trainModel(text)
+    trigramModel = TrigramModel()
+    trigramModel.trainModel(text)
+    sentence = [ 'the', 'quick' ]
+    print arrayModel.trainingDataHasNGram(sentence)
+    print arrayModel.getCandidateDictionary(sentence)
+    print trigramModel.getCandidateDictionary(sentence)
+    directory = tempfile.mkdtemp()
+    arrayModel.save(directory)
+    print ArrayTrieModel.load(directory).getCandidateDictionary(sentence)
@@ -0,0 +1,246 @@
+import random
+from bisect import bisect_left, bisect_right
+from nGramModel import constrainCandidates, RankedCandidates
+
+END_SYMBOL = '$:::$'
+
+# -----------------------------------------------------------------------------
+# BackoffIndex class ----------------------------------------------------------
+# One trie over the contexts of all n-gram models, so that finding the model
+# to use and drawing the next token takes one walk instead of a
+# trainingDataHasNGram check per model followed by getCandidateDictionary.
+
+class CandidateSampler(object):
+
+    def __init__(self, candidates, model):
+        """
+        Requires: candidates is a dictionary of {token: integer} pairs and
+                  model is the NGramModel it comes from
+        Modifies: self
+        Effects:  precomputes the cumulative counts that weightedChoice
+                  would compute for candidates on every call. The tokens
+                  keep the order in which weightedChoice iterates over
+                  the dictionary.
+
+                  Also precomputes the same table without the end symbol.
+                  weightedChoice draws a number from 0 to the total count,
+                  so a token is drawn with probability count / (total + 1)
+                  and the first one with (count + 1) / (total + 1); the
+                  table keeps these weights for the other tokens, and
+                  endProbability is the chance of drawing the end symbol.
+        """
+        self.candidates = candidates
+        self.model = model
+        self.tokens = list(candidates)
+        self.cumulative = []
+        total = 0
+        for token in self.tokens:
+            total += candidates[token]
+            self.cumulative.append(total)
+
+        self.tokensNoEnd = []
+        self.cumulativeNoEnd = []
+        weight = 0
+        for i, token in enumerate(self.tokens):
+            if token != END_SYMBOL:
+                weight += candidates[token] + (i == 0)
+                self.tokensNoEnd.append(token)
+                self.cumulativeNoEnd.append(weight)
+        self.endProbability = 1. - weight / (total + 1.)
+        self.restricted = {}
+        # for the sampling modes: all candidates and those but the end
+        # symbol, ranked by count once they are needed
+        self.ranked = None
+        self.rankedNoEnd = None
+        # the chance of drawing from the next shorter context instead
+        self.backoffProbability = 0.
+
+    def draw(self, rng=random):
+        """
+        Requires: rng is a random.Random (the random module by default)
+        Modifies: the state of rng
+        Effects:  returns a token chosen like weightedChoice would choose it
+                  from the candidates; for the same random state both return
+                  the same token.
+        """
+        randomNum = rng.randrange(0, self.cumulative[-1] + 1)
+        return self.tokens[bisect_left(self.cumulative, randomNum)]
+
+    def drawNonEnd(self, rng=random, mode=None):
+        """
+        Requires: rng is a random.Random (the random module by default),
+                  there is a candidate other than the end symbol; mode, if
+                  given, is a SamplingMode of nGramModel
+        Modifies: the state of rng, self.rankedNoEnd
+        Effects:  returns a token chosen like draw would choose it, given
+                  that it is not the end symbol, with a single draw. With
+                  mode, it is drawn from the candidates other than the end
+                  symbol as mode describes instead.
+        """
+        if mode is not None:
+            if self.rankedNoEnd is None:
+                self.rankedNoEnd = RankedCandidates(dict((token, self.candidates[token])
+                                                         for token in self.tokensNoEnd))
+            return self.rankedNoEnd.sample(mode, rng)
+        randomNum = rng.randrange(0, self.cumulativeNoEnd[-1])
+        return self.tokensNoEnd[bisect_right(self.cumulativeNoEnd, randomNum)]
+
+    def drawsEnd(self, mode=None):
+        """
+        Requires: mode, if given, is a SamplingMode of nGramModel
+        Modifies: self.ranked
+        Effects:  returns endProbability, or with mode the probability that
+                  the end symbol is drawn from all candidates as mode
+                  describes.
+        """
+        if mode is None:
+            return self.endProbability
+        if self.ranked is None:
+            self.ranked = RankedCandidates(self.candidates)
+        return self.ranked.probability(END_SYMBOL, mode)
+
+    def restrict(self, fits, possiblePitches):
+        """
+        Requires: fits is one of the note filters of nGramModel
+        Modifies: self.restricted
+        Effects:  returns the sampler of the candidates that fit, like the
+                  constrained dictionary getNextNote and its variants build
+                  on every call, or None if no candidate fits. It is built
+                  once per filter and list of pitches.
+        """
+        key = (fits, tuple(possiblePitches))
+        if key not in self.restricted:
+            constrained = constrainCandidates(self.candidates, fits, possiblePitches)
+            self.restricted[key] = CandidateSampler(constrained, self.model) if constrained else None
+        return self.restricted[key]
+
+
+class BackoffIndex(object):
+
+    def __init__(self, models):
+        """
+        Requires: models is a list of trained NGramModel objects sorted by
+                  descending priority: tri-, then bi-, then unigrams
+        Modifies: self
+        Effects:  builds a trie of all contexts the models know, keyed from
+                  the most recent token backwards. Each node is a pair
+                  [sampler, children]; the root holds the unigram sampler,
+                  its children the bigram contexts by last token and their
+                  children the trigram contexts by second to last token.
+                  Models that do not keep nested dictionaries, such as
+                  ArrayTrieModel, give their contexts through iterContexts,
+                  and models that prune their contexts, such as
+                  CompactModel, give the probability of backing off from
+                  each through backoffProbability. The index has to be
+                  rebuilt when a model is retrained.
+        """
+        self.models = models
+        self.root = [None, {}]
+        self.order = 1
+        for model in reversed(models):
+            if hasattr(model, 'iterContexts'):
+                for context, counts in model.iterContexts():
+                    self.addSampler(model, counts, context)
+            else:
+                self.addContexts(model, model.nGramCounts, ())
+
+    def addContexts(self, model, counts, context):
+        """
+        Requires: counts is (part of) the nGramCounts of model, reached by
+                  the keys in context
+        Modifies: self.root, self.order
+        Effects:  adds a sampler for every context in counts to the trie.
+                  Models of higher priority are added last, so their
+                  samplers replace those of lower ones for the same context.
+        """
+        if not counts:
+            return
+        if isinstance(next(iter(counts.values())), dict):
+            for token in counts:
+                self.addContexts(model, counts[token], context + (token,))
+            return
+        self.addSampler(model, counts, context)
+
+    def addSampler(self, model, counts, context):
+        """
+        Requires: counts is the candidate dictionary of model for the tuple
+                  of tokens context
+        Modifies: self.root, self.order
+        Effects:  adds a sampler for counts to the trie, replacing the one
+                  already there for context.
+        """
+        node = self.root
+        for token in reversed(context):
+            if token not in node[1]:
+                node[1][token] = [None, {}]
+            node = node[1][token]
+        node[0] = CandidateSampler(counts, model)
+        if hasattr(model, 'backoffProbability'):
+            node[0].backoffProbability = model.backoffProbability(context)
+        self.order = max(self.order, len(context) + 1)
+
+    def samplers(self, sentence):
+        """
+        Requires: sentence is a list of tokens
+        Modifies: nothing
+        Effects:  returns the samplers of all contexts that end sentence
+                  and that one of the models knows, the longest first and
+                  the unigram sampler last.
+        """
+        node = self.root
+        samplers = [node[0]]
+        for i in range(1, min(self.order, len(sentence) + 1)):
+            node = node[1].get(sentence[-i])
+            if node is None:
+                break
+            if node[0] is not None:
+                samplers.append(node[0])
+        samplers.reverse()
+        return samplers
+
+    def lookup(self, sentence, rng=random):
+        """
+        Requires: sentence is a list of tokens, rng is a random.Random (the
+                  random module by default)
+        Modifies: the state of rng, if a sampler has a backoff probability
+        Effects:  returns the sampler of the longest context that ends
+                  sentence and that one of the models knows. This is the
+                  candidate dictionary of the model selectNGramModel would
+                  choose, found in a single walk. With its
+                  backoffProbability, the sampler of the next shorter
+                  context is returned instead, and so on down.
+        """
+        samplers = self.samplers(sentence)
+        i = 0
+        while i + 1 < len(samplers) and samplers[i].backoffProbability and \
+              rng.random() < samplers[i].backoffProbability:
+            i += 1
+        return samplers[i]
+
+    def getNextToken(self, sentence, rng=random):
+        """
+        Requires: sentence is a list of strings, rng is a random.Random (the
+                  random module by default)
+        Modifies: the state of rng
+        Effects:  returns the next token for sentence, drawn from the
+                  deepest matching context.
+        """
+        return self.lookup(sentence, rng).draw(rng)
+
+
+# -----------------------------------------------------------------------------
+# Testing code ----------------------------------------------------------------
+
+if __name__ == '__main__':
+    from unigramModel import *
+    from bigramModel import *
+    from trigramModel import *
+    text = [ ['the', 'quick', 'brown', 'fox'], ['the', 'lazy', 'dog'] ]
+    models = [TrigramModel(), BigramModel(), UnigramModel()]
+    for model in models:
+        model.trainModel(text)
+    index = BackoffIndex(models)
+    print index.lookup(['^::^', '^:::^']).candidates
+    print index.lookup(['the', 'quick']).candidates
+    print index.lookup(['lazy', 'quick']).candidates
+    print index.getNextToken(['quick', 'brown'])
@@ -19,6 +19,7 @@ class BigramModel(NGramModel):
                   constructor.
         """
         super(BigramModel, self).__init__()
+        self.n = 2
 
     def trainModel(self, text):
         """
@@ -36,6 +37,8 @@ class BigramModel(NGramModel):
                   self.nGramCounts. For more details, see the spec.
         """
         
+        # the rankings of the old counts would be stale
+        self.ranked.clear()
         # builds a dictionary of potential bigrams and their counts
         text = self.prepData(text)
         for sentence in text:
@@ -0,0 +1,322 @@
+import math
+import numpy as np
+from nGramModel import *
+
+# -----------------------------------------------------------------------------
+# CompactModel class ----------------------------------------------------------
+# A trained n-gram model made small for shipping: continuations that are
+# rarely drawn are pruned, and the remaining counts are kept as quantized
+# logarithms in NumPy arrays. What was pruned from a context becomes its
+# probability of backing off: a token is drawn from the model one order down
+# with that probability, as in Katz backoff, so the pruned continuations can
+# still come up through it.
+
+def modelContexts(model):
+    """
+    Requires: model is a trained n-gram model
+    Modifies: nothing
+    Effects:  yields (context, candidates) for every context of model, with
+              context a tuple of tokens, from its iterContexts or from its
+              nested nGramCounts dictionaries.
+    """
+    if hasattr(model, 'iterContexts'):
+        for item in model.iterContexts():
+            yield item
+        return
+    contexts = [((), model.nGramCounts)]
+    while contexts:
+        context, counts = contexts.pop()
+        if counts and isinstance(next(iter(counts.values())), dict):
+            for token in counts:
+                contexts.append((context + (token,), counts[token]))
+        elif counts:
+            yield context, counts
+
+def probabilityOf(model, sentence, token):
+    """
+    Requires: model is an n-gram model, sentence a list of tokens
+    Modifies: nothing
+    Effects:  returns the probability that model draws token after
+              sentence, ignoring the extra chance weightedChoice gives its
+              first candidate; 0 if the model cannot be used for sentence.
+    """
+    if hasattr(model, 'probability'):
+        return model.probability(sentence, token)
+    if not model.trainingDataHasNGram(sentence):
+        return 0.
+    counts = model.getCandidateDictionary(sentence)
+    return counts.get(token, 0) / float(sum(counts.values()))
+
+class CompactModel(NGramModel):
+
+    def __init__(self, model, minCount=2, maxCandidates=None, bits=8, backoff=None):
+        """
+        Requires: model is a trained n-gram model; bits is 8 or 16;
+                  backoff, if given, is the model of one order lower
+        Modifies: self
+        Effects:  keeps the candidates of every context of model that were
+                  seen at least minCount times, and of those the
+                  maxCandidates most frequent ones, if given. The count of
+                  what was pruned from a context stays with it as the mass
+                  of its backoff probability; contexts left without
+                  candidates are dropped, so the model of one order lower
+                  is used for them. Counts and
+                  masses are stored as round(log(count) / step) in unsigned
+                  integers of the given bits, step chosen so that the
+                  largest fits.
+        """
+        super(CompactModel, self).__init__()
+        self.backoff = backoff
+        self.tokens = []
+        self.tokenIds = {}
+        self.n = 1
+        dtype = {8: np.uint8, 16: np.uint16}[bits]
+
+        kept = []
+        for context, candidates in modelContexts(model):
+            self.n = len(context) + 1
+            ordered = sorted(candidates.items(), key=lambda item: -item[1])
+            frequent = [item for item in ordered if item[1] >= minCount][:maxCandidates]
+            if frequent:
+                pruned = sum(candidates.values()) - sum(count for token, count in frequent)
+                kept.append((context, frequent, pruned))
+                for token in context + tuple(token for token, count in frequent):
+                    self.addToken(token)
+        self.radix = max(len(self.tokens), 1)
+        assert self.radix ** max(self.n - 1, 1) < 2 ** 62
+
+        largest = max([count for context, frequent, pruned in kept
+                       for token, count in frequent] + [pruned for context, frequent, pruned in kept] + [2])
+        self.step = math.log(largest) / (2 ** bits - 1)
+        keys = []
+        indptr = [0]
+        candidateIds = []
+        counts = []
+        masses = []
+        for context, frequent, pruned in kept:
+            keys.append(self.contextKey(context))
+            candidateIds.extend(self.tokenIds[token] for token, count in frequent)
+            counts.extend(count for token, count in frequent)
+            indptr.append(len(candidateIds))
+            masses.append(pruned)
+        order = np.argsort(np.array(keys, np.int64))
+        self.keys = np.array(keys, np.int64)[order]
+        self.rows = order.astype(np.uint32)
+        self.indptr = np.array(indptr, np.uint32)
+        self.candidateIds = np.array(candidateIds, np.uint32)
+        self.logCounts = self.quantize(counts, dtype)
+        # a mass of m is stored as the log of m + 1, so that 0 means none
+        self.logMasses = self.quantize(np.array(masses) + 1, dtype)
+
+    def __str__(self):
+        return 'This is a CompactModel object of order %d' % self.n
+
+    def addToken(self, token):
+        """
+        Requires: nothing
+        Modifies: self.tokens, self.tokenIds
+        Effects:  returns the id of token, giving it the next free id if it
+                  does not have one yet.
+        """
+        if token not in self.tokenIds:
+            self.tokenIds[token] = len(self.tokens)
+            self.tokens.append(token)
+        return self.tokenIds[token]
+
+    def contextKey(self, context):
+        key = 0
+        for i, token in enumerate(reversed(context)):
+            key += self.tokenIds[token] * self.radix ** i
+        return key
+
+    def quantize(self, counts, dtype):
+        return np.round(np.log(np.array(counts, np.float64).reshape(-1)) / self.step).astype(dtype)
+
+    def dequantize(self, logCounts):
+        return np.exp(logCounts * self.step)
+
+    def findRow(self, sentence):
+        """
+        Requires: sentence is a list of tokens
+        Modifies: nothing
+        Effects:  returns the row of the context of sentence, or None if
+                  it was dropped or never seen.
+        """
+        context = tuple(sentence[len(sentence) - self.n + 1:]) if self.n > 1 else ()
+        if len(context) != self.n - 1 or not len(self.keys):
+            return None
+        if any(token not in self.tokenIds for token in context):
+            return None
+        key = self.contextKey(context)
+        pos = np.searchsorted(self.keys, key)
+        if pos == len(self.keys) or self.keys[pos] != key:
+            return None
+        return int(self.rows[pos])
+
+    def trainingDataHasNGram(self, sentence):
+        """
+        Requires: sentence is a list of tokens
+        Modifies: nothing
+        Effects:  returns True if the context of sentence was kept.
+        """
+        return self.findRow(sentence) is not None
+
+    def row(self, sentence):
+        """
+        Requires: sentence is a list of tokens whose context was kept
+        Modifies: nothing
+        Effects:  returns the ids of the candidates of its context, their
+                  counts and the pruned mass, dequantized.
+        """
+        row = self.findRow(sentence)
+        lo, hi = self.indptr[row], self.indptr[row + 1]
+        mass = self.dequantize(self.logMasses[row]) - 1
+        return self.candidateIds[lo:hi], self.dequantize(self.logCounts[lo:hi]), mass
+
+    def backoffProbability(self, context):
+        """
+        Requires: context is a tuple of tokens that was kept
+        Modifies: nothing
+        Effects:  returns the share of the pruned mass in the context, the
+                  probability with which BackoffIndex draws from the model
+                  one order lower instead; 0 without a backoff model.
+        """
+        if self.backoff is None:
+            return 0.
+        ids, counts, mass = self.row(list(context))
+        mass = round(mass)
+        return mass / (counts.sum() + mass)
+
+    def probability(self, sentence, token):
+        """
+        Requires: sentence is a list of tokens
+        Modifies: nothing
+        Effects:  returns the probability of token after sentence: its share
+                  of the kept counts, plus the backoff probability times
+                  its probability under the backoff model. Where the
+                  context was dropped, this is its probability under the
+                  backoff model.
+        """
+        if self.findRow(sentence) is None:
+            if self.backoff is None:
+                return 0.
+            return probabilityOf(self.backoff, sentence, token)
+        ids, counts, mass = self.row(sentence)
+        p = 0.
+        if token in self.tokenIds:
+            p = counts[ids == self.tokenIds[token]].sum() / counts.sum()
+        beta = self.backoffProbability(tuple(sentence))
+        if beta:
+            p = (1 - beta) * p + beta * probabilityOf(self.backoff, sentence, token)
+        return p
+
+    def getCandidateDictionary(self, sentence):
+        """
+        Requires: sentence is a list of tokens, and trainingDataHasNGram
+                  has returned True for it
+        Modifies: nothing
+        Effects:  returns the kept candidates of the context of sentence
+                  with their dequantized counts, rounded to whole numbers.
+        """
+        ids, counts, mass = self.row(sentence)
+        return dict((self.tokens[i], max(int(round(c)), 1))
+                    for i, c in zip(ids.tolist(), counts.tolist()))
+
+    def iterContexts(self):
+        """
+        Requires: nothing
+        Modifies: nothing
+        Effects:  yields (context, candidates) for every kept context, as
+                  BackoffIndex reads them.
+        """
+        for key in self.keys.tolist():
+            context = []
+            for i in range(self.n - 1):
+                context.append(self.tokens[key % self.radix])
+                key //= self.radix
+            context = tuple(reversed(context))
+            yield context, self.getCandidateDictionary(list(context))
+
+    def nbytes(self):
+        """
+        Requires: nothing
+        Modifies: nothing
+        Effects:  returns the number of bytes the arrays take.
+        """
+        return sum(a.nbytes for a in (self.keys, self.rows, self.indptr,
+                   self.candidateIds, self.logCounts, self.logMasses))
+
+def compact(model, minCount=2, maxCandidates=None, bits=8, backoff=None):
+    """
+    Requires: see CompactModel
+    Modifies: nothing
+    Effects:  returns the CompactModel of model and a report on it: the
+              number of n-grams before and after, the bytes of its
+              arrays, and the KL divergence of its next-token distribution
+              from model's, averaged over contexts weighted by their
+              counts. Without a backoff model, pruning makes the KL
+              divergence infinite.
+    """
+    compactModel = CompactModel(model, minCount, maxCandidates, bits, backoff)
+    entries = 0
+    divergence = 0.
+    total = 0
+    for context, candidates in modelContexts(model):
+        entries += len(candidates)
+        count = float(sum(candidates.values()))
+        kl = 0.
+        for token, c in candidates.items():
+            q = compactModel.probability(list(context), token)
+            if q <= 0.:
+                kl = float('inf')
+                break
+            kl += c / count * math.log(c / count / q)
+        divergence += count * kl
+        total += count
+    report = {'entries': entries,
+              'keptEntries': len(compactModel.candidateIds),
+              'bytes': compactModel.nbytes(),
+              'kl': divergence / max(total, 1)}
+    return compactModel, report
+
+def compactModels(models, minCount=2, maxCandidates=None, bits=8):
+    """
+    Requires: models is a list of trained models sorted by descending
+              order, ending with a unigram model
+    Modifies: nothing
+    Effects:  returns the list of compacted models and the list of their
+              reports, compacting from the lowest order up so that each
+              model backs off to the compacted model below it. The
+              unigram model has nothing to back off to and is only
+              quantized.
+    """
+    compacted = []
+    reports = []
+    backoff = None
+    for model in reversed(models):
+        if backoff is None:
+            backoff, report = compact(model, 1, None, bits)
+        else:
+            backoff, report = compact(model, minCount, maxCandidates, bits, backoff)
+        compacted.insert(0, backoff)
+        reports.insert(0, report)
+    return compacted, reports
+
+# -----------------------------------------------------------------------------
+# Testing code ----------------------------------------------------------------
+
+if __name__ == '__main__':
+    from unigramModel import *
+    from bigramModel import *
+    from trigramModel import *
+    text = [ ['the', 'quick', 'brown', 'fox'], ['the', 'lazy', 'dog'],
+             ['the', 'quick', 'brown', 'cat'], ['the', 'quick', 'red', 'fox'] ]
+    models = [TrigramModel(), BigramModel(), UnigramModel()]
+    for model in models:
+        model.trainModel(text)
+    compacted, reports = compactModels(models)
+    for report in reports:
+        print report
+    print compacted[0].getCandidateDictionary(['the', 'quick'])
+    print compacted[0].backoffProbability(('the', 'quick'))
+    print compacted[0].probability(['the', 'quick'], 'red')
@@ -0,0 +1,350 @@
+import numpy as np
+from collections import OrderedDict
+from nGramModel import *
+from unigramModel import *
+from bigramModel import *
+from trigramModel import *
+from backoffIndex import BackoffIndex
+
+# -----------------------------------------------------------------------------
+# Key detection ---------------------------------------------------------------
+# The key of a song is found from how often it plays each of the twelve pitch
+# classes: the histograms of all songs are scored against a profile of every
+# key in KEY_SIGNATURES at once, and each song gets the key that scores
+# highest. A profile counts the tones of the scale, and its tonic twice, so
+# that a major key and its relative minor, which share their tones, are told
+# apart by the note the song comes back to.
+
+# pitch class of every pitch name, with its enharmonic spellings
+PITCH_CLASSES = {'c': 0, 'b#': 0, 'c#': 1, 'db': 1, 'd': 2, 'd#': 3, 'eb': 3,
+                 'e': 4, 'fb': 4, 'f': 5, 'e#': 5, 'f#': 6, 'gb': 6, 'g': 7,
+                 'g#': 8, 'ab': 8, 'a': 9, 'a#': 10, 'bb': 10, 'b': 11, 'cb': 11}
+
+# how much more the tonic of a key weighs in its profile than its other tones
+TONIC_WEIGHT = 2.
+
+def keyProfiles(keys=KEY_SIGNATURES):
+    """
+    Requires: keys is a dictionary of {key name: list of pitch names} with
+              the tonic first, such as KEY_SIGNATURES
+    Modifies: nothing
+    Effects:  returns the sorted key names and an array with one row of
+              twelve pitch class weights for each of them.
+    """
+    names = sorted(keys)
+    profiles = np.zeros((len(names), 12))
+    for i, name in enumerate(names):
+        for pitch in keys[name]:
+            profiles[i, PITCH_CLASSES[pitch]] = 1.
+        profiles[i, PITCH_CLASSES[keys[name][0]]] = TONIC_WEIGHT
+    return names, profiles
+
+def pitchClassHistograms(songs):
+    """
+    Requires: songs is a list of lists of PySynth tuples
+    Modifies: nothing
+    Effects:  returns an array with one row per song of the share of its
+              notes in each of the twelve pitch classes; all zeros for a
+              song without notes. Pitch names that are not known count
+              for no class.
+    """
+    lengths = np.array([len(song) for song in songs], np.int64)
+    if not lengths.sum():
+        return np.zeros((len(songs), 12))
+    names = np.array([note[0][:-1] for song in songs for note in song])
+    unique, inverse = np.unique(names, return_inverse = True)
+    classes = np.array([PITCH_CLASSES.get(name, -1) for name in unique])[inverse]
+    songIds = np.repeat(np.arange(len(songs)), lengths)
+    known = classes >= 0
+    counts = np.bincount(songIds[known] * 12 + classes[known],
+                         minlength = len(songs) * 12).reshape(len(songs), 12)
+    return counts / np.maximum(counts.sum(axis = 1), 1.)[:, None]
+
+def detectKeys(songs, keys=KEY_SIGNATURES):
+    """
+    Requires: songs is a list of lists of PySynth tuples, keys as for
+              keyProfiles
+    Modifies: nothing
+    Effects:  returns the name of the key of every song, the one whose
+              profile scores highest against its pitch class histogram;
+              for a song without notes, the first key name.
+    """
+    names, profiles = keyProfiles(keys)
+    scores = pitchClassHistograms(songs).dot(profiles.T)
+    return [names[i] for i in scores.argmax(axis = 1)]
+
+# -----------------------------------------------------------------------------
+# Transposed training ---------------------------------------------------------
+# Training on every song in all twelve keys without making twelve copies of
+# the songs: each note becomes the id of its (pitch class, octave, duration),
+# so a transposition is an addition to the ids, and the n-grams of all
+# transpositions are counted together with NumPy in one pass over the songs.
+# Transposed notes are spelled the way the songs spell each pitch class most
+# often, and kept within the octaves formatPitch keeps them in.
+
+# the semitones songs are shifted by, from a fourth down to a tritone up
+TRANSPOSITIONS = range(-5, 7)
+
+LOWEST_OCTAVE = 1
+HIGHEST_OCTAVE = 7
+
+def noteIds(songs, offsets=None):
+    """
+    Requires: songs is a list of lists of PySynth tuples whose pitches are
+              names of PITCH_CLASSES followed by an octave digit; offsets,
+              if given, is a list of semitones to shift each song by
+    Modifies: nothing
+    Effects:  returns the semitone of every note of songs, counted from
+              octave 0 and shifted by the offset of its song, the index of
+              its duration in the sorted list of durations, that list,
+              and the spelling of every pitch class, the one songs use
+              most often.
+    """
+    lengths = [len(song) for song in songs]
+    names = np.array([note[0][:-1] for song in songs for note in song])
+    octaves = np.array([int(note[0][-1]) for song in songs for note in song], np.int64)
+    unique, inverse, counts = np.unique(names, return_inverse = True, return_counts = True)
+    classes = np.array([PITCH_CLASSES[name] for name in unique], np.int64)
+    spellings = {}
+    for name, pitchClass, count in sorted(zip(unique.tolist(), classes.tolist(), counts.tolist()),
+                                          key = lambda item: item[2]):
+        spellings[pitchClass] = name
+    spelling = [spellings.get(pitchClass, name) for pitchClass, name in
+                enumerate(['c', 'c#', 'd', 'eb', 'e', 'f', 'f#', 'g', 'g#', 'a', 'bb', 'b'])]
+    semitones = octaves * 12 + classes[inverse]
+    if offsets is not None:
+        semitones += np.repeat(np.array(offsets, np.int64), lengths)
+    durations, durationIds = np.unique([note[1] for song in songs for note in song],
+                                       return_inverse = True)
+    return semitones, durationIds, durations.tolist(), spelling
+
+def transposedCounts(songs, shifts=TRANSPOSITIONS, offsets=None):
+    """
+    Requires: songs as for noteIds, shifts a list of semitones, offsets as
+              for noteIds
+    Modifies: nothing
+    Effects:  returns the nGramCounts a trigram, a bigram and a unigram
+              model would have after training on every song shifted by
+              its offset and then by each of shifts, without making those
+              copies.
+    """
+    counts = [{}, {}, {}]
+    songs = [song for song in songs if song]
+    if not songs:
+        return counts
+    semitones, durationIds, durations, spelling = noteIds(songs, offsets)
+
+    # ids 0, 1 and 2 are the symbols of prepData, then notes by semitone
+    # and duration
+    tokens = ['^::^', '^:::^', '$:::$']
+    for semitone in range((HIGHEST_OCTAVE + 1) * 12):
+        for duration in durations:
+            tokens.append((spelling[semitone % 12] + str(semitone // 12), duration))
+    vocabulary = len(tokens)
+
+    # every song as it is in prepData, one after the other
+    lengths = np.array([len(song) for song in songs], np.int64)
+    starts = np.cumsum(lengths + 3) - lengths - 3
+    stream = np.zeros(len(semitones) + 3 * len(songs), np.int64)
+    stream[starts + 1] = 1
+    stream[starts + lengths + 2] = 2
+    notes = np.ones(len(stream), bool)
+    notes[starts] = notes[starts + 1] = notes[starts + lengths + 2] = False
+
+    # the stream of every shift, with the shift added to the note semitones
+    shifted = semitones[None, :] + np.array(shifts, np.int64)[:, None]
+    shifted = np.clip(shifted // 12, LOWEST_OCTAVE, HIGHEST_OCTAVE) * 12 + shifted % 12
+    streams = np.tile(stream, (len(shifts), 1))
+    streams[:, notes] = 3 + shifted * len(durations) + durationIds
+
+    # an n-gram starts at every token but the last n - 1 of each song
+    ends = np.zeros(len(stream), bool)
+    ends[starts + lengths + 2] = True
+    grams = []
+    for n in (3, 2, 1):
+        if n == 1:
+            # the unigram model only counts what follows the start symbols
+            first = notes | ends
+        else:
+            first = ~ends
+            for i in range(1, n - 1):
+                first[:-i] &= ~ends[i:]
+        positions = np.flatnonzero(first)
+        key = streams[:, positions]
+        for i in range(1, n):
+            key = key * vocabulary + streams[:, positions + i]
+        grams.append(np.unique(key, return_counts = True))
+
+    for table, (keys, gramCounts), n in zip(counts, grams, (3, 2, 1)):
+        for key, count in zip(keys.tolist(), gramCounts.tolist()):
+            ids = []
+            for i in range(n):
+                key, tokenId = divmod(key, vocabulary)
+                ids.append(tokenId)
+            node = table
+            for tokenId in reversed(ids[1:]):
+                node = node.setdefault(tokens[tokenId], {})
+            node[tokens[ids[0]]] = count
+    return counts
+
+def trainTransposedModels(songs, shifts=TRANSPOSITIONS, offsets=None):
+    """
+    Requires: see transposedCounts
+    Modifies: nothing
+    Effects:  returns a list of a trigram, a bigram and a unigram model
+              with the counts of transposedCounts, in that order.
+    """
+    models = [TrigramModel(), BigramModel(), UnigramModel()]
+    for model, counts in zip(models, transposedCounts(songs, shifts, offsets)):
+        model.nGramCounts = counts
+    return models
+
+# -----------------------------------------------------------------------------
+# KeyedMusicModels class ------------------------------------------------------
+# Music models partitioned by key: the songs are indexed by their detected
+# key, and the models of a key are trained on its songs only and keep only
+# the candidates that fit it, so generating in that key needs no filter. The
+# models of a key are built the first time they are asked for, and only the
+# last few are kept.
+
+def keepInKey(counts, possiblePitches):
+    """
+    Requires: counts is the nGramCounts dictionary of a trained model
+    Modifies: nothing
+    Effects:  returns a copy of counts with only the candidates noteFits
+              accepts for possiblePitches. Contexts with a note that does
+              not fit, which generating in key never reaches, and contexts
+              left without candidates are dropped.
+    """
+    if counts and isinstance(next(iter(counts.values())), dict):
+        kept = {}
+        for token in counts:
+            if token not in ('^::^', '^:::^') and not noteFits(token, possiblePitches):
+                continue
+            candidates = keepInKey(counts[token], possiblePitches)
+            if candidates:
+                kept[token] = candidates
+        return kept
+    return constrainCandidates(counts, noteFits, possiblePitches)
+
+class KeyedMusicModels(object):
+
+    def __init__(self, songs, scales=None, minSongs=5, cacheSize=4, transpose=False):
+        """
+        Requires: songs is a list of lists of PySynth tuples; scales, if
+                  given, is a dictionary of {key name: list of pitch
+                  names}, KEY_SIGNATURES and OTHER_KEY by default
+        Modifies: self
+        Effects:  detects the key of every song and indexes the songs by
+                  key and by mode. The models of the last cacheSize keys
+                  asked for are kept. With transpose, the models of a key
+                  of KEY_SIGNATURES are trained on all songs of its mode,
+                  each transposed into that key.
+        """
+        if scales is None:
+            scales = dict(KEY_SIGNATURES)
+            scales.update(OTHER_KEY)
+        self.songs = songs
+        self.scales = scales
+        self.minSongs = minSongs
+        self.transpose = transpose
+        self.keys = detectKeys(songs)
+        self.byKey = {}
+        self.byMode = {}
+        for i, key in enumerate(self.keys):
+            self.byKey.setdefault(key, []).append(i)
+            self.byMode.setdefault(key.split()[-1], []).append(i)
+        self.cacheSize = cacheSize
+        self.loaded = OrderedDict()
+
+    def __str__(self):
+        return 'This is a KeyedMusicModels object of %d songs in %d keys' % \
+               (len(self.songs), len(self.byKey))
+
+    def songsFor(self, keyName):
+        """
+        Requires: nothing
+        Modifies: nothing
+        Effects:  returns the indexes of the songs to train the models of
+                  keyName on: the songs in that key, or if there are fewer
+                  than minSongs of them, the songs in its mode, or else
+                  all songs.
+        """
+        songs = self.byKey.get(keyName, [])
+        if len(songs) < self.minSongs:
+            songs = self.byMode.get(keyName.split()[-1], [])
+        if len(songs) < self.minSongs:
+            songs = range(len(self.songs))
+        return songs
+
+    def transposedSongsFor(self, keyName):
+        """
+        Requires: keyName is a key of KEY_SIGNATURES
+        Modifies: nothing
+        Effects:  returns the indexes of the songs in the mode of keyName
+                  and the semitones, from a fourth down to a tritone up,
+                  that move the tonic of each onto the tonic of keyName.
+        """
+        songs = self.byMode.get(keyName.split()[-1], [])
+        tonic = PITCH_CLASSES[KEY_SIGNATURES[keyName][0]]
+        offsets = [(tonic - PITCH_CLASSES[KEY_SIGNATURES[self.keys[i]][0]] + 5) % 12 - 5
+                   for i in songs]
+        return songs, offsets
+
+    def index(self, keyName):
+        """
+        Requires: keyName is a key of self.scales
+        Modifies: self.loaded
+        Effects:  returns the BackoffIndex of a trigram, a bigram and a
+                  unigram model trained on the songs of keyName, or with
+                  transpose on those of transposedSongsFor, each
+                  keeping only the candidates that fit its pitches. They
+                  are trained the first time; the least recently used are
+                  dropped once more than cacheSize keys are loaded. The
+                  index is kept here rather than by getBackoffIndex, so
+                  that dropped models are freed.
+        """
+        if keyName in self.loaded:
+            index = self.loaded.pop(keyName)
+        else:
+            songs, offsets = [], None
+            if self.transpose and keyName in KEY_SIGNATURES:
+                songs, offsets = self.transposedSongsFor(keyName)
+            if len(songs) >= self.minSongs:
+                models = trainTransposedModels([self.songs[i] for i in songs], [0], offsets)
+            else:
+                models = [TrigramModel(), BigramModel(), UnigramModel()]
+                for model in models:
+                    model.trainModel([self.songs[i] for i in self.songsFor(keyName)])
+            for model in models:
+                model.nGramCounts = keepInKey(model.nGramCounts, self.scales[keyName])
+            index = BackoffIndex(models)
+            if len(self.loaded) >= self.cacheSize:
+                self.loaded.popitem(last = False)
+        self.loaded[keyName] = index
+        return index
+
+    def models(self, keyName):
+        """
+        Requires: keyName is a key of self.scales
+        Modifies: self.loaded
+        Effects:  returns the list of models index(keyName) is built on,
+                  in order of tri-, then bi-, then unigramModel objects.
+        """
+        return self.index(keyName).models
+
+# -----------------------------------------------------------------------------
+# Testing code ----------------------------------------------------------------
+
+if __name__ == '__main__':
+    scale = KEY_SIGNATURES['g major']
+    song = [(pitch + '4', 4) for pitch in scale + [scale[0], scale[4], scale[0]]]
+    relative = [(pitch + '4', 4) for pitch in ['e', 'g', 'b', 'e', 'a', 'e', 'd', 'c', 'e']]
+    print detectKeys([song, relative, []])
+    keyed = KeyedMusicModels([song, relative], minSongs = 1)
+    print keyed
+    print keyed.models('g major')[2].nGramCounts
+    print keyed.models('c major')[1].nGramCounts
+    print transposedCounts([song[:3]], [0, 2])[2]
+    keyed = KeyedMusicModels([song, relative], minSongs = 1, transpose = True)
+    print keyed.models('a major')[2].nGramCounts
@@ -0,0 +1,390 @@
+import random
+import numpy as np
+from nGramModel import *
+from backoffIndex import END_SYMBOL
+
+# -----------------------------------------------------------------------------
+# KneserNeyModel class --------------------------------------------------------
+# An interpolated Kneser-Ney model: instead of backing off only where a
+# context was never seen, every context gives up a share of its probability,
+# gamma, to the next shorter one, and the shorter contexts count how many
+# different tokens came before an n-gram rather than how often it occurred.
+#
+# Level k holds the n-grams of k tokens, grouped by their context of k - 1
+# tokens, in flat arrays: sorted context keys, the candidates of each context
+# in CSR form with the cumulative discounted weights, and gamma per context.
+# Drawing a token finds the context of each level with one binary search,
+# picks the level with one random number and the token with another.
+
+START_SYMBOLS = ('^::^', '^:::^')
+
+class KneserNeyLevel(object):
+
+    def __init__(self, grams, counts, discount, radix, endId):
+        """
+        Requires: grams is an array of distinct n-grams of k token ids, one
+                  per row, sorted lexicographically, with their positive
+                  counts; 0 <= discount < 1; every id is below radix
+        Modifies: self
+        Effects:  groups the n-grams by context and stores, for the
+                  context of row i, the key keys[i], the candidates
+                  candidateIds[indptr[i]:indptr[i + 1]] in ascending order
+                  with their counts minus discount as weights, cumulated
+                  over all rows from base[i], their total totals[i], the
+                  share gamma[i] = discount * candidates / count given to
+                  the shorter context, and where the end symbol is among
+                  the candidates: its weight endWeights[i] and the weight
+                  of the candidates before it, endBefore[i].
+        """
+        k = grams.shape[1]
+        contexts = grams[:, :k - 1]
+        self.keys = np.zeros(len(grams), np.int64)
+        for j in range(k - 1):
+            self.keys = self.keys * radix + contexts[:, j]
+        starts = np.flatnonzero(np.concatenate(([True], self.keys[1:] != self.keys[:-1])))
+        self.keys = self.keys[starts]
+        self.indptr = np.append(starts, len(grams))
+        self.candidateIds = grams[:, k - 1]
+
+        self.discount = discount
+        weights = counts - float(discount)
+        self.cumulative = np.cumsum(weights)
+        ends = np.concatenate(([0.], self.cumulative))[self.indptr]
+        self.base = ends[:-1]
+        self.totals = np.diff(ends)
+        sizes = np.diff(self.indptr)
+        self.gamma = discount * sizes / np.add.reduceat(counts.astype(np.float64), starts)
+
+        rows = np.repeat(np.arange(len(starts)), sizes)
+        isEnd = self.candidateIds == endId
+        self.endWeights = np.zeros(len(starts))
+        self.endWeights[rows[isEnd]] = weights[isEnd]
+        self.endBefore = np.zeros(len(starts))
+        self.endBefore[rows[isEnd]] = (self.cumulative - weights)[isEnd] - self.base[rows[isEnd]]
+
+    def findRow(self, key):
+        """
+        Requires: key is a context key
+        Modifies: nothing
+        Effects:  returns the row of the context, or None if it is not
+                  known at this level.
+        """
+        pos = int(np.searchsorted(self.keys, key))
+        if pos == len(self.keys) or self.keys[pos] != key:
+            return None
+        return pos
+
+    def weight(self, row, tokenId):
+        """
+        Requires: row is a row of this level
+        Modifies: nothing
+        Effects:  returns the discounted weight of tokenId in row, 0 if it
+                  is not a candidate there.
+        """
+        lo, hi = self.indptr[row], self.indptr[row + 1]
+        pos = lo + int(np.searchsorted(self.candidateIds[lo:hi], tokenId))
+        if pos == hi or self.candidateIds[pos] != tokenId:
+            return 0.
+        before = self.cumulative[pos - 1] if pos > 0 else 0.
+        return self.cumulative[pos] - before
+
+    def draw(self, row, uniform, noEnd=False):
+        """
+        Requires: row is a row of this level, uniform is in [0, 1)
+        Modifies: nothing
+        Effects:  returns the candidate of row at uniform of its total
+                  weight, leaving out the end symbol if noEnd.
+        """
+        total = self.totals[row]
+        if noEnd:
+            total -= self.endWeights[row]
+        randomNum = uniform * total
+        if noEnd and self.endWeights[row] and randomNum >= self.endBefore[row]:
+            randomNum += self.endWeights[row]
+        pos = int(np.searchsorted(self.cumulative, self.base[row] + randomNum, 'right'))
+        return self.candidateIds[min(pos, self.indptr[row + 1] - 1)]
+
+
+class KneserNeySampler(object):
+
+    def __init__(self, model, chain):
+        """
+        Requires: chain is what model.chain returns for a sentence
+        Modifies: self
+        Effects:  precomputes how likely each level of chain is to give
+                  the next token, with and without the end symbol, so that
+                  the generators can use it like a CandidateSampler.
+        """
+        self.model = model
+        self.chain = chain
+        self.ranked = None
+        self.rankedNoEnd = None
+        reach = 1.
+        self.masses = []
+        self.massesNoEnd = []
+        self.endProbability = 0.
+        for level, row in chain:
+            gamma = level.gamma[row]
+            end = level.endWeights[row] / level.totals[row]
+            mass = reach * (1 - gamma)
+            self.masses.append(mass)
+            self.massesNoEnd.append(mass * (1 - end))
+            self.endProbability += mass * end
+            reach *= gamma
+
+    def pick(self, masses, rng):
+        randomNum = rng.random() * sum(masses)
+        for i, mass in enumerate(masses):
+            randomNum -= mass
+            if randomNum < 0:
+                return i
+        return len(masses) - 1
+
+    def draw(self, rng=random):
+        """
+        Requires: rng is a random.Random (the random module by default)
+        Modifies: the state of rng
+        Effects:  returns a token drawn from the interpolated distribution.
+        """
+        level, row = self.chain[self.pick(self.masses, rng)]
+        return self.model.tokens[level.draw(row, rng.random())]
+
+    def candidates(self):
+        """
+        Requires: nothing
+        Modifies: nothing
+        Effects:  returns a dictionary of every token draw can return and
+                  its interpolated probability.
+        """
+        probabilities = np.zeros(len(self.model.tokens))
+        for (level, row), mass in zip(self.chain, self.masses):
+            lo, hi = level.indptr[row], level.indptr[row + 1]
+            weights = np.diff(np.concatenate(([level.base[row]], level.cumulative[lo:hi])))
+            probabilities[level.candidateIds[lo:hi]] += mass * weights / level.totals[row]
+        return dict((self.model.tokens[i], probabilities[i])
+                    for i in np.flatnonzero(probabilities > 0).tolist())
+
+    def drawNonEnd(self, rng=random, mode=None):
+        """
+        Requires: rng is a random.Random (the random module by default),
+                  endProbability < 1; mode, if given, is a SamplingMode of
+                  nGramModel
+        Modifies: the state of rng, self.rankedNoEnd
+        Effects:  returns a token drawn like draw, given that it is not the
+                  end symbol. With mode, it is drawn from the interpolated
+                  probabilities of the other tokens as mode describes
+                  instead.
+        """
+        if mode is not None:
+            if self.rankedNoEnd is None:
+                candidates = self.candidates()
+                candidates.pop(END_SYMBOL, None)
+                self.rankedNoEnd = RankedCandidates(candidates)
+            return self.rankedNoEnd.sample(mode, rng)
+        level, row = self.chain[self.pick(self.massesNoEnd, rng)]
+        return self.model.tokens[level.draw(row, rng.random(), True)]
+
+    def drawsEnd(self, mode=None):
+        """
+        Requires: mode, if given, is a SamplingMode of nGramModel
+        Modifies: self.ranked
+        Effects:  returns endProbability, or with mode the probability that
+                  the end symbol is drawn from the interpolated
+                  probabilities as mode describes.
+        """
+        if mode is None:
+            return self.endProbability
+        if self.ranked is None:
+            self.ranked = RankedCandidates(self.candidates())
+        return self.ranked.probability(END_SYMBOL, mode)
+
+
+class KneserNeyModel(NGramModel):
+
+    def __init__(self, n=3):
+        """
+        Requires: n >= 1 is the order of the model
+        Modifies: self
+        Effects:  sets up an empty model. self.nGramCounts stays empty.
+        """
+        super(KneserNeyModel, self).__init__()
+        self.n = n
+        self.tokens = []
+        self.tokenIds = {}
+        self.levels = []
+
+    def __str__(self):
+        return 'This is a KneserNeyModel object of order %d' % self.n
+
+    def addToken(self, token):
+        """
+        Requires: nothing
+        Modifies: self.tokens, self.tokenIds
+        Effects:  returns the id of token, giving it the next free id if it
+                  does not have one yet.
+        """
+        if token not in self.tokenIds:
+            self.tokenIds[token] = len(self.tokens)
+            self.tokens.append(token)
+        return self.tokenIds[token]
+
+    def trainModel(self, text):
+        """
+        Requires: text is a list of lists of strings
+        Modifies: self
+        Effects:  builds the levels from the n-grams of text with the
+                  start and end symbols of prepData. The top level counts
+                  how often each n-gram occurs; each lower level counts,
+                  for each n-gram, how many different tokens come before
+                  it, except for those that begin with a start symbol,
+                  which keep how often they occur: only '^::^' comes
+                  before '^:::^', so they would all count once. Each
+                  level from the bigrams up is discounted by
+                  D = n1 / (n1 + 2 * n2), n1 and n2 being its numbers of
+                  n-grams counted once and twice. The start symbols are
+                  never candidates, as in UnigramModel.
+        """
+        self.ranked.clear()
+        for token in START_SYMBOLS + (END_SYMBOL,):
+            self.addToken(token)
+        columns = [[[] for d in range(k)] for k in range(self.n + 1)]
+        for sentence in self.prepData(text):
+            ids = [self.addToken(token) for token in sentence]
+            for k in range(1, self.n + 1):
+                for d in range(k):
+                    columns[k][d].extend(ids[d:len(ids) - k + 1 + d])
+        self.radix = len(self.tokens)
+        assert self.radix ** max(self.n - 1, 1) < 2 ** 62
+        notCandidates = [self.tokenIds[token] for token in START_SYMBOLS]
+
+        self.levels = [None] * (self.n + 1)
+        higher = None
+        for k in range(self.n, 0, -1):
+            grams = np.array(columns[k], np.int64).reshape(k, -1).T
+            grams, counts = np.unique(grams, axis = 0, return_counts = True)
+            if higher is not None:
+                # the n-grams of a lower level are the ends of the n-grams
+                # of the one above, counted once for every token before them
+                sentenceStarts = np.in1d(grams[:, 0], notCandidates)
+                continued, continuations = np.unique(higher[:, 1:], axis = 0, return_counts = True)
+                fromStart = np.in1d(continued[:, 0], notCandidates)
+                grams = np.concatenate((continued[~fromStart], grams[sentenceStarts]))
+                counts = np.concatenate((continuations[~fromStart], counts[sentenceStarts]))
+                order = np.lexsort(grams.T[::-1])
+                grams, counts = grams[order], counts[order]
+            higher = grams
+            keep = ~np.in1d(grams[:, -1], notCandidates)
+            grams, counts = grams[keep], counts[keep]
+            discount = 0.
+            if k > 1:
+                n1, n2 = (counts == 1).sum(), (counts == 2).sum()
+                discount = n1 / float(n1 + 2 * n2) if n1 else 0.5
+            self.levels[k] = KneserNeyLevel(grams, counts, discount, self.radix,
+                                            self.tokenIds[END_SYMBOL])
+
+    def chain(self, sentence):
+        """
+        Requires: sentence is a list of tokens
+        Modifies: nothing
+        Effects:  returns the (level, row) of every context that ends
+                  sentence and is known, from the longest down to the
+                  empty one of the unigram level.
+        """
+        chain = []
+        ids = []
+        for token in reversed(sentence[len(sentence) - self.n + 1:] if self.n > 1 else []):
+            if token not in self.tokenIds:
+                break
+            ids.append(self.tokenIds[token])
+        for k in range(len(ids) + 1, 0, -1):
+            key = 0
+            for tokenId in reversed(ids[:k - 1]):
+                key = key * self.radix + tokenId
+            row = self.levels[k].findRow(key)
+            if row is not None:
+                chain.append((self.levels[k], row))
+        return chain
+
+    def trainingDataHasNGram(self, sentence):
+        """
+        Requires: sentence is a list of strings
+        Modifies: nothing
+        Effects:  returns True: the model always has the unigram level to
+                  fall back to.
+        """
+        return True
+
+    def getCandidateDictionary(self, sentence):
+        """
+        Requires: sentence is a list of strings
+        Modifies: nothing
+        Effects:  returns the candidates of the longest known context of
+                  sentence with their counts as the model keeps them: what
+                  the model draws from before interpolating.
+        """
+        level, row = self.chain(sentence)[0]
+        lo, hi = level.indptr[row], level.indptr[row + 1]
+        weights = np.diff(np.concatenate(([level.base[row]], level.cumulative[lo:hi])))
+        return dict((self.tokens[i], int(round(w + level.discount)))
+                    for i, w in zip(level.candidateIds[lo:hi].tolist(), weights.tolist()))
+
+    def probability(self, sentence, token):
+        """
+        Requires: sentence is a list of tokens
+        Modifies: nothing
+        Effects:  returns the interpolated probability of token after
+                  sentence.
+        """
+        tokenId = self.tokenIds.get(token)
+        if tokenId is None:
+            return 0.
+        p = 0.
+        reach = 1.
+        for level, row in self.chain(sentence):
+            p += reach * (1 - level.gamma[row]) * level.weight(row, tokenId) / level.totals[row]
+            reach *= level.gamma[row]
+        return p
+
+    def lookup(self, sentence, rng=None):
+        """
+        Requires: sentence is a list of tokens; rng is not used, the
+                  levels are chosen when drawing
+        Modifies: nothing
+        Effects:  returns a KneserNeySampler for sentence, so that
+                  generateSentence can use this model in place of a list
+                  of models.
+        """
+        return KneserNeySampler(self, self.chain(sentence))
+
+    def getNextToken(self, sentence, rng=random):
+        """
+        Requires: sentence is a list of strings, rng is a random.Random (the
+                  random module by default)
+        Modifies: the state of rng
+        Effects:  returns the next token for sentence, drawn from the
+                  interpolated distribution.
+        """
+        return self.lookup(sentence).draw(rng)
+
+    def nbytes(self):
+        """
+        Requires: nothing
+        Modifies: nothing
+        Effects:  returns the number of bytes the arrays of the levels take.
+        """
+        return sum(array.nbytes for level in self.levels[1:] for array in vars(level).values()
+                   if isinstance(array, np.ndarray))
+
+# -----------------------------------------------------------------------------
+# Testing code ----------------------------------------------------------------
+
+if __name__ == '__main__':
+    text = [ ['the', 'quick', 'brown', 'fox'], ['the', 'lazy', 'dog'],
+             ['a', 'quick', 'brown', 'cat'], ['the', 'quick', 'red', 'fox'] ]
+    model = KneserNeyModel(3)
+    model.trainModel(text)
+    for sentence in (['^::^', '^:::^'], ['the', 'quick'], ['a', 'quick'], ['zebra']):
+        total = sum(model.probability(sentence, token) for token in model.tokens)
+        print sentence, model.getCandidateDictionary(sentence), round(total, 6)
+    print model.probability(['the', 'quick'], 'brown'), model.probability(['the', 'quick'], 'cat')
+    print model.getNextToken(['the', 'quick'])
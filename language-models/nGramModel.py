@@ -4,6 +4,176 @@ import copy
 sys.path.append('../data')
 from musicData import *
 
+# -----------------------------------------------------------------------------
+# Note filters ----------------------------------------------------------------
+# The rules getNextNote, getNextGoodNote and getSlowNote use to choose which
+# candidates fit possiblePitches. They are functions of their own so that the
+# backoff index can cache the constrained candidates of every context.
+
+def noteFits(key, possiblePitches):
+    """
+    Requires: key is a PySynth tuple or '$:::$'
+    Modifies: nothing
+    Effects:  returns True if getNextNote may choose key: the end symbol, or
+              a note whose pitch without its octave is in possiblePitches.
+    """
+    if key == '$:::$':
+        return True
+    return key[0][:-1] in list(possiblePitches)
+
+def goodNoteFits(key, possiblePitches):
+    """
+    Requires: key is a PySynth tuple or '$:::$'
+    Modifies: nothing
+    Effects:  returns True if getNextGoodNote may choose key.
+    """
+    if key == '$:::$':
+        return True
+    compKey = key[0][:-1]
+    compOct = key[0][-1:]
+    return compKey in list(possiblePitches) and ((key[1] == 8) or (key[1] == 4)) and compOct == 3
+
+def slowNoteFits(key, possiblePitches):
+    """
+    Requires: key is a PySynth tuple or '$:::$'
+    Modifies: nothing
+    Effects:  returns True if getSlowNote may choose key.
+    """
+    if key == '$:::$':
+        return True
+    return key[0][:-1] in list(possiblePitches) and key[1] == 2
+
+def addCounts(counts, other):
+    """
+    Requires: counts and other are n-gram count tables of the same shape:
+              dictionaries of integers, or of such dictionaries
+    Modifies: counts
+    Effects:  adds the counts of other into counts, entry by entry, and
+              returns counts. Only the entries of other are visited, so
+              merging a small table into a large one is cheap.
+    """
+    for key in other:
+        if isinstance(other[key], dict):
+            addCounts(counts.setdefault(key, {}), other[key])
+        else:
+            counts[key] = counts.get(key, 0) + other[key]
+    return counts
+
+def constrainCandidates(allCandidates, fits, possiblePitches):
+    """
+    Requires: allCandidates is a candidate dictionary, fits one of the note
+              filters above
+    Modifies: nothing
+    Effects:  returns a new dictionary of the candidates that fit, filled in
+              the order allCandidates iterates in.
+    """
+    constrainedCandidates = {}
+    for key in allCandidates:
+        if fits(key, possiblePitches):
+            constrainedCandidates[key] = allCandidates[key]
+    return constrainedCandidates
+
+# -----------------------------------------------------------------------------
+# Sampling modes --------------------------------------------------------------
+# Ways of drawing the next token other than in proportion to its count: with
+# a temperature, from the topK most frequent candidates only, or from the
+# smallest set of most frequent candidates holding topP of the probability
+# (nucleus sampling). The candidates of a context are sorted once, so each
+# draw is a binary search in cached prefix sums.
+
+class SamplingMode(object):
+
+    def __init__(self, temperature=1., topK=None, topP=None):
+        """
+        Requires: temperature >= 0; topK, if given, >= 1; topP, if given,
+                  is in (0, 1]
+        Modifies: self
+        Effects:  describes a sampling mode. Counts are raised to the power
+                  1 / temperature, so temperatures below 1 favour frequent
+                  candidates and 0 always takes the most frequent; then
+                  only the topK most frequent candidates are kept, and of
+                  those the fewest most frequent ones whose weight reaches
+                  topP of theirs.
+        """
+        self.temperature = temperature
+        self.topK = topK
+        self.topP = topP
+
+class RankedCandidates(object):
+
+    def __init__(self, candidates):
+        """
+        Requires: candidates is a non-empty candidate dictionary
+        Modifies: self
+        Effects:  sorts the candidates by descending count, those with the
+                  same count in the order the dictionary iterates in.
+        """
+        import numpy as np
+        tokens = list(candidates)
+        order = sorted(range(len(tokens)), key=lambda i: -candidates[tokens[i]])
+        self.tokens = [tokens[i] for i in order]
+        self.counts = np.array([candidates[token] for token in self.tokens], np.float64)
+        self.tempered = {}
+
+    def cumulative(self, temperature):
+        """
+        Requires: temperature > 0
+        Modifies: self.tempered
+        Effects:  returns the prefix sums of the counts raised to the power
+                  1 / temperature, computed the first time for each
+                  temperature. The counts are scaled by the largest first,
+                  so that low temperatures cannot overflow.
+        """
+        if temperature not in self.tempered:
+            import numpy as np
+            weights = (self.counts / self.counts[0]) ** (1. / temperature)
+            self.tempered[temperature] = np.cumsum(weights)
+        return self.tempered[temperature]
+
+    def cutoff(self, mode):
+        """
+        Requires: mode is a SamplingMode with a temperature > 0
+        Modifies: self.tempered
+        Effects:  returns the number of most frequent candidates mode
+                  draws from and the prefix sums of the tempered weights.
+        """
+        cumulative = self.cumulative(mode.temperature)
+        n = len(cumulative)
+        if mode.topK is not None:
+            n = min(n, mode.topK)
+        if mode.topP is not None:
+            import numpy as np
+            n = min(n, int(np.searchsorted(cumulative, mode.topP * cumulative[n - 1])) + 1)
+        return n, cumulative
+
+    def sample(self, mode, rng=random):
+        """
+        Requires: mode is a SamplingMode, rng is a random.Random (the random
+                  module by default)
+        Modifies: self.tempered, the state of rng
+        Effects:  returns a candidate drawn as mode describes.
+        """
+        if mode.temperature <= 0:
+            return self.tokens[0]
+        import numpy as np
+        n, cumulative = self.cutoff(mode)
+        randomNum = rng.random() * cumulative[n - 1]
+        return self.tokens[min(int(np.searchsorted(cumulative, randomNum, 'right')), n - 1)]
+
+    def probability(self, token, mode):
+        """
+        Requires: mode is a SamplingMode
+        Modifies: self.tempered
+        Effects:  returns the probability that sample draws token.
+        """
+        if mode.temperature <= 0:
+            return float(self.tokens[0] == token)
+        n, cumulative = self.cutoff(mode)
+        if token not in self.tokens[:n]:
+            return 0.
+        i = self.tokens.index(token)
+        return (cumulative[i] - (cumulative[i - 1] if i else 0.)) / cumulative[n - 1]
+
 # -----------------------------------------------------------------------------
 # NGramModel class ------------------------------------------------------------
 # Core functions to implement: prepData, weightedChoice, and getNextToken
@@ -21,6 +191,9 @@ class NGramModel(object):
                   function is done for you.
         """
         self.nGramCounts = {}
+        # the RankedCandidates of each context and note filter, for the
+        # sampling modes
+        self.ranked = {}
 
     def __str__(self):
         """
@@ -73,6 +246,18 @@ class NGramModel(object):
 
         return
 
+    def merge(self, other):
+        """
+        Requires: other is a model of the same class
+        Modifies: self.nGramCounts
+        Effects:  adds the counts of other to this model's and returns it,
+                  so that a model trained on parts of a text and merged
+                  has the counts of one trained on the whole text.
+        """
+        addCounts(self.nGramCounts, other.nGramCounts)
+        self.ranked.clear()
+        return self
+
     def trainingDataHasNGram(self, sentence):
         """
         Requires: sentence is a list of strings, and trainingDataHasNGram
@@ -97,11 +282,43 @@ class NGramModel(object):
         """
         return {}
 
-    def weightedChoice(self, candidates):
+    def context(self, sentence):
         """
-        Requires: candidates is a dictionary; the keys of candidates are items
-                  you want to choose from and the values are integers
+        Requires: sentence is a list of strings
         Modifies: nothing
+        Effects:  returns the tuple of the last n - 1 tokens of sentence,
+                  the context this model of order n chooses the next
+                  token by.
+        """
+        if self.n == 1:
+            return ()
+        return tuple(sentence[1 - self.n:])
+
+    def rankedCandidates(self, sentence, fits=None, possiblePitches=()):
+        """
+        Requires: sentence is a list of strings, and trainingDataHasNGram
+                  has returned True for it; fits, if given, is one of the
+                  note filters
+        Modifies: self.ranked
+        Effects:  returns the RankedCandidates of the candidates for
+                  sentence, only those that fit possiblePitches if fits is
+                  given, or None if none do. They are built once per
+                  context and filter, and dropped by trainModel and merge.
+        """
+        key = (self.context(sentence), fits, tuple(possiblePitches))
+        if key not in self.ranked:
+            candidates = self.getCandidateDictionary(sentence)
+            if fits is not None:
+                candidates = constrainCandidates(candidates, fits, possiblePitches)
+            self.ranked[key] = RankedCandidates(candidates) if candidates else None
+        return self.ranked[key]
+
+    def weightedChoice(self, candidates, rng=random):
+        """
+        Requires: candidates is a dictionary; the keys of candidates are items
+                  you want to choose from and the values are integers;
+                  rng is a random.Random (the random module by default)
+        Modifies: the state of rng
         Effects:  returns a candidate item (a key in the candidates dictionary)
                   based on the algorithm described in the spec.
         """
@@ -122,7 +339,7 @@ class NGramModel(object):
           cumulative.append(cumulative[i - 1] + countValues[i])
 
         # compares random value with cumulative list values
-        randomNum = random.randrange(0, cumulative[-1] + 1)
+        randomNum = rng.randrange(0, cumulative[-1] + 1)
         j = 0
 
         # calculates index while random number is greater than cumulative count
@@ -133,147 +350,165 @@ class NGramModel(object):
         return tokenKeys[j]
 
 
-    def getNextToken(self, sentence):
+    def getNextToken(self, sentence, rng=random, mode=None):
         """
         Requires: sentence is a list of strings, and this model can be used to
-                  choose the next token for the current sentence
-        Modifies: nothing
+                  choose the next token for the current sentence; rng is a
+                  random.Random (the random module by default); mode, if
+                  given, is a SamplingMode
+        Modifies: the state of rng, self.ranked
         Effects:  returns the next token to be added to sentence by calling
                   the getCandidateDictionary and weightedChoice functions.
                   For more information on how to put all these functions
-                  together, see the spec.
+                  together, see the spec. With mode, the token is drawn
+                  from the ranked candidates as mode describes instead.
         """
+        if mode is not None:
+            return self.rankedCandidates(sentence).sample(mode, rng)
 
         # getting a list of candidate next words for the sentence
         # by choosing next word for the sentence based on weights of candidate word
         # returns chosen word
-        return self.weightedChoice(self.getCandidateDictionary(sentence))
+        return self.weightedChoice(self.getCandidateDictionary(sentence), rng)
+
 
+    def sampleNote(self, musicalSentence, possiblePitches, candidates, rng, mode, fits, durations):
+        """
+        Requires: as getNextNote, and mode is a SamplingMode, fits one of
+                  the note filters and durations a list of durations
+        Modifies: the state of rng, self.ranked
+        Effects:  returns the next note like the getNextNote variant that
+                  uses fits and durations, but drawn as mode describes.
+        """
+        if candidates is None:
+            ranked = self.rankedCandidates(musicalSentence, fits, possiblePitches)
+        else:
+            constrained = constrainCandidates(candidates, fits, possiblePitches)
+            ranked = RankedCandidates(constrained) if constrained else None
+        if ranked is None:
+            return (rng.choice(possiblePitches), rng.choice(durations))
+        return ranked.sample(mode, rng)
 
-    def getNextNote(self, musicalSentence, possiblePitches):
+    def getNextNote(self, musicalSentence, possiblePitches, candidates=None, rng=random, mode=None):
         """
         Requires: musicalSentence is a list of PySynth tuples,
                   possiblePitches is a list of possible pitches for this
                   line of music (in other words, a key signature), and this
                   model can be used to choose the next note for the current
-                  musical sentence
-        Modifies: nothing
+                  musical sentence. candidates, if given, is the candidate
+                  dictionary to use instead of getCandidateDictionary's;
+                  rng is a random.Random (the random module by default);
+                  mode, if given, is a SamplingMode
+        Modifies: the state of rng, self.ranked
         Effects:  returns the next note to be added to the "musical sentence".
                   For details on how to do this and how this will differ
                   from the getNextToken function from the core, see the spec.
                   Please note that this function is for the reach only.
+                  With mode, the note is drawn as mode describes.
         """
 
-        allCandidates = self.getCandidateDictionary(musicalSentence)
+        if mode is not None:
+            return self.sampleNote(musicalSentence, possiblePitches, candidates, rng, mode,
+                                   noteFits, NOTE_DURATIONS)
 
-        constrainedCandidates = {}
-        # finish constrainedCandidates
-        for key in allCandidates:
-          if key == '$:::$':
-            #add to constrainedCandidates
-            constrainedCandidates[key] = allCandidates[key]
+        allCandidates = candidates
+        if allCandidates is None:
+            allCandidates = self.getCandidateDictionary(musicalSentence)
 
-          else:
-            for pitch in possiblePitches:
-              compKey = key[0][:-1]
-              if pitch == compKey:
-                constrainedCandidates[key] = allCandidates[key]
+        constrainedCandidates = constrainCandidates(allCandidates, noteFits, possiblePitches)
 
         if len(constrainedCandidates) != 0:
-          return self.weightedChoice(constrainedCandidates)
+          return self.weightedChoice(constrainedCandidates, rng)
 
         else:
           # first item in tuple
-          firstItem = (random.choice(possiblePitches))
+          firstItem = (rng.choice(possiblePitches))
           firstItem.join('4')
 
           # second item
-          secondItem = (random.choice(NOTE_DURATIONS))
+          secondItem = (rng.choice(NOTE_DURATIONS))
 
         return (firstItem, secondItem)
 
-    def getNextGoodNote(self, musicalSentence, possiblePitches):
+    def getNextGoodNote(self, musicalSentence, possiblePitches, candidates=None, rng=random, mode=None):
         """
         Requires: musicalSentence is a list of PySynth tuples,
                   possiblePitches is a list of possible pitches for this
                   line of music (in other words, a key signature), and this
                   model can be used to choose the next note for the current
-                  musical sentence
-        Modifies: nothing
+                  musical sentence. candidates, if given, is the candidate
+                  dictionary to use instead of getCandidateDictionary's;
+                  rng is a random.Random (the random module by default);
+                  mode, if given, is a SamplingMode
+        Modifies: the state of rng, self.ranked
         Effects:  returns the next note to be added to the "musical sentence".
                   For details on how to do this and how this will differ
                   from the getNextToken function from the core, see the spec.
                   Please note that this function is for the reach only.
+                  With mode, the note is drawn as mode describes.
         """
 
-        allCandidates = self.getCandidateDictionary(musicalSentence)
+        if mode is not None:
+            return self.sampleNote(musicalSentence, possiblePitches, candidates, rng, mode,
+                                   goodNoteFits, OTHER_NOTE_DURATIONS)
 
-        constrainedCandidates = {}
-        # finish constrainedCandidates
-        for key in allCandidates:
-          if key == '$:::$':
-            #add to constrainedCandidates
-            constrainedCandidates[key] = allCandidates[key]
+        allCandidates = candidates
+        if allCandidates is None:
+            allCandidates = self.getCandidateDictionary(musicalSentence)
 
-          else:
-            for pitch in possiblePitches:
-              compKey = key[0][:-1]
-              compOct = key[0][-1:]
-              if pitch == compKey and ((key[1] == 8) or (key[1] == 4)) and compOct == 3:
-                constrainedCandidates[key] = allCandidates[key]
+        constrainedCandidates = constrainCandidates(allCandidates, goodNoteFits, possiblePitches)
 
         if len(constrainedCandidates) != 0:
-          return self.weightedChoice(constrainedCandidates)
+          return self.weightedChoice(constrainedCandidates, rng)
 
         else:
           # first item in tuple
-          firstItem = (random.choice(possiblePitches))
+          firstItem = (rng.choice(possiblePitches))
           firstItem.join('4')
 
           # second item
-          secondItem = (random.choice(OTHER_NOTE_DURATIONS))
+          secondItem = (rng.choice(OTHER_NOTE_DURATIONS))
 
         return (firstItem, secondItem)
 
-    def getSlowNote(self, musicalSentence, possiblePitches):
+    def getSlowNote(self, musicalSentence, possiblePitches, candidates=None, rng=random, mode=None):
         """
         Requires: musicalSentence is a list of PySynth tuples,
                   possiblePitches is a list of possible pitches for this
                   line of music (in other words, a key signature), and this
                   model can be used to choose the next note for the current
-                  musical sentence
-        Modifies: nothing
+                  musical sentence. candidates, if given, is the candidate
+                  dictionary to use instead of getCandidateDictionary's;
+                  rng is a random.Random (the random module by default);
+                  mode, if given, is a SamplingMode
+        Modifies: the state of rng, self.ranked
         Effects:  returns the next note to be added to the "musical sentence".
                   For details on how to do this and how this will differ
                   from the getNextToken function from the core, see the spec.
                   Please note that this function is for the reach only.
+                  With mode, the note is drawn as mode describes.
         """
 
-        allCandidates = self.getCandidateDictionary(musicalSentence)
+        if mode is not None:
+            return self.sampleNote(musicalSentence, possiblePitches, candidates, rng, mode,
+                                   slowNoteFits, SLOW_DURATIONS)
 
-        constrainedCandidates = {}
-        # finish constrainedCandidates
-        for key in allCandidates:
-          if key == '$:::$':
-            # add to constrainedCandidates
-            constrainedCandidates[key] = allCandidates[key]
+        allCandidates = candidates
+        if allCandidates is None:
+            allCandidates = self.getCandidateDictionary(musicalSentence)
 
-          else:
-            for pitch in possiblePitches:
-              compKey = key[0][:-1]
-              if pitch == compKey and key[1] == 2:
-                constrainedCandidates[key] = allCandidates[key]
+        constrainedCandidates = constrainCandidates(allCandidates, slowNoteFits, possiblePitches)
 
         if len(constrainedCandidates) != 0:
-          return self.weightedChoice(constrainedCandidates)
+          return self.weightedChoice(constrainedCandidates, rng)
 
         else:
           # first item in tuple
-          firstItem = (random.choice(possiblePitches))
+          firstItem = (rng.choice(possiblePitches))
           firstItem.join('4')
 
           # second item
-          secondItem = (random.choice(SLOW_DURATIONS))
+          secondItem = (rng.choice(SLOW_DURATIONS))
 
         return (firstItem, secondItem)
 
@@ -0,0 +1,523 @@
+import os
+import random
+import cPickle
+import numpy as np
+from backoffIndex import END_SYMBOL
+
+# -----------------------------------------------------------------------------
+# PackedModel class -----------------------------------------------------------
+# The contexts and candidate counts of a BackoffIndex packed into NumPy
+# arrays, so that many sentences can be generated in lock-step: each step
+# looks up the contexts of all unfinished sentences and draws their next
+# tokens with one vectorized draw.
+#
+# A PackedModel can be saved and loaded back frozen: its arrays mapped
+# read-only from their files, so that any number of worker processes share
+# one copy of them in the page cache instead of each holding its own.
+
+START_SYMBOLS = ('^::^', '^:::^')
+
+def numpyRandom(rng):
+    """
+    Requires: rng is a random.Random or the random module
+    Modifies: the state of rng
+    Effects:  returns a NumPy RandomState seeded from rng, or NumPy's global
+              one for the random module, so that batched generation follows
+              the same seed as the rest of the program.
+    """
+    if rng is random:
+        return np.random
+    return np.random.RandomState([rng.getrandbits(32) for i in range(8)])
+
+class PackedCounts(object):
+
+    def __init__(self, indptr, candidateIds, counts, weights = None):
+        """
+        Requires: indptr, candidateIds and counts describe one row of
+                  candidates per context in CSR form: the candidates of row
+                  i are candidateIds[indptr[i]:indptr[i + 1]] with the
+                  positive counts in counts at the same positions; weights,
+                  if given, is an array like counts
+        Modifies: self
+        Effects:  precomputes the cumulative weights of all rows, so that
+                  they can be searched with one searchsorted call: row i
+                  covers the numbers from base[i] up to base[i] + totals[i].
+                  By default the weights are those weightedChoice draws
+                  with: a number from 0 to the total count picks the first
+                  candidate whose cumulative count is at least that number,
+                  so the first candidate of a row weighs one more than its
+                  count.
+        """
+        self.indptr = indptr
+        self.candidateIds = candidateIds
+        self.counts = counts
+        if weights is None:
+            weights = counts.copy()
+            weights[indptr[:-1][np.diff(indptr) > 0]] += 1
+        self.weights = weights
+        self.cumulative = np.cumsum(weights)
+        ends = np.concatenate(([0], self.cumulative))[indptr]
+        self.base = ends[:-1]
+        self.totals = np.diff(ends)
+
+    def draw(self, rows, uniform):
+        """
+        Requires: rows is an array of row numbers and uniform an array of the
+                  same length of numbers drawn uniformly from [0, 1)
+        Modifies: nothing
+        Effects:  returns the candidate token id drawn for each row, each
+                  with a probability proportional to its weight; for the
+                  default weights, as weightedChoice would draw it. Rows
+                  without candidates give -1.
+        """
+        totals = self.totals[rows]
+        if not len(self.candidateIds):
+            return np.full(len(rows), -1, np.int64)
+        randomNums = np.floor(uniform * totals).astype(np.int64)
+        positions = np.searchsorted(self.cumulative, self.base[rows] + randomNums, 'right')
+        positions = np.minimum(positions, len(self.candidateIds) - 1)
+        return np.where(totals > 0, self.candidateIds[positions], -1)
+
+    def without(self, tokenId):
+        """
+        Requires: nothing
+        Modifies: nothing
+        Effects:  returns the PackedCounts of the same rows without the
+                  candidate tokenId, the others keeping their weights, and
+                  an array with the probability of drawing tokenId from each
+                  row (0 for rows without candidates). Drawing from the
+                  former gives the distribution of draw on the condition
+                  that tokenId is not drawn.
+        """
+        keep = self.candidateIds != tokenId
+        kept = np.concatenate(([0], np.cumsum(keep)))[self.indptr]
+        rest = PackedCounts(kept, self.candidateIds[keep], self.counts[keep], self.weights[keep])
+        totals = np.maximum(self.totals, 1).astype(np.float64)
+        return rest, np.where(self.totals > 0, 1. - rest.totals / totals, 0.)
+
+    # the arrays save writes and load maps
+    ARRAYS = ('indptr', 'candidateIds', 'counts', 'weights', 'cumulative', 'base', 'totals')
+
+    def save(self, directory, name):
+        """
+        Requires: directory exists
+        Modifies: the files in directory
+        Effects:  writes every array to directory as name.array.npy.
+        """
+        for array in self.ARRAYS:
+            np.save(os.path.join(directory, '%s.%s.npy' % (name, array)), getattr(self, array))
+
+    @staticmethod
+    def load(directory, name, mode=None):
+        """
+        Requires: directory holds the arrays save wrote under name
+        Modifies: nothing
+        Effects:  returns the PackedCounts, with its arrays loaded with
+                  np.load in mode ('r' to map them read-only), none of
+                  them computed again.
+        """
+        counts = PackedCounts.__new__(PackedCounts)
+        for array in PackedCounts.ARRAYS:
+            setattr(counts, array, np.load(os.path.join(directory, '%s.%s.npy' % (name, array)), mode))
+        return counts
+
+
+class PackedModel(object):
+
+    def __init__(self, index):
+        """
+        Requires: index is a BackoffIndex
+        Modifies: self
+        Effects:  numbers all tokens the index knows and packs its contexts.
+                  A context of depth d (its d most recent tokens) is stored
+                  in levels[d] under the key sum(id_i * radix ** i), with
+                  i = 0 for the most recent token, next to its row in counts.
+                  backoff holds the backoffProbability of every row.
+        """
+        self.tokens = []
+        self.tokenIds = {}
+        self.order = index.order
+        self.endless = None
+        self.directory = None
+        self.entries = None
+
+        contexts = []
+        nodes = [(index.root, ())]
+        while nodes:
+            node, context = nodes.pop()
+            if node[0] is not None:
+                contexts.append((context, node[0]))
+            for token in node[1]:
+                nodes.append((node[1][token], context + (token,)))
+
+        for context, sampler in contexts:
+            for token in context + tuple(sampler.tokens):
+                self.addToken(token)
+        for token in START_SYMBOLS + (END_SYMBOL,):
+            self.addToken(token)
+        self.radix = len(self.tokens)
+        assert self.radix ** max(self.order - 1, 1) < 2 ** 62
+
+        indptr = [0]
+        candidateIds = []
+        counts = []
+        backoff = []
+        levelKeys = [[] for i in range(self.order)]
+        levelRows = [[] for i in range(self.order)]
+        for row, (context, sampler) in enumerate(contexts):
+            candidateIds.extend(self.tokenIds[token] for token in sampler.tokens)
+            counts.extend(sampler.candidates[token] for token in sampler.tokens)
+            indptr.append(len(candidateIds))
+            backoff.append(sampler.backoffProbability)
+            if not context:
+                self.rootRow = row
+            key = 0
+            for i, token in enumerate(context):
+                key += self.tokenIds[token] * self.radix ** i
+            levelKeys[len(context)].append(key)
+            levelRows[len(context)].append(row)
+
+        self.counts = PackedCounts(np.array(indptr, np.int64),
+            np.array(candidateIds, np.int64), np.array(counts, np.int64))
+        self.backoff = np.array(backoff, np.float64)
+        self.levels = []
+        for keys, rows in zip(levelKeys, levelRows):
+            keys = np.array(keys, np.int64)
+            order = np.argsort(keys)
+            self.levels.append((keys[order], np.array(rows, np.int64)[order]))
+
+    def addToken(self, token):
+        """
+        Requires: nothing
+        Modifies: self.tokens, self.tokenIds
+        Effects:  returns the id of token, giving it the next free id if it
+                  does not have one yet. Tokens added after packing never
+                  occur in a context.
+        """
+        if token not in self.tokenIds:
+            self.tokenIds[token] = len(self.tokens)
+            self.tokens.append(token)
+        return self.tokenIds[token]
+
+    def withoutEnd(self):
+        """
+        Requires: nothing
+        Modifies: self.endless
+        Effects:  returns counts.without the end symbol (see
+                  PackedCounts.without), computed the first time.
+        """
+        if self.endless is None:
+            self.endless = self.counts.without(self.tokenIds[END_SYMBOL])
+        return self.endless
+
+    def save(self, directory):
+        """
+        Requires: nothing
+        Modifies: the files in directory, self.endless
+        Effects:  writes the model to directory: one .npy file per array,
+                  the tables without the end symbol included, and the
+                  tokens, pickled.
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(os.path.join(directory, 'tokens.pkl'), 'wb') as f:
+            cPickle.dump((self.order, self.radix, self.rootRow, self.tokens), f, 2)
+        self.counts.save(directory, 'counts')
+        endless, drawsEnd = self.withoutEnd()
+        endless.save(directory, 'endless')
+        np.save(os.path.join(directory, 'drawsEnd.npy'), drawsEnd)
+        np.save(os.path.join(directory, 'backoff.npy'), self.backoff)
+        for depth, (keys, rows) in enumerate(self.levels):
+            np.save(os.path.join(directory, 'keys%d.npy' % depth), keys)
+            np.save(os.path.join(directory, 'rows%d.npy' % depth), rows)
+
+    @staticmethod
+    def load(directory, mmap=True):
+        """
+        Requires: directory holds a model written by save
+        Modifies: nothing
+        Effects:  returns the model. With mmap, the arrays are mapped
+                  read-only from their files instead of read: loading
+                  takes the same time for any size of model, and processes
+                  that load the same directory, or are forked after
+                  loading it, share its pages. Such a model pickles as the
+                  name of its directory, so sending it to a worker process
+                  maps it there rather than copying it.
+        """
+        mode = 'r' if mmap else None
+        def load(name):
+            return np.load(os.path.join(directory, name), mode)
+        model = PackedModel.__new__(PackedModel)
+        with open(os.path.join(directory, 'tokens.pkl'), 'rb') as f:
+            model.order, model.radix, model.rootRow, tokens = cPickle.load(f)
+        model.tokens = []
+        model.tokenIds = {}
+        for token in tokens:
+            model.addToken(token)
+        model.counts = PackedCounts.load(directory, 'counts', mode)
+        model.endless = (PackedCounts.load(directory, 'endless', mode), load('drawsEnd.npy'))
+        model.backoff = load('backoff.npy')
+        model.levels = [(load('keys%d.npy' % depth), load('rows%d.npy' % depth))
+                        for depth in range(model.order)]
+        model.directory = directory if mmap else None
+        model.entries = None
+        return model
+
+    def __getstate__(self):
+        if self.directory is not None:
+            return {'directory': self.directory}
+        return self.__dict__
+
+    def __setstate__(self, state):
+        if 'directory' in state and len(state) == 1:
+            state = PackedModel.load(state['directory']).__dict__
+        self.__dict__.update(state)
+
+    def contextRows(self, history, rng = np.random):
+        """
+        Requires: history is an array of token ids with one row per
+                  sentence and the most recent token in the last column;
+                  rng is a NumPy RandomState (NumPy's global one by
+                  default)
+        Modifies: the state of rng, if a row has a backoff probability
+        Effects:  returns, for every sentence, the row in counts of the
+                  deepest context that the models know, or of a shorter
+                  one after backing off, like BackoffIndex.lookup does for
+                  one sentence.
+        """
+        rows = np.empty(len(history), np.int64)
+        rows[:] = self.rootRow
+        # the rows of the shorter contexts, for backing off to
+        shorter = []
+        for depth in range(1, min(self.order, history.shape[1] + 1)):
+            keys, levelRows = self.levels[depth]
+            if not len(keys):
+                continue
+            recent = history[:, -depth:]
+            key = np.zeros(len(history), np.int64)
+            for i in range(depth):
+                key += recent[:, -1 - i] * self.radix ** i
+            positions = np.minimum(np.searchsorted(keys, key), len(keys) - 1)
+            found = (keys[positions] == key) & (recent < self.radix).all(axis = 1)
+            if self.backoff.any():
+                shorter.append(rows.copy())
+            rows[found] = levelRows[positions[found]]
+        # from the deepest context up, each sentence either stays at the
+        # context it has reached or backs off to the next shorter one
+        settled = np.zeros(len(rows), bool)
+        while shorter:
+            previous = shorter.pop()
+            deciding = ~settled & (rows != previous)
+            backsOff = deciding & (rng.random_sample(len(rows)) < self.backoff[rows])
+            settled |= deciding & ~backsOff
+            rows[backsOff] = previous[backsOff]
+        return rows
+
+    def levelRows(self, history):
+        """
+        Requires: history is an array of token ids with one row per
+                  sentence and the most recent token in the last column
+        Modifies: nothing
+        Effects:  returns an array with one row per sentence and one
+                  column per depth d < order: the row in counts of the
+                  context of the d most recent tokens, or -1 if the models
+                  do not know it.
+        """
+        found = np.full((len(history), self.order), -1, np.int64)
+        found[:, 0] = self.rootRow
+        for depth in range(1, min(self.order, history.shape[1] + 1)):
+            keys, levelRows = self.levels[depth]
+            if not len(keys):
+                continue
+            recent = history[:, -depth:]
+            key = np.zeros(len(history), np.int64)
+            for i in range(depth):
+                key += recent[:, -1 - i] * self.radix ** i
+            positions = np.minimum(np.searchsorted(keys, key), len(keys) - 1)
+            known = (keys[positions] == key) & (recent >= 0).all(axis = 1) & \
+                    (recent < self.radix).all(axis = 1)
+            found[known, depth] = levelRows[positions[known]]
+        return found
+
+    def entryIndex(self):
+        """
+        Requires: nothing
+        Modifies: self.entries
+        Effects:  returns, computed the first time, the sorted keys
+                  row * radix + candidate id of all candidates, their counts
+                  in the same order, and the total count of every row.
+        """
+        if self.entries is None:
+            counts = self.counts
+            rows = np.repeat(np.arange(len(counts.indptr) - 1), np.diff(counts.indptr))
+            keys = rows * self.radix + counts.candidateIds
+            order = np.argsort(keys)
+            ends = np.concatenate(([0], np.cumsum(counts.counts)))[counts.indptr]
+            self.entries = (keys[order], counts.counts[order], np.diff(ends))
+        return self.entries
+
+    def logProbabilities(self, history, tokenIds):
+        """
+        Requires: history is as for levelRows, tokenIds an array of the
+                  ids of the tokens that follow each row of it, -1 for
+                  tokens the model does not know
+        Modifies: self.entries
+        Effects:  returns the natural log-probability of every token as
+                  the generators draw it, and the order at which it was
+                  scored. The token is scored after the longest context of
+                  its history that the models know, whether or not it was
+                  seen there, by its share of that context's counts; with
+                  the backoffProbability of that context, the next shorter
+                  one is mixed in, as BackoffIndex.lookup would choose
+                  them, and so on down. The order is the length of the
+                  n-gram of the longest context, 0 for tokens the
+                  generators could not draw there, whose log-probability
+                  is left at 0.
+        """
+        keys, counts, totals = self.entryIndex()
+        found = self.levelRows(history)
+        probabilities = np.zeros(len(tokenIds))
+        orders = np.zeros(len(tokenIds), np.int64)
+        # the probability of backing off to the context of each depth
+        reach = np.ones(len(tokenIds))
+        scoring = np.zeros(len(tokenIds), bool)
+        for depth in range(self.order - 1, -1, -1):
+            todo = np.flatnonzero((reach > 0) & (found[:, depth] >= 0))
+            if not len(todo):
+                continue
+            rows = found[todo, depth]
+            orders[todo[~scoring[todo]]] = depth + 1
+            scoring[todo] = True
+            # the unigram context is the last, and never backs off
+            backoff = self.backoff[rows] if depth else np.zeros(len(rows))
+            share = reach[todo] * (1 - backoff)
+            reach[todo] *= backoff
+            if not len(keys):
+                continue
+            key = rows * self.radix + tokenIds[todo]
+            positions = np.minimum(np.searchsorted(keys, key), len(keys) - 1)
+            hit = (keys[positions] == key) & (tokenIds[todo] >= 0)
+            todo, rows, positions = todo[hit], rows[hit], positions[hit]
+            probabilities[todo] += share[hit] * counts[positions] / totals[rows].astype(np.float64)
+        drawn = probabilities > 0
+        orders[~drawn] = 0
+        logProbabilities = np.zeros(len(tokenIds))
+        logProbabilities[drawn] = np.log(probabilities[drawn])
+        return logProbabilities, orders
+
+    def allowedTokens(self, isAllowed):
+        """
+        Requires: isAllowed is a function of one token returning a bool
+        Modifies: nothing
+        Effects:  returns a boolean array over token ids telling which
+                  tokens isAllowed accepts.
+        """
+        return np.array([isAllowed(token) for token in self.tokens], bool)
+
+    def restrictedCounts(self, allowed):
+        """
+        Requires: allowed is a boolean array over token ids
+        Modifies: nothing
+        Effects:  returns PackedCounts for the same rows that only keep the
+                  allowed candidates; a row can end up with none. They are
+                  kept in the order of a dictionary filled with them in
+                  their original order, as getNextNote builds one, because
+                  weightedChoice favours whichever candidate comes first.
+        """
+        indptr = self.counts.indptr.tolist()
+        candidateIds = self.counts.candidateIds.tolist()
+        counts = self.counts.counts.tolist()
+        allowed = allowed.tolist()
+        newIndptr = [0]
+        newCandidateIds = []
+        newCounts = []
+        for row in range(len(indptr) - 1):
+            constrained = {}
+            for j in range(indptr[row], indptr[row + 1]):
+                if allowed[candidateIds[j]]:
+                    constrained[self.tokens[candidateIds[j]]] = counts[j]
+            for token in constrained:
+                newCandidateIds.append(self.tokenIds[token])
+                newCounts.append(constrained[token])
+            newIndptr.append(len(newCandidateIds))
+        return PackedCounts(np.array(newIndptr, np.int64),
+            np.array(newCandidateIds, np.int64), np.array(newCounts, np.int64))
+
+    def generate(self, count, desiredLength, lengthPolicy, allowed = None, fallback = None, rng = np.random):
+        """
+        Requires: count >= 0; lengthPolicy is a function of desiredLength
+                  and a sentence length returning the probability that a
+                  sentence of that length is too long (see
+                  sentenceTooLongProbability); allowed, if given, is a
+                  boolean array over token ids (see allowedTokens);
+                  fallback, if given, is a non-empty list of tokens; rng is
+                  a NumPy RandomState (NumPy's global one by default)
+        Modifies: self.tokens and self.tokenIds if fallback holds new
+                  tokens, the state of rng
+        Effects:  generates count sentences at once and returns them as
+                  lists of tokens without the start and end symbols. Every
+                  sentence follows the rules of generateSentence: each step
+                  ends it with the probability sentenceEnds gives, else
+                  draws one token other than the end symbol. With allowed,
+                  only the allowed candidates of each context are drawn
+                  from, as getNextNote does; where none are left, a token
+                  is picked uniformly from fallback. All unfinished
+                  sentences have the same length, one more after every step.
+        """
+        if allowed is None:
+            counts, drawsEnd = self.withoutEnd()
+        else:
+            allowed = np.concatenate((allowed, np.zeros(len(self.tokens) - len(allowed), bool)))
+            counts, drawsEnd = self.restrictedCounts(allowed).without(self.tokenIds[END_SYMBOL])
+        if fallback:
+            fallbackIds = np.array([self.addToken(token) for token in fallback], np.int64)
+
+        depth = max(self.order - 1, 1)
+        history = np.empty((count, depth), np.int64)
+        history[:] = [self.tokenIds[token] for token in START_SYMBOLS][-depth:]
+        sentences = np.zeros((count, max(2 * desiredLength, 1)), np.int64)
+        lengths = np.zeros(count, np.int64)
+
+        active = np.arange(count)
+        step = 0
+        while len(active):
+            rows = self.contextRows(history[active], rng)
+            tooLong = lengthPolicy(desiredLength, step)
+            goOn = (1 - tooLong) * (1 - drawsEnd[rows])
+            going = (rng.random_sample(len(active)) * (tooLong + goOn) >= tooLong) & (goOn > 0)
+            active = active[going]
+            if not len(active):
+                break
+            tokens = counts.draw(rows[going], rng.random_sample(len(active)))
+            if fallback:
+                empty = np.flatnonzero(tokens < 0)
+                tokens[empty] = fallbackIds[rng.randint(len(fallbackIds), size = len(empty))]
+            active = active[tokens >= 0]
+            tokens = tokens[tokens >= 0]
+
+            if step >= sentences.shape[1]:
+                sentences = np.hstack((sentences, np.zeros_like(sentences)))
+            sentences[active, step] = tokens
+            lengths[active] += 1
+            history[active, :-1] = history[active, 1:]
+            history[active, -1] = tokens
+            step += 1
+
+        return [[self.tokens[i] for i in sentences[k, :lengths[k]]] for k in range(count)]
+
+
+# -----------------------------------------------------------------------------
+# Testing code ----------------------------------------------------------------
+
+if __name__ == '__main__':
+    from unigramModel import *
+    from bigramModel import *
+    from trigramModel import *
+    from backoffIndex import *
+    text = [ ['the', 'quick', 'brown', 'fox'], ['the', 'lazy', 'dog'] ]
+    models = [TrigramModel(), BigramModel(), UnigramModel()]
+    for model in models:
+        model.trainModel(text)
+    packedModel = PackedModel(BackoffIndex(models))
+    for sentence in packedModel.generate(5, 4, lambda desiredLength, length: float(length >= desiredLength)):
+        print sentence
@@ -0,0 +1,310 @@
+import sys
+import math
+import numpy as np
+from nGramModel import *
+
+# -----------------------------------------------------------------------------
+# SketchModel class -----------------------------------------------------------
+# An approximate n-gram model for corpora whose exact tables would be too
+# big, most of their entries being n-grams seen once. The counts of all
+# n-grams share one count-min sketch of fixed size, and the continuations to
+# sample from are the most frequent n-grams of each context, kept in a
+# hashed table of fixed size, so that only the vocabulary grows with the
+# corpus.
+
+# a Mersenne prime for the row hashes of the sketch
+PRIME = (1 << 61) - 1
+
+class CountMinSketch(object):
+
+    def __init__(self, memory=1 << 22, depth=4, conservative=True, seed=0):
+        """
+        Requires: memory is the number of bytes the table may take, depth
+                  >= 1 the number of rows
+        Modifies: self
+        Effects:  sets up depth rows of width = memory / (4 * depth)
+                  32-bit counters with a hash function each. After adding
+                  a total count N, estimate(key) is never below the true
+                  count of key, and exceeds it by more than eps * N with
+                  probability at most delta, for eps = e / width and
+                  delta = exp(-depth). Conservative update only raises
+                  counters as far as needed, which keeps the same bounds
+                  and makes the errors much smaller in practice.
+        """
+        self.depth = depth
+        self.width = max(memory // (4 * depth), 1)
+        self.table = np.zeros((depth, self.width), np.uint32)
+        self.conservative = conservative
+        self.total = 0
+        rng = np.random.RandomState(seed)
+        self.a = [int(x) for x in rng.randint(1, 1 << 30, depth)]
+        self.b = [int(x) for x in rng.randint(0, 1 << 30, depth)]
+        self.rows = np.arange(depth)
+
+    def columns(self, key):
+        """
+        Requires: key is hashable
+        Modifies: nothing
+        Effects:  returns the counter of key in every row.
+        """
+        h = hash(key) & 0xffffffffffffffff
+        return [((a * h + b) % PRIME) % self.width for a, b in zip(self.a, self.b)]
+
+    def add(self, key, count=1):
+        """
+        Requires: count >= 0
+        Modifies: self.table, self.total
+        Effects:  adds count to the count of key.
+        """
+        columns = self.columns(key)
+        self.total += count
+        if self.conservative:
+            current = self.table[self.rows, columns]
+            self.table[self.rows, columns] = np.maximum(current, current.min() + count)
+        else:
+            self.table[self.rows, columns] += count
+
+    def estimate(self, key):
+        """
+        Requires: key is hashable
+        Modifies: nothing
+        Effects:  returns the estimated count of key (see __init__).
+        """
+        return int(self.table[self.rows, self.columns(key)].min())
+
+    def errorBound(self):
+        """
+        Requires: nothing
+        Modifies: nothing
+        Effects:  returns (eps * N, delta): estimates exceed true counts by
+                  more than the first with probability at most the second.
+        """
+        return math.e / self.width * self.total, math.exp(-self.depth)
+
+
+def deepSize(obj, seen=None):
+    """
+    Requires: obj is built of dicts, lists, tuples, sets, strings, numbers
+              and NumPy arrays
+    Modifies: seen, the ids of the objects counted so far
+    Effects:  returns the bytes sys.getsizeof reports for obj and every
+              object it holds, counting each object once.
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, np.ndarray):
+        return sys.getsizeof(obj) + (obj.nbytes if obj.base is not None else 0)
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += deepSize(key, seen) + deepSize(value, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += deepSize(item, seen)
+    return size
+
+class HeavyHitters(object):
+
+    def __init__(self, n, buckets=1 << 12, slots=8):
+        """
+        Requires: n >= 1 is the order of the n-grams, buckets and slots
+                  >= 1
+        Modifies: self
+        Effects:  sets up a table of buckets rows of slots candidates,
+                  each an n-gram kept as the ids of its tokens with a
+                  count, in NumPy arrays of fixed size. A context goes to
+                  the bucket its hash points at; contexts that share a
+                  bucket share its slots.
+        """
+        self.buckets = buckets
+        # the token ids of each kept n-gram, plus one so that 0 is empty
+        self.grams = np.zeros((buckets, slots, n), np.int32)
+        self.counts = np.zeros((buckets, slots), np.uint32)
+        self.tokens = []
+        self.tokenIds = {}
+
+    def tokenId(self, token):
+        if token not in self.tokenIds:
+            self.tokenIds[token] = len(self.tokens) + 1
+            self.tokens.append(token)
+        return self.tokenIds[token]
+
+    def add(self, context, token):
+        """
+        Requires: context is a tuple of n - 1 tokens
+        Modifies: self
+        Effects:  counts one n-gram with the Space-Saving algorithm of its
+                  bucket: when the bucket is full, a new n-gram takes the
+                  place of the one with the smallest count and starts from
+                  that count plus one. After N n-grams went to a bucket,
+                  every one of them seen more than N / slots times is kept.
+        """
+        row = hash(context) % self.buckets
+        gram = [self.tokenId(t) for t in context + (token,)]
+        found = np.flatnonzero((self.grams[row] == gram).all(axis = 1))
+        slot = found[0] if len(found) else self.counts[row].argmin()
+        self.grams[row, slot] = gram
+        self.counts[row, slot] += 1
+
+    def candidates(self, context):
+        """
+        Requires: context is a tuple of n - 1 tokens
+        Modifies: nothing
+        Effects:  returns the kept tokens that follow context.
+        """
+        row = hash(context) % self.buckets
+        ids = [self.tokenIds.get(t, -1) for t in context]
+        grams = self.grams[row]
+        kept = (grams[:, :-1] == ids).all(axis = 1) & (self.counts[row] > 0)
+        return [self.tokens[i - 1] for i in grams[kept, -1].tolist()]
+
+    def contexts(self):
+        """
+        Requires: nothing
+        Modifies: nothing
+        Effects:  returns the set of contexts with a kept token.
+        """
+        grams = self.grams[self.counts > 0][:, :-1]
+        return set(tuple(self.tokens[i - 1] for i in gram) for gram in grams.tolist())
+
+    def nbytes(self):
+        """
+        Requires: nothing
+        Modifies: nothing
+        Effects:  returns the bytes of the table arrays, which are fixed,
+                  plus those of the token list and ids, which grow with
+                  the vocabulary only, as measured by deepSize.
+        """
+        return self.grams.nbytes + self.counts.nbytes + \
+               deepSize([self.tokens, self.tokenIds])
+
+
+class SketchModel(NGramModel):
+
+    def __init__(self, n, memory=1 << 22, depth=4, buckets=1 << 12, slots=8):
+        """
+        Requires: n >= 1 is the order of the model; memory and depth size
+                  the CountMinSketch, buckets and slots the HeavyHitters
+        Modifies: self
+        Effects:  sets up an empty model that keeps at most buckets *
+                  slots candidates. self.nGramCounts stays empty.
+        """
+        super(SketchModel, self).__init__()
+        self.n = n
+        self.sketch = CountMinSketch(memory, depth)
+        self.heavyHitters = HeavyHitters(n, buckets, slots)
+
+    def __str__(self):
+        return 'This is a SketchModel object of order %d' % self.n
+
+    def trainModel(self, text):
+        """
+        Requires: text is a list of lists of strings
+        Modifies: self
+        Effects:  adds every n-gram of text, as the dictionary model of
+                  the same order counts them, to the sketch and to the
+                  HeavyHitters, which keep the candidates to sample from.
+        """
+        self.ranked.clear()
+        # like UnigramModel, unigrams do not count the start symbols
+        start = 2 if self.n == 1 else 0
+        for sentence in text:
+            # the symbols of prepData, without its copy of the whole text
+            sentence = ['^::^', '^:::^'] + list(sentence) + ['$:::$']
+            for i in range(start, len(sentence) - self.n + 1):
+                context = tuple(sentence[i:i + self.n - 1])
+                token = sentence[i + self.n - 1]
+                self.sketch.add((context, token))
+                self.heavyHitters.add(context, token)
+        return self.heavyHitters
+
+    def trainingDataHasNGram(self, sentence):
+        """
+        Requires: sentence is a list of strings
+        Modifies: nothing
+        Effects:  returns True if the model keeps a candidate for the
+                  last n - 1 tokens of sentence.
+        """
+        if len(sentence) < self.n - 1:
+            return False
+        return len(self.heavyHitters.candidates(self.context(sentence))) > 0
+
+    def context(self, sentence):
+        if self.n == 1:
+            return ()
+        return tuple(sentence[1 - self.n:])
+
+    def getCandidateDictionary(self, sentence):
+        """
+        Requires: sentence is a list of strings, and trainingDataHasNGram
+                  has returned True for it
+        Modifies: nothing
+        Effects:  returns the kept candidates of the context of sentence
+                  with their counts as estimated by the sketch.
+        """
+        return self.candidates(self.context(sentence))
+
+    def candidates(self, context):
+        return dict((token, self.sketch.estimate((context, token)))
+                    for token in self.heavyHitters.candidates(context))
+
+    def iterContexts(self):
+        """
+        Requires: nothing
+        Modifies: nothing
+        Effects:  yields (context, candidates) for every context the model
+                  knows, as BackoffIndex reads them.
+        """
+        for context in self.heavyHitters.contexts():
+            yield context, self.candidates(context)
+
+    def nbytes(self):
+        """
+        Requires: nothing
+        Modifies: nothing
+        Effects:  returns the bytes taken by the sketch and the
+                  HeavyHitters.
+        """
+        return self.sketch.table.nbytes + self.heavyHitters.nbytes()
+
+# -----------------------------------------------------------------------------
+# Testing code ----------------------------------------------------------------
+
+if __name__ == '__main__':
+    from dataLoader import *
+    from trigramModel import *
+    # compares the next-token distributions of an exact and a sketched
+    # trigram model on the Beatles lyrics, weighting contexts by their
+    # number of n-grams
+    dataLoader = DataLoader()
+    dataLoader.loadLyrics('the_beatles')
+    exact = TrigramModel()
+    exact.trainModel(dataLoader.lyrics)
+    entries = sum(len(b) for a in exact.nGramCounts.values() for b in a.values())
+    print 'exact: %d n-grams, %d bytes' % (entries, deepSize(exact.nGramCounts))
+    for memory, buckets in ((1 << 16, 1 << 10), (1 << 18, 1 << 11), (1 << 20, 1 << 12)):
+        sketched = SketchModel(3, memory, buckets = buckets)
+        sketched.trainModel(dataLoader.lyrics)
+        distance = 0.
+        total = 0
+        for a in exact.nGramCounts:
+            for b in exact.nGramCounts[a]:
+                counts = exact.nGramCounts[a][b]
+                if not sketched.trainingDataHasNGram([a, b]):
+                    # a context without candidates backs off entirely
+                    distance += sum(counts.values())
+                    total += sum(counts.values())
+                    continue
+                estimates = sketched.getCandidateDictionary([a, b])
+                n = float(sum(counts.values()))
+                m = float(sum(estimates.values()))
+                tokens = set(counts) | set(estimates)
+                tv = 0.5 * sum(abs(counts.get(t, 0) / n - estimates.get(t, 0) / m) for t in tokens)
+                distance += tv * n
+                total += n
+        bound, delta = sketched.sketch.errorBound()
+        print 'memory %7d buckets %4d: %8d bytes, bound %.1f (delta %.3f), total variation %.3f' % (
+            memory, buckets, sketched.nbytes(), bound, delta, distance / total)
@@ -0,0 +1,256 @@
+import random
+import numpy as np
+from collections import OrderedDict
+from nGramModel import *
+from backoffIndex import CandidateSampler
+
+# -----------------------------------------------------------------------------
+# SuffixArrayIndex class ------------------------------------------------------
+# An index for contexts of any length (an "infinity-gram" model): a suffix
+# array over the token stream of the whole corpus, in which the context of a
+# sentence is looked up as far back as it occurs in the corpus. It takes
+# memory in proportion to the corpus, whatever the length of the contexts.
+#
+# The stream is stored reversed, so that a context read from its last token
+# backwards is a prefix of the suffixes it matches: taking one more token of
+# the context narrows the range of matching suffixes with one binary search
+# on one column, and the token that follows a match in the corpus is the one
+# just before it in the reversed stream.
+
+def suffixArray(stream):
+    """
+    Requires: stream is an array of non-negative integers
+    Modifies: nothing
+    Effects:  returns the start positions of the suffixes of stream in
+              sorted order, by prefix doubling: after the round with step
+              k, suffixes are ranked by their first 2 * k tokens.
+    """
+    n = len(stream)
+    rank = np.unique(stream, return_inverse = True)[1].astype(np.int64)
+    order = np.argsort(rank, kind = 'mergesort')
+    k = 1
+    while n and rank.max() < n - 1:
+        second = np.full(n, -1, np.int64)
+        second[:n - k] = rank[k:]
+        order = np.lexsort((second, rank))
+        first, second = rank[order], second[order]
+        changed = np.ones(n, np.int64)
+        changed[1:] = (first[1:] != first[:-1]) | (second[1:] != second[:-1])
+        rank = np.empty(n, np.int64)
+        rank[order] = np.cumsum(changed) - 1
+        k *= 2
+    return order
+
+class SuffixArrayIndex(object):
+
+    def __init__(self, text, maxContext=None, cacheSize=4096):
+        """
+        Requires: text is a list of lists of tokens; maxContext, if given,
+                  is the most tokens of context to look at
+        Modifies: self
+        Effects:  interns the tokens of text, with the start and end
+                  symbols of prepData around every sentence, and builds the
+                  suffix array of the reversed stream. Samplers for the
+                  last cacheSize contexts drawn from are kept.
+        """
+        self.tokens = []
+        self.tokenIds = {}
+        stream = []
+        for sentence in NGramModel().prepData(text):
+            stream.extend(self.addToken(token) for token in sentence)
+        dtype = np.int32 if len(stream) < 2 ** 31 else np.int64
+        self.reversed = np.array(stream[::-1], dtype)
+        self.suffixes = suffixArray(self.reversed).astype(dtype)
+        self.maxContext = maxContext
+        if maxContext is None:
+            self.order = len(stream) + 1
+        else:
+            self.order = maxContext + 1
+
+        # the empty context draws like UnigramModel, without start symbols
+        counts = np.bincount(self.reversed, minlength = len(self.tokens))
+        for token in ('^::^', '^:::^'):
+            counts[self.tokenIds[token]] = 0
+        self.unigramCandidates = dict((self.tokens[i], int(counts[i]))
+                                      for i in np.flatnonzero(counts))
+        self.samplers = OrderedDict()
+        self.cacheSize = cacheSize
+
+    def addToken(self, token):
+        """
+        Requires: nothing
+        Modifies: self.tokens, self.tokenIds
+        Effects:  returns the id of token, giving it the next free id if it
+                  does not have one yet.
+        """
+        if token not in self.tokenIds:
+            self.tokenIds[token] = len(self.tokens)
+            self.tokens.append(token)
+        return self.tokenIds[token]
+
+    def narrow(self, lo, hi, depth, tokenId):
+        """
+        Requires: the suffixes in [lo, hi) all share their first depth
+                  tokens
+        Modifies: nothing
+        Effects:  returns the range of those suffixes whose token at depth
+                  is tokenId, found by binary search; suffixes too short to
+                  have a token there sort first.
+        """
+        suffixes, stream, n = self.suffixes, self.reversed, len(self.reversed)
+        def tokenAt(i):
+            pos = suffixes[i] + depth
+            return stream[pos] if pos < n else -1
+        a, b = lo, hi
+        while a < b:
+            mid = (a + b) // 2
+            if tokenAt(mid) < tokenId:
+                a = mid + 1
+            else:
+                b = mid
+        start = a
+        b = hi
+        while a < b:
+            mid = (a + b) // 2
+            if tokenAt(mid) <= tokenId:
+                a = mid + 1
+            else:
+                b = mid
+        return start, a
+
+    def longestMatch(self, sentence):
+        """
+        Requires: sentence is a list of tokens
+        Modifies: nothing
+        Effects:  returns (k, lo, hi): the largest k, up to maxContext,
+                  such that the last k tokens of sentence occur in the
+                  corpus followed by another token, and the range of the
+                  suffix array holding those occurrences.
+        """
+        lo, hi = 0, len(self.suffixes)
+        match = (0, lo, hi)
+        limit = len(sentence)
+        if self.maxContext is not None:
+            limit = min(limit, self.maxContext)
+        for k in range(1, limit + 1):
+            if hi - lo <= self.FEW:
+                return self.extendMatch(sentence, match, limit)
+            tokenId = self.tokenIds.get(sentence[-k])
+            if tokenId is None:
+                break
+            lo, hi = self.narrow(lo, hi, k - 1, tokenId)
+            # the suffix at position 0 is the end of the corpus, which no
+            # token follows
+            if hi - lo - (self.suffixes[lo:hi] == 0).any() <= 0:
+                break
+            match = (k, lo, hi)
+        return match
+
+    # ranges of at most this many suffixes are matched by extendMatch
+    FEW = 16
+
+    def extendMatch(self, sentence, match, limit):
+        """
+        Requires: match is (k, lo, hi) for the last k tokens of sentence,
+                  with few suffixes in [lo, hi)
+        Modifies: nothing
+        Effects:  returns the longest match as longestMatch does, by
+                  comparing the rest of the context with each of the few
+                  suffixes at once, a block of tokens at a time, instead of
+                  narrowing the range one token at a time.
+        """
+        k, lo, hi = match
+        starts = self.suffixes[lo:hi].astype(np.int64)
+        n = len(self.reversed)
+        common = np.zeros(len(starts), np.int64) + k
+        matching = np.ones(len(starts), bool)
+        block = 32
+        done = k
+        while done < limit and matching.any():
+            width = min(block, limit - done)
+            context = [self.tokenIds.get(token, -1) for token in
+                       sentence[len(sentence) - done - width:len(sentence) - done][::-1]]
+            positions = starts[:, None] + done + np.arange(width)
+            window = np.where(positions < n, self.reversed[np.minimum(positions, n - 1)], -2)
+            equal = (window == context) & matching[:, None]
+            run = np.where(equal.all(axis = 1), width, np.argmin(equal, axis = 1))
+            common += np.where(matching, run, 0)
+            matching &= run == width
+            done += width
+            block *= 2
+        # the suffix at position 0 is the end of the corpus, which no token
+        # follows
+        best = common[starts > 0].max()
+        inside = np.flatnonzero(common >= best)
+        return best, lo + inside[0], lo + inside[-1] + 1
+
+    def getCandidateDictionary(self, sentence):
+        """
+        Requires: sentence is a list of tokens
+        Modifies: nothing
+        Effects:  returns the dictionary of the tokens that follow the
+                  longest match of the end of sentence in the corpus, with
+                  their counts, by scanning its range of the suffix array.
+        """
+        k, lo, hi = self.longestMatch(sentence)
+        return self.candidates(k, lo, hi)
+
+    def candidates(self, k, lo, hi):
+        """
+        Requires: (k, lo, hi) is a match as longestMatch returns it
+        Modifies: nothing
+        Effects:  returns the {token: count} dictionary of the tokens that
+                  follow the match; for k = 0, the unigram counts.
+        """
+        if k == 0:
+            return self.unigramCandidates
+        starts = self.suffixes[lo:hi]
+        following = self.reversed[starts[starts > 0] - 1]
+        ids, counts = np.unique(following, return_counts = True)
+        return dict((self.tokens[i], c) for i, c in zip(ids.tolist(), counts.tolist()))
+
+    def lookup(self, sentence, rng=None):
+        """
+        Requires: sentence is a list of tokens; rng is not used, the index
+                  never backs off to a shorter match
+        Modifies: self.samplers
+        Effects:  returns a CandidateSampler for the longest match of the
+                  end of sentence, like BackoffIndex.lookup, so that the
+                  generators can use this index in place of a list of
+                  models.
+        """
+        k, lo, hi = self.longestMatch(sentence)
+        key = (k, lo, hi)
+        if key in self.samplers:
+            sampler = self.samplers.pop(key)
+        else:
+            sampler = CandidateSampler(self.candidates(k, lo, hi), self)
+            if len(self.samplers) >= self.cacheSize:
+                self.samplers.popitem(last = False)
+        self.samplers[key] = sampler
+        return sampler
+
+    def getNextToken(self, sentence, rng=random):
+        """
+        Requires: sentence is a list of tokens, rng is a random.Random (the
+                  random module by default)
+        Modifies: self.samplers, the state of rng
+        Effects:  returns the next token for sentence, drawn from the
+                  tokens following its longest match.
+        """
+        return self.lookup(sentence).draw(rng)
+
+
+# -----------------------------------------------------------------------------
+# Testing code ----------------------------------------------------------------
+
+if __name__ == '__main__':
+    text = [ ['the', 'quick', 'brown', 'fox'], ['the', 'lazy', 'dog'],
+             ['a', 'quick', 'brown', 'cat'] ]
+    index = SuffixArrayIndex(text)
+    print index.longestMatch(['the', 'quick', 'brown'])
+    print index.getCandidateDictionary(['the', 'quick', 'brown'])
+    print index.getCandidateDictionary(['a', 'quick', 'brown'])
+    print index.getCandidateDictionary(['quick', 'brown'])
+    print index.getCandidateDictionary(['zebra'])
+    print index.getNextToken(['^::^', '^:::^'])
@@ -18,6 +18,7 @@ class TrigramModel(NGramModel):
                   from the NGramModel class.
         """
         super(TrigramModel, self).__init__()
+        self.n = 3
 
     def trainModel(self, text):
         """
@@ -36,6 +37,9 @@ class TrigramModel(NGramModel):
                   self.nGramCounts. For more details, see the spec.
         """
         
+        # the rankings of the old counts would be stale
+        self.ranked.clear()
+
         # builds a dictionary of potential trigrams and their counts
 
         text = self.prepData(text)
@@ -62,10 +66,9 @@ class TrigramModel(NGramModel):
         """
         # returns true if model has seen the second to last and last words in current sentence at start of trigram
         if sentence[-2] in self.nGramCounts:
-          if sentence[-1] in self.nGramCounts:
+          if sentence[-1] in self.nGramCounts[sentence[-2]]:
             return True
-        else:
-            return False
+        return False
 
     def getCandidateDictionary(self, sentence):
         """
@@ -19,6 +19,7 @@ class UnigramModel(NGramModel):
                   constructor.
         """
         super(UnigramModel, self).__init__()
+        self.n = 1
 
     def trainModel(self, text):
         """
@@ -34,6 +35,8 @@ class UnigramModel(NGramModel):
                   symbols to be included as their own tokens in
                   self.nGramCounts. For more details, see the spec.
         """
+        # the rankings of the old counts would be stale
+        self.ranked.clear()
         text = self.prepData(text)
 
         # builds a dictionary of potential n-grams and their counts
@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+
+"""
+Lazy registry of the PySynth engines.
+
+An engine module is only imported, and its tables only computed, the first
+time it is asked for. Scripts that can render with any of the engines thus
+start without loading NumPy or any engine they end up not using.
+"""
+
+import importlib
+
+# Engine name -> module. The names match the --sound options of menv.py.
+ENGINES = {
+	'a': 'pysynth',
+	'b': 'pysynth_b',
+	'e': 'pysynth_e',
+	's': 'pysynth_s',
+	'beeper': 'pysynth_beeper',
+}
+
+def get(name):
+	''' Return the engine registered under name, importing it on first use.'''
+
+	return importlib.import_module(ENGINES[name])
+
+def register(name, module):
+	''' Make the module with the given name available as engine name.'''
+
+	ENGINES[name] = module
+
+def names():
+	''' Names of all registered engines.'''
+
+	return sorted(ENGINES)
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+"""
+Attack and decay envelope tables for the piano engines (pysynth_b, _e).
+
+The tables only depend on the sample rate, so they are interpolated once
+per rate with np.interp and then shared by every render of every engine.
+They are read-only; copy them before changing anything.
+"""
+
+import numpy as np
+from math import log
+
+# Attack envelopes as (sample at 44.1 kHz, level) breakpoints: the treble
+# one for high and loud notes, the bass one for low and soft notes.
+ATT_TREB = ((0,0.), (100, .2), (300, .7), (400, .6), (600, .25), (800, .9), (1000, 1.25), (2000,1.15), (3000, 1.))
+ATT_BASS = ((0,0.), (100, .1), (300, .2), (400, .15), (600, .1), (800, .9), (1000, 1.25), (2000,1.15), (3000, 1.))
+
+# Decay time in seconds over log(frequency), as (log(hz), log(time))
+# breakpoints. The table is indexed with int(100 * log(hz)).
+DECAY = ( (0,log(3)), (3,log(5)), (5, log(1.)), (6, log(.8)), (9,log(.1)) )
+
+_tables = {}
+
+def _interp(points, x):
+	return np.interp(x, [float(v[0]) for v in points], [v[1] for v in points])
+
+def tables(rate = 44100):
+	''' Return (att_treb, att_bass, decay) for the given sample rate.'''
+
+	if rate not in _tables:
+		att_len = int(3000 * rate / 44100.)
+		x = np.arange(att_len) * 44100. / rate
+		att_treb = _interp(ATT_TREB, x)
+		att_bass = _interp(ATT_BASS, x)
+		decay = np.zeros(1000)
+		decay[:900] = np.exp(_interp(DECAY, np.arange(900) / 100.))
+		for table in (att_treb, att_bass, decay):
+			table.flags.writeable = False
+		_tables[rate] = att_treb, att_bass, decay
+	return _tables[rate]
+
+def attack(rate = 44100):
+	''' Return the treble and bass attack envelopes for the given sample rate.'''
+
+	return tables(rate)[:2]
+
+def decay(rate = 44100):
+	''' Return the decay time table for the given sample rate.'''
+
+	return tables(rate)[2]
@@ -6,7 +6,7 @@ Pranav Ravichandran (me@onloop.net)
 """
 
 import play_wav
-import pysynth, pysynth_b, pysynth_s
+import engines
 import wave
 import sys
 import os
@@ -32,6 +32,8 @@ class mEnv:
 	instrument = ''
 	outFile = ''
 	trashFile = True
+	renderSound = None
+	options = {}
 	def __init__(self):
 		''' Constructor class. '''
 
@@ -41,12 +43,11 @@ class mEnv:
 		self.parse(cliInput)
 
 		# Different cases of input, when optional argument 'sound' is given.
-		if self.instrument == 'a' or self.instrument == '':
-			self.synthSounds(pysynth, self.outFile)
-		elif self.instrument == 'b':
-			self.synthSounds(pysynth_b, self.outFile)
-		elif self.instrument == 's':
-			self.synthSounds(pysynth_s, self.outFile)
+		# Engines are only imported once they are asked for.
+		if self.instrument == '':
+			self.synthSounds(engines.get('a'), self.outFile)
+		elif self.instrument in ('a', 'b', 's'):
+			self.synthSounds(engines.get(self.instrument), self.outFile)
 		else:
 			print invalidOption
 			mEnv()
@@ -113,13 +114,30 @@ class mEnv:
 				i += 1
 
 	def play(self, outFile):
-		''' Open the .wav file and play it.'''
+		''' Play the sound while it is being rendered, or open the .wav file and play it.'''
 
 		if outFile == '':
 			outFile = 'temp.wav'
 
 		a = play_wav.Sound()
-		a.playFile(outFile)
+		if self.renderSound is None:
+			a.playFile(outFile)
+			return
+
+		sink = play_wav.default_sink(outFile)
+		a.playStream(lambda player: self.renderSound.stream(self.synthParam,
+			player, silent = True, **self.options), sink)
+		if isinstance(sink, play_wav.FileSink):
+			self.trashFile = False
+			print 'No audio output found. Saved to ' + outFile
+
+	def save(self, outFile):
+		''' Render the sound to a .wav file.'''
+
+		if outFile == '':
+			outFile = 'temp.wav'
+
+		self.renderSound.make_wav(self.synthParam, fn = outFile, silent = True, **self.options)
 
 	def removeFile(self, outFile):
 		''' Delete the .wav file.'''
@@ -127,25 +145,28 @@ class mEnv:
 		if outFile == '':
 			outFile = 'temp.wav'
 
-		if self.trashFile:
+		if self.trashFile and os.path.exists(outFile):
 			os.remove(outFile)
 
 	def synthSounds(self, renderSound, outFile):
-		''' Render sound with pysynth_a, pysynth_b or pysynth_s based on user preference.'''
+		''' Render sound with pysynth_a, pysynth_b or pysynth_s based on user preference.
 
-		if outFile == '':
-			outFile = 'temp.wav'
+		Unless the sound is to be saved, rendering is left to play(), which
+		streams it to the audio output while it is being rendered.'''
+
+		# Optional arguments 'bpm' and 'repeat' are only passed when given.
+		self.options = {}
+		if self.bpmVal:
+			self.options['bpm'] = self.bpmVal
+		if self.repeatVal:
+			self.options['repeat'] = self.repeatVal
+
+		if self.trashFile:
+			self.renderSound = renderSound
+			return
 
 		try:
-			# Different cases of input, when optional arguments 'bpm' and 'repeat' are given.
-			if self.bpmVal and self.repeatVal:
-				renderSound.make_wav(self.synthParam, fn = outFile, silent = True, bpm = self.bpmVal, repeat = self.repeatVal)
-			elif self.bpmVal:
-				renderSound.make_wav(self.synthParam, fn = outFile, silent = True, bpm = self.bpmVal)
-			elif self.repeatVal:
-				renderSound.make_wav(self.synthParam, fn = outFile, silent = True, repeat = self.repeatVal)
-			else:
-				renderSound.make_wav(self.synthParam, fn = outFile, silent = True)
+			renderSound.make_wav(self.synthParam, fn = outFile, silent = True, **self.options)
 		except KeyError:
 			print warningStr
 			mEnv()
@@ -161,9 +182,13 @@ if __name__ == "__main__":
 		a = mEnv()
 		try:
 			a.play(a.outFile)
+		except KeyError:
+			print warningStr
 		except:
 			a.trashFile = False
 			if a.outFile == '':
 				a.outFile = 'temp.wav'
+			if a.renderSound is not None:
+				a.save(a.outFile)
 			print 'Could not play file. Saved to ' + a.outFile
 		a.removeFile(a.outFile)
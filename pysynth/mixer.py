@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+"""
+Overlap-add mixing shared by the NumPy engines (pysynth_b, _e and _s).
+
+An engine schedules a song as a list of note events (nn, pos, args): nn is
+the index of the note in the song, pos the sample the note starts at and
+args the arguments for the engine's note renderer, which returns the
+samples of that note including its decaying tail. Events are in order of
+pos, so once a note has been added everything before its start is final.
+"""
+
+import multiprocessing
+import numpy as np
+
+def _progress(nn, total, silent):
+	if not nn % 4 and silent == False:
+		print "[%u/%u]\t" % (nn+1, total)
+
+def mix(events, render_note, length, extra = (), total = 0, silent = False, workers = 1):
+	''' Render all note events and add them into one buffer of the given
+	length. With workers other than 1, this is done by mix_parallel.'''
+
+	if workers != 1:
+		return mix_parallel(events, render_note, length, extra, total, silent, workers)
+	data = np.zeros(length)
+	for nn, pos, args in events:
+		_progress(nn, total, silent)
+		snd = render_note(*(args + extra))
+		data[pos:pos+len(snd)] += snd
+	return data
+
+def mix_blocks(events, render_note, length, out_len, extra = (), total = 0, silent = False, block = 4096):
+	''' Like mix, but yield the first out_len samples in blocks of the given
+	size as soon as no later note can change them any more.
+
+	The blocks are views into the mix buffer, so use them before asking
+	for the next one.'''
+
+	data = np.zeros(length)
+	done = 0
+	for nn, pos, args in events:
+		while pos >= done + block and done < out_len:
+			yield data[done:min(done + block, out_len)]
+			done += block
+		_progress(nn, total, silent)
+		snd = render_note(*(args + extra))
+		data[pos:pos+len(snd)] += snd
+	while done < out_len:
+		yield data[done:min(done + block, out_len)]
+		done += block
+
+# Set in each worker process of mix_parallel.
+_job = None
+
+def _init_worker(events, render_note, extra):
+	global _job
+	_job = events, render_note, extra
+
+def _render_segment(bounds):
+	''' Render the notes of one segment. Up to split, as long after the
+	earliest of them as the longest is, send back every note on its own;
+	after split, their sum in note order.'''
+
+	events, render_note, extra = _job
+	notes = [(pos, render_note(*(args + extra))) for nn, pos, args in events[bounds[0]:bounds[1]]]
+	split = min(pos for pos, snd in notes) + max(len(snd) for pos, snd in notes)
+	heads = [snd[:max(split - pos, 0)] for pos, snd in notes]
+	data = np.zeros(max(max(pos + len(snd) for pos, snd in notes) - split, 0))
+	for pos, snd in notes:
+		if pos + len(snd) > split:
+			skip = max(split - pos, 0)
+			data[pos+skip-split:pos+len(snd)-split] += snd[skip:]
+	return split, heads, data
+
+def segments(events, count):
+	''' Cut the timeline up to the start of the last note into count spans
+	of equal duration and return the (first, last + 1) event indices of the
+	non-empty ones. A dotted rest moves the position back, so the cuts
+	are made on the latest start so far.'''
+
+	if not events:
+		return []
+	positions = np.maximum.accumulate([pos for nn, pos, args in events])
+	starts = np.searchsorted(positions,
+		np.arange(count + 1) * (positions[-1] + 1) / float(count))
+	starts[-1] = len(events)
+	return [(lo, hi) for lo, hi in zip(starts[:-1], starts[1:]) if hi > lo]
+
+def mix_parallel(events, render_note, length, extra = (), total = 0, silent = False, workers = None, per_worker = 4):
+	''' Like mix, but render the notes in a pool of worker processes, with
+	exactly the same result.
+
+	The notes are cut into per_worker segments for each worker. A worker
+	renders the notes starting in its segment, tails included even where
+	they spill into later segments, and sends back their beginnings one
+	by one and the rest summed (see _render_segment). The parent adds the
+	segments into the buffer in timeline order. A sum is only added where
+	no earlier note reaches, so that every sample is added up in note
+	order as in mix: where the tails of earlier segments reach past the
+	split, the notes are rendered again in the parent and added one by
+	one up to there. render_note has to be a module-level function.'''
+
+	workers = workers or multiprocessing.cpu_count()
+	pool = multiprocessing.Pool(workers, _init_worker, (events, render_note, extra))
+	try:
+		data = np.zeros(length)
+		# the end of the longest tail added so far
+		reach = 0
+		bounds = segments(events, workers * per_worker)
+		for (lo, hi), (split, heads, seg) in zip(bounds, pool.imap(_render_segment, bounds)):
+			ends = [split + len(seg)]
+			for (nn, pos, args), head in zip(events[lo:hi], heads):
+				_progress(nn, total, silent)
+				data[pos:pos+len(head)] += head
+				ends.append(pos + len(head))
+				if pos < reach and reach > split:
+					skip = max(split - pos, 0)
+					snd = render_note(*(args + extra))[skip:reach-pos]
+					data[pos+skip:pos+skip+len(snd)] += snd
+			skip = max(reach - split, 0)
+			data[split+skip:split+len(seg)] += seg[skip:]
+			reach = max([reach] + ends)
+		pool.close()
+	finally:
+		pool.terminate()
+	return data
+
+def tile(data, pass_len, repeat):
+	''' Assemble a song played repeat+1 times from the mix of a single pass.
+
+	data holds one pass including the tails of its last notes, pass_len is
+	the length of a pass in samples as returned by schedule. Each further
+	pass is added pass_len samples after the previous one, so the tails ring
+	on into the next pass just as when every note is rendered again.'''
+
+	if not repeat:
+		return data
+	out = np.zeros(int(repeat * pass_len) + len(data))
+	for rp in range(repeat + 1):
+		off = int(rp * pass_len)
+		out[off:off+len(data)] += data
+	return out
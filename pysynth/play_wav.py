@@ -9,6 +9,14 @@ import wave
 import os
 import sys
 import string
+import threading
+
+try:
+	import Queue as queue
+except ImportError:
+	import queue
+
+import wav_io
 
 pyaudioFound = False
 tkSnackFound = False
@@ -28,6 +36,113 @@ except ImportError:
 		except ImportError:
 			print "Audio playback frameworks not found. Install one of pyaudio, tkSnack or pyglet."
 
+class PyAudioSink:
+	''' Play raw 16-bit mono PCM through pyaudio as it arrives.'''
+
+	def __init__(self):
+		self.p = pyaudio.PyAudio()
+		self.stream = self.p.open(format = self.p.get_format_from_width(2),
+		                          channels = 1,
+		                          rate = wav_io.SAMPLING_RATE,
+		                          output = True)
+
+	def write(self, data):
+		self.stream.write(data)
+
+	def close(self):
+		self.stream.stop_stream()
+		self.stream.close()
+		self.p.terminate()
+
+class PipeSink:
+	''' Pipe raw 16-bit mono PCM into a console player such as aplay.'''
+
+	def __init__(self, command):
+		import subprocess
+		self.proc = subprocess.Popen(command, shell = True, stdin = subprocess.PIPE)
+
+	def write(self, data):
+		self.proc.stdin.write(data)
+
+	def close(self):
+		self.proc.stdin.close()
+		self.proc.wait()
+
+class FileSink:
+	''' Write the PCM to a .wav file as it arrives, when nothing can play it.'''
+
+	def __init__(self, fn):
+		self.fn = fn
+		self.f = wav_io.open_wav(fn)
+
+	def write(self, data):
+		self.f.writeframesraw(data)
+
+	def close(self):
+		self.f.close()
+
+def pcm_player():
+	''' Command line of a console player reading raw PCM from stdin, if any.'''
+
+	player = os.getenv("PCM_PLAYER")
+	if player:
+		return player
+	from distutils.spawn import find_executable
+	if find_executable("aplay"):
+		return "aplay -q -t raw -f S16_LE -c 1 -r %u" % wav_io.SAMPLING_RATE
+	if find_executable("play"):
+		return "play -q -t raw -e signed -b 16 -c 1 -r %u -" % wav_io.SAMPLING_RATE
+	return None
+
+def default_sink(fn = 'temp.wav'):
+	''' Pick the best available live output: pyaudio, then a PCM pipe, then a .wav file.'''
+
+	if pyaudioFound:
+		return PyAudioSink()
+	player = pcm_player()
+	if player:
+		return PipeSink(player)
+	return FileSink(fn)
+
+class StreamPlayer:
+	''' Play audio while it is still being rendered.
+
+	An engine's stream() hands over blocks with writeframesraw. They pass
+	through a bounded queue to a playback thread that feeds the sink, so
+	rendering never gets more than maxBlocks ahead of playback.'''
+
+	def __init__(self, sink = None, maxBlocks = 16):
+		self.sink = sink or default_sink()
+		self.queue = queue.Queue(maxBlocks)
+		self.error = None
+		self.thread = threading.Thread(target = self.run)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def run(self):
+		while True:
+			data = self.queue.get()
+			if data is None:
+				break
+			# After a sink error keep draining, so the renderer never blocks.
+			if self.error is None:
+				try:
+					self.sink.write(data)
+				except Exception as e:
+					self.error = e
+
+	def writeframesraw(self, data):
+		if self.error is not None:
+			raise self.error
+		self.queue.put(data)
+
+	def close(self):
+		self.queue.put(None)
+		self.thread.join()
+		self.sink.close()
+		if self.error is not None:
+			raise self.error
+
 class Sound:
 	def __init__(self, fn = None):
 		pass
@@ -48,6 +163,44 @@ class Sound:
 			else:
 				self.play_media(mediaFile)
 
+	def playData(self, data, repeat = 0):
+		''' Play rendered audio (a NumPy array or 16-bit PCM frames) without a .wav file.'''
+
+		if not pyaudioFound:
+			# The other backends only play files, so hand them a temporary one.
+			import tempfile
+			fd, mediaFile = tempfile.mkstemp(suffix = '.wav')
+			os.close(fd)
+			try:
+				wav_io.write_wav(mediaFile, data)
+				self.playFile(mediaFile, repeat)
+			finally:
+				os.remove(mediaFile)
+			return
+
+		raw = wav_io.to_bytes(data)
+		p = pyaudio.PyAudio()
+		stream = p.open(format = p.get_format_from_width(2),
+		                channels = 1,
+		                rate = wav_io.SAMPLING_RATE,
+		                output = True)
+		for n in range(repeat + 1):
+			stream.write(raw)
+		stream.stop_stream()
+		stream.close()
+
+		p.terminate()
+
+	def playStream(self, render, sink = None):
+		''' Play audio while render(player) is producing it, e.g.
+		lambda player: pysynth_b.stream(song, player).'''
+
+		player = StreamPlayer(sink)
+		try:
+			render(player)
+		finally:
+			player.close()
+
 	def play_pyaudio(self, mediaFile):
 		''' Use pyaudio backend to play the .wav.'''
 
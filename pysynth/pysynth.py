@@ -140,14 +140,18 @@ harm_max = 4.
 ##########################################################################
 
 import wave, math, struct
-
-def make_wav(song,bpm=150,transpose=0,pause=.05,boost=1.9,repeat=0,fn="out.wav", silent=False):
-	f=wave.open(fn,'w')
-
-	f.setnchannels(1)
-	f.setsampwidth(2)
-	f.setframerate(44100)
-	f.setcomptype('NONE','Not Compressed')
+import wav_io
+
+def render_raw(song,bpm=150,transpose=0,pause=.05,boost=1.9,repeat=0,silent=False,sink=None):
+	"""
+	Render the song in memory and return the 16-bit PCM frames as a string.
+	Works without NumPy; use render() to get an array instead.
+	If a sink is given, each note goes to sink.writeframesraw as soon as
+	it is rendered and nothing is returned.
+	With repeat, the waveform of each distinct note is only rendered once;
+	later passes write it again with the silence that keeps it in time.
+	"""
+	f = sink if sink is not None else wav_io.BufferSink()
 
 	bpmfac = 120./bpm
 
@@ -190,49 +194,80 @@ def make_wav(song,bpm=150,transpose=0,pause=.05,boost=1.9,repeat=0,fn="out.wav",
 	         ow=ow+sixteenbit((asin(float(x)/l[0])
 	              +harm*asin(float(x)/(l[0]/2.))
 	              +.5*harm*asin(float(x)/(l[0]/4.)))/4.*fac*vol*dfac*volfac)
+	    return ow
+
+	def place(ow):
+	    # the silence after a note makes up for the samples the notes
+	    # before it fell short by, in earlier passes too
+	    q = len(ow) // 2
 	    fill = max(int(ex_pos - curpos - q), 0)
 	    f.writeframesraw((ow)+(sixteenbit(0)*fill))
 	    return q + fill
 
+	curpos = 0
+	ex_pos = 0.
+	waves = {}
+	for nn, x in enumerate(song * (repeat+1)):
+	    if not nn % 4 and nn < len(song) and silent == False:
+	        print "[%u/%u]\t" % (nn+1,len(song))
+	    if x[0]!='r':
+	        if x[0][-1] == '*':
+	            vol = boost
+	            note = x[0][:-1]
+	        else:
+	            vol = 1.
+	            note = x[0]
+		try:
+	            a=pitchhz[note]
+		except:
+	            a=pitchhz[note + '4']	# default to fourth octave
+	        a = a * 2**transpose
+	        if x[1] < 0:
+	            b=length(-2.*x[1]/3.)
+	        else:
+	            b=length(x[1])
+		ex_pos = ex_pos + b
+	        if (a,b,vol) not in waves:
+	            waves[(a,b,vol)] = render2(a,b,vol)
+	        curpos = curpos + place(waves[(a,b,vol)])
+
+	    if x[0]=='r':
+	        b=length(x[1])
+		ex_pos = ex_pos + b
+	        f.writeframesraw(sixteenbit(0)*int(b))
+		curpos = curpos + int(b)
+
+	if sink is None:
+		return f.getvalue()
+
+def stream(song,sink,bpm=150,transpose=0,pause=.05,boost=1.9,repeat=0,silent=False):
+	"""
+	Render the song into sink (anything with writeframesraw, such as a
+	play_wav.StreamPlayer) note by note, so playback can start right away.
+	"""
+	render_raw(song, bpm, transpose, pause, boost, repeat, silent, sink)
+
+def render(song,bpm=150,transpose=0,pause=.05,boost=1.9,repeat=0,silent=False,dtype=None,out=None):
+	"""
+	Render the song and return it as a NumPy int16 array (or float32 in
+	[-1, 1) with dtype=numpy.float32). If out is given, the samples are
+	written into that array and a view of it is returned.
+	"""
+	raw = render_raw(song, bpm, transpose, pause, boost, repeat, silent)
+	return wav_io.from_bytes(raw, dtype, out)
+
+def make_wav(song,bpm=150,transpose=0,pause=.05,boost=1.9,repeat=0,fn="out.wav", silent=False):
+	"""
+	Render the song and write it as a WAV file. fn may be a file name or a
+	writable file-like object.
+	"""
 	##########################################################################
 	# Write to output file (in WAV format)
 	##########################################################################
 
 	if silent == False:
 		print "Writing to file", fn
-	curpos = 0
-	ex_pos = 0.
-	for rp in range(repeat+1):
-		for nn, x in enumerate(song):
-		    if not nn % 4 and silent == False:
-		        print "[%u/%u]\t" % (nn+1,len(song))
-		    if x[0]!='r':
-		        if x[0][-1] == '*':
-		            vol = boost
-		            note = x[0][:-1]
-		        else:
-		            vol = 1.
-		            note = x[0]
-			try:
-		            a=pitchhz[note]
-			except:
-		            a=pitchhz[note + '4']	# default to fourth octave
-		        a = a * 2**transpose
-		        if x[1] < 0:
-		            b=length(-2.*x[1]/3.)
-		        else:
-		            b=length(x[1])
-			ex_pos = ex_pos + b
-		        curpos = curpos + render2(a,b,vol)
-
-		    if x[0]=='r':
-		        b=length(x[1])
-			ex_pos = ex_pos + b
-		        f.writeframesraw(sixteenbit(0)*int(b))
-			curpos = curpos + int(b)
-
-	f.writeframes('')
-	f.close()
+	wav_io.write_wav(fn, render_raw(song, bpm, transpose, pause, boost, repeat, silent))
 	print
 
 def mix_files(a, b, c, chann = 2, phase = -1.):
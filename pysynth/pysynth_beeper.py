@@ -1,7 +1,8 @@
 import logging
 import math
 import struct 
-import wave
+
+import wav_io
 
 LOG = logging.getLogger("pysynth_beeper")
 SAMPLING_RATE = 44100
@@ -14,13 +15,13 @@ for k in range(88):
     note = '%s%u' % (keys_s[k % 12], oct)
     PITCHHZ[note] = freq
 
-def make_wav(song, tempo=120, transpose=0, fn="out.wav"):
-    f = wave.open(fn, 'w')
+def render_raw(song, tempo=120, transpose=0, sink=None):
+    """Render the song in memory and return the 16-bit PCM frames.
 
-    f.setnchannels(1)
-    f.setsampwidth(2)
-    f.setframerate(SAMPLING_RATE)
-    f.setcomptype('NONE', 'Not Compressed')
+    If a sink is given, each note goes to sink.writeframesraw as soon as it
+    is rendered and nothing is returned.
+    """
+    f = sink if sink is not None else wav_io.BufferSink()
 
     # Define a waveform that looks something like this
     # \        /
@@ -110,4 +111,20 @@ def make_wav(song, tempo=120, transpose=0, fn="out.wav"):
             LOG.debug("%d Hz for %d samples" % (freq, duration))
             beep(freq, duration, f)
 
-    f.close()
+    if sink is None:
+        return f.getvalue()
+
+
+def stream(song, sink, tempo=120, transpose=0):
+    """Render the song into sink note by note, e.g. a play_wav.StreamPlayer."""
+    render_raw(song, tempo, transpose, sink)
+
+
+def render(song, tempo=120, transpose=0, dtype=None, out=None):
+    """Render the song and return it as a NumPy int16 (or float) array."""
+    return wav_io.from_bytes(render_raw(song, tempo, transpose), dtype, out)
+
+
+def make_wav(song, tempo=120, transpose=0, fn="out.wav"):
+    """Render the song to fn, a file name or a writable file-like object."""
+    wav_io.write_wav(fn, render_raw(song, tempo, transpose))
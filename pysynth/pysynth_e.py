@@ -33,6 +33,7 @@
 
 import wave, struct
 import numpy as np
+import envelopes, mixer, wav_io
 from math import sin, cos, pi, log, exp
 
 # Example 1: The C major scale
@@ -149,18 +150,17 @@ for k in range(88):
 
 harmtab = np.zeros((88, 20))
 
+harmo_keys = [float(v[0]) for v in harmo]
 for h in range(1, len(harmo[0])):
-	dat = []
-	for n in range(len(harmo)):
-		dat.append((float(harmo[n][0]), harmo[n][h]))
-	for h2 in range(88):
-		harmtab[h2,h] = linint(dat, h2+1)
+	harmtab[:,h] = np.interp(np.arange(1, 89), harmo_keys, [v[h] for v in harmo])
 
 #print harmtab[keynum['c4'],:]
-for h2 in range(88):
-	for n in range(20):
-		ref = harmtab[h2,1]
-		harmtab[h2,n] = 10.**((harmtab[h2,n] - ref)/20.)
+# Relative to the fundamental; the columns after it have always been taken
+# relative to the already converted fundamental, i.e. to 1 dB.
+ref = harmtab[:,1].copy()
+harmtab[:,0] = 10.**((harmtab[:,0] - ref)/20.)
+harmtab[:,1] = 1.
+harmtab[:,2:] = 10.**((harmtab[:,2:] - 1.)/20.)
 #print harmtab[keynum['c4'],:]
 
 ##########################################################################
@@ -190,75 +190,68 @@ for h2 in range(88):
 # Suggested range: between 3. and 5., depending on the frequency response
 #  of speakers/headphones used
 harm_max = 5.
+
+# Loudest raw sample expected in a mix; stream() scales to this because it
+# cannot normalize a mix that is still being rendered.
+STREAM_PEAK = 5.
 ##########################################################################
 
 data = []
 note_cache = {}
 cache_this = {}
 
-def make_wav(song,bpm=120,transpose=0,leg_stac=.9,boost=1.1,repeat=0,fn="out.wav", silent=False):
-	f=wave.open(fn,'w')
-
-	f.setnchannels(1)
-	f.setsampwidth(2)
-	f.setframerate(44100)
-	f.setcomptype('NONE','Not Compressed')
-
-	bpmfac = 120./bpm
-
-	def length(l):
-	    return 88200./l*bpmfac
-
-	def waves2(hz,l):
-	    a=44100./hz
-	    b=float(l)/44100.*hz
-	    return [a,round(b)]
-
-	att_len = 3000
-	att_bass = np.zeros(att_len)
-	att_treb = np.zeros(att_len)
-	for n in range(att_len):
-		att_treb[n] = linint(((0,0.), (100, .2), (300, .7), (400, .6), (600, .25), (800, .9), (1000, 1.25), (2000,1.15), (3000, 1.)), n)
-		att_bass[n] = linint(((0,0.), (100, .1), (300, .2), (400, .15), (600, .1), (800, .9), (1000, 1.25), (2000,1.15), (3000, 1.)), n)
-	decay = np.zeros(1000)
-	for n in range(900):
-		decay[n] = exp(linint(( (0,log(3)), (3,log(5)), (5, log(1.)), (6, log(.8)), (9,log(.1)) ), n/100.))
-
-	def zz(a):
-		for q in range(len(a)):
-			if a[q] < 0: a[q] = 0
-
-	def render2(a, b, vol, pos, knum, note):
-	    l=waves2(a, b)
-	    q=int(l[0]*l[1])
-	    lf = log(a)
-	    snd_len = max(int(3.1*q), 44100)
-
-	    raw_note = 12*44100
-	    if note not in note_cache.keys():
-	        x2 = np.arange(raw_note)
-	    	sina = 2. * pi * x2 / float(l[0])
-	    	sina14 = 14. * 2. * pi * x2 / float(l[0])
-	    	amp1 = 1. - (x2/snd_len)
+def waves2(hz,l):
+    a=44100./hz
+    b=float(l)/44100.*hz
+    return [a,round(b)]
+
+def zz(a):
+	for q in range(len(a)):
+		if a[q] < 0: a[q] = 0
+
+def render_note(a, b, vol, kn, note, leg_stac, decay):
+	"Render one note, including its decaying tail, as a float array."
+	l=waves2(a, b)
+	q=int(l[0]*l[1])
+	lf = log(a)
+	snd_len = max(int(3.1*q), 44100)
+
+	raw_note = 12*44100
+	if note not in note_cache:
+		x2 = np.arange(raw_note)
+		sina = 2. * pi * x2 / float(l[0])
+		sina14 = 14. * 2. * pi * x2 / float(l[0])
+		amp1 = 1. - (x2/snd_len)
 		amp2 = 1. - (4*x2/snd_len)
-	    	amp_3to6 = 1. - (.25*x2/snd_len)
-	    	zz(amp1)
-	    	zz(amp2)
-	    	zz(amp_3to6)
-	   	new = (
+		amp_3to6 = 1. - (.25*x2/snd_len)
+		zz(amp1)
+		zz(amp2)
+		zz(amp_3to6)
+		new = (
 			amp1 * np.sin(sina+.58*amp2*np.sin(sina14))
-	              + amp_3to6 * np.sin(sina+.89*amp_3to6*np.sin(sina))
-	              + amp_3to6 * np.sin(sina+.79*amp_3to6*np.sin(sina))
+		      + amp_3to6 * np.sin(sina+.89*amp_3to6*np.sin(sina))
+		      + amp_3to6 * np.sin(sina+.79*amp_3to6*np.sin(sina))
 		      )
 		new *= np.exp(-x2/decay[int(lf*100)]/44100.)
 		if cache_this[note] > 1:
 			note_cache[note] = new.copy()
-	    else:
+	else:
 		new = note_cache[note].copy()
-	    dec_ind = int(leg_stac*q)
-	    new[dec_ind:] *= np.exp(-np.arange(raw_note-dec_ind)/3000.)
-	    #print snd_len, raw_note
-	    data[pos:pos+snd_len] += ( new[:snd_len] * vol  )
+	dec_ind = int(leg_stac*q)
+	new[dec_ind:] *= np.exp(-np.arange(raw_note-dec_ind)/3000.)
+	#print snd_len, raw_note
+	return ( new[:snd_len] * vol  )
+
+def schedule(song,bpm=120,transpose=0,boost=1.1,repeat=0):
+	"""
+	Work out where the notes of the song start. Returns the note events
+	(nn, pos, (a, b, vol, kn, note)) for render_note, the length of the
+	song in samples and the size of the buffer to mix it into.
+	"""
+	bpmfac = 120./bpm
+
+	def length(l):
+	    return 88200./l*bpmfac
 
 	ex_pos = 0.
 	t_len = 0
@@ -273,13 +266,10 @@ def make_wav(song,bpm=120,transpose=0,leg_stac=.9,boost=1.1,repeat=0,fn="out.wav
 			y += '4'
 		cache_this[y] = cache_this.get(y, 0) + 1
 	#print "Note frequencies in song:", cache_this
-	data = np.zeros((repeat+1)*t_len + 441000.)
-	#print len(data)/44100., "s allocated"
 
+	events = []
 	for rp in range(repeat+1):
 		for nn, x in enumerate(song):
-		    if not nn % 4 and silent == False:
-		        print "[%u/%u]\t" % (nn+1,len(song))
 		    if x[0]!='r':
 		        if x[0][-1] == '*':
 		            vol = boost
@@ -297,25 +287,59 @@ def make_wav(song,bpm=120,transpose=0,leg_stac=.9,boost=1.1,repeat=0,fn="out.wav
 		        else:
 		            b=length(x[1])
 
-		        render2(a, b, vol, int(ex_pos), kn, note)
+			events.append((nn, int(ex_pos), (a, b, vol, kn, note)))
 			ex_pos = ex_pos + b
 
 		    if x[0]=='r':
 		        b=length(x[1])
 			ex_pos = ex_pos + b
 
+	return events, ex_pos, int((repeat+1)*t_len + 441000.)
+
+def render(song,bpm=120,transpose=0,leg_stac=.9,boost=1.1,repeat=0,silent=False,dtype=np.int16,out=None,workers=1):
+	"""
+	Render the song and return it as a NumPy array: int16 samples exactly
+	as make_wav writes them, or a float dtype scaled to [-1, 1). If out is
+	given, the samples are written into that array and a view is returned.
+	With workers other than 1 (None for one per CPU), the notes are
+	rendered in that many processes, with the same result.
+	Repeats are not rendered again: one pass is mixed and then tiled.
+	"""
+	events, ex_pos, buf_len = schedule(song, bpm, transpose, boost)
+	data = mixer.mix(events, render_note, buf_len, (leg_stac, envelopes.decay()), len(song), silent, workers)
+	data = mixer.tile(data, ex_pos, repeat)
+
+	out_len = int(2. * 44100. + (repeat+1)*ex_pos+.5)
+	return wav_io.normalize(data, out_len, dtype, out)
+
+def stream(song,sink,bpm=120,transpose=0,leg_stac=.9,boost=1.1,repeat=0,silent=False,block=4096,peak=STREAM_PEAK):
+	"""
+	Render the song into sink (anything with writeframesraw, such as a
+	play_wav.StreamPlayer) block by block, as soon as each block is final,
+	so playback can start long before the song is rendered. The mix cannot
+	be peak-normalized before it is complete, so it is scaled as if its
+	loudest sample were peak and clipped above that.
+	"""
+	events, ex_pos, buf_len = schedule(song, bpm, transpose, boost, repeat)
+	out_len = int(2. * 44100. + ex_pos+.5)
+	for data in mixer.mix_blocks(events, render_note, buf_len, out_len,
+			(leg_stac, envelopes.decay()), len(song), silent, block):
+		sink.writeframesraw(wav_io.scale(data, peak).tostring())
+
+def make_wav(song,bpm=120,transpose=0,leg_stac=.9,boost=1.1,repeat=0,fn="out.wav", silent=False,workers=1):
+	"""
+	Render the song and write it as a WAV file. fn may be a file name or a
+	writable file-like object.
+	"""
+	data2 = render(song, bpm, transpose, leg_stac, boost, repeat, silent, workers = workers)
+
 	##########################################################################
 	# Write to output file (in WAV format)
 	##########################################################################
 	if silent == False:
 		print "Writing to file", fn
 
-	data = data / (data.max() * 2.)
-	out_len = int(2. * 44100. + ex_pos+.5)
-	data2 = np.zeros(out_len, np.short)
-	data2[:] = 32000. * data[:out_len]
-	f.writeframes(data2.tostring())
-	f.close()
+	wav_io.write_wav(fn, data2)
 	print
 
 def mix_files(a, b, c, chann = 2, phase = -1.):
@@ -33,6 +33,7 @@
 
 import wave, struct
 import numpy as np
+import mixer, wav_io
 from math import sin, cos, pi, log, exp, floor, ceil
 
 # Example 1: The C major scale
@@ -154,64 +155,65 @@ for k in range(88):
 # Output file name
 #fn = 'pysynth_output.wav'
 
-data = []
-
-def make_wav(song,bpm=120,transpose=0,pause=0.,boost=1.1,repeat=0,fn="out.wav",silent=False):
-	f=wave.open(fn,'w')
+# Loudest raw sample expected in a mix; stream() scales to this because it
+# cannot normalize a mix that is still being rendered.
+STREAM_PEAK = 1.5
 
-	f.setnchannels(1)
-	f.setsampwidth(2)
-	f.setframerate(44100)
-	f.setcomptype('NONE','Not Compressed')
+data = []
 
+def waves2(hz,l):
+    a=44100./hz
+    b=float(l)/44100.*hz
+    return [a,round(b)]
+
+def render_note(a, b, vol, kn, noise, pause, endamp = .25, sm = 10):
+	"""
+	Render one plucked note, including its decaying tail, as a float array.
+	noise is the excitation of the string, int(44100./a) random samples.
+	"""
+	b2 = (1. - pause) * b
+	l=waves2(a, b2)
+	q=int(l[0]*l[1])
+
+	lf = log(a)
+	t = (lf-3.) / (8.5-3.)
+	volfac = 1. + .8 * t * cos(pi/5.3*(lf-3.))
+	snd_len = int((10.-lf)*q)
+	if lf < 4: snd_len *= 2
+	kp_len = int(l[0])
+	kps1 = np.zeros(snd_len)
+	kps2 = np.zeros(snd_len)
+	kps1[:kp_len] = noise
+
+	for t in range(kp_len):
+		kps2[t] = kps1[t:t+sm].mean()
+	delt = float(l[0])
+	li = int(floor(delt))
+	hi = int(ceil(delt))
+	ifac = delt % 1
+	delt2 = delt * (floor(delt) - 1) / floor(delt)
+	ifac2 = delt2 % 1
+	falloff = (4./lf*endamp)**(1./l[1])
+	for t in range(hi, snd_len):
+		v1 = ifac * kps2[t-hi]   + (1.-ifac) * kps2[t-li]
+		v2 = ifac2 * kps2[t-hi+1] + (1.-ifac2) * kps2[t-li+1]
+		kps2[t] += .5 * (v1 + v2) * falloff
+	return kps2*vol*volfac
+
+def schedule(song,bpm=120,transpose=0,boost=1.1,repeat=0,rng=np.random):
+	"""
+	Work out where the notes of the song start. Returns the note events
+	(nn, pos, (a, b, vol, kn, noise)) for render_note, the length of the
+	song in samples and the size of the buffer to mix it into.
+	The noise of every note is drawn here, in order, from rng (a NumPy
+	RandomState, NumPy's global one by default), so that rendering the
+	notes in any order or in other processes gives the same sound.
+	"""
 	bpmfac = 120./bpm
 
 	def length(l):
 	    return 88200./l*bpmfac
 
-	def waves2(hz,l):
-	    a=44100./hz
-	    b=float(l)/44100.*hz
-	    return [a,round(b)]
-
-	def asin(x):
-	    return sin(2.*pi*x)
-
-	def render2(a, b, vol, pos, knum, endamp = .25, sm = 10):
-	    b2 = (1. - pause) * b
-	    l=waves2(a, b2)
-	    ow=""
-	    q=int(l[0]*l[1])
-
-	    lf = log(a)
-	    t = (lf-3.) / (8.5-3.)
-	    volfac = 1. + .8 * t * cos(pi/5.3*(lf-3.))
-	    snd_len = int((10.-lf)*q)
-	    if lf < 4: snd_len *= 2
-	    x = np.arange(snd_len)
-	    s = x / float(q)
-
-	    ls = np.log(1. + s)
-	    kp_len = int(l[0])
-	    kps1 = np.zeros(snd_len)
-	    kps2 = np.zeros(snd_len)
-	    kps1[:kp_len] = np.random.normal(size = kp_len)
-
-	    for t in range(kp_len):
-		kps2[t] = kps1[t:t+sm].mean()
-	    delt = float(l[0])
-	    li = int(floor(delt))
-	    hi = int(ceil(delt))
-	    ifac = delt % 1
-	    delt2 = delt * (floor(delt) - 1) / floor(delt)
-	    ifac2 = delt2 % 1
-	    falloff = (4./lf*endamp)**(1./l[1])
-	    for t in range(hi, snd_len):
-		v1 = ifac * kps2[t-hi]   + (1.-ifac) * kps2[t-li]
-		v2 = ifac2 * kps2[t-hi+1] + (1.-ifac2) * kps2[t-li+1]
-	        kps2[t] += .5 * (v1 + v2) * falloff
-	    data[pos:pos+snd_len] += kps2*vol*volfac
-
 	ex_pos = 0.
 	t_len = 0
 	for y, x in song:
@@ -219,13 +221,10 @@ def make_wav(song,bpm=120,transpose=0,pause=0.,boost=1.1,repeat=0,fn="out.wav",s
 			t_len+=length(-2.*x/3.)
 		else:
 			t_len+=length(x)
-	data = np.zeros((repeat+1)*t_len + 20. * 44100.)
-	#print len(data)/44100., "s allocated"
 
+	events = []
 	for rp in range(repeat+1):
 		for nn, x in enumerate(song):
-		    if not nn % 4 and silent == False:
-		        print "[%u/%u]\t" % (nn+1,len(song))
 		    if x[0]!='r':
 		        if x[0][-1] == '*':
 		            vol = boost
@@ -244,25 +243,61 @@ def make_wav(song,bpm=120,transpose=0,pause=0.,boost=1.1,repeat=0,fn="out.wav",s
 		            b=length(-2.*x[1]/3.)
 		        else:
 		            b=length(x[1])
-		        render2(a, b, vol, int(ex_pos), kn)
+			noise = rng.normal(size = int(44100./a))
+			events.append((nn, int(ex_pos), (a, b, vol, kn, noise)))
 			ex_pos = ex_pos + b
 
 		    if x[0]=='r':
 		        b=length(x[1])
 			ex_pos = ex_pos + b
 
+	return events, ex_pos, int((repeat+1)*t_len + 20. * 44100.)
+
+def render(song,bpm=120,transpose=0,pause=0.,boost=1.1,repeat=0,silent=False,dtype=np.int16,out=None,workers=1,rng=np.random):
+	"""
+	Render the song and return it as a NumPy array: int16 samples exactly
+	as make_wav writes them, or a float dtype scaled to [-1, 1). If out is
+	given, the samples are written into that array and a view is returned.
+	With workers other than 1 (None for one per CPU), the notes are
+	rendered in that many processes, with the same result.
+	Repeats are not rendered again: one pass is mixed and then tiled.
+	The string noise is drawn from rng, see schedule.
+	"""
+	events, ex_pos, buf_len = schedule(song, bpm, transpose, boost, rng = rng)
+	data = mixer.mix(events, render_note, buf_len, (pause,), len(song), silent, workers)
+	data = mixer.tile(data, ex_pos, repeat)
+
+	out_len = int(2. * 44100. + (repeat+1)*ex_pos+.5)
+	return wav_io.normalize(data, out_len, dtype, out)
+
+def stream(song,sink,bpm=120,transpose=0,pause=0.,boost=1.1,repeat=0,silent=False,block=4096,peak=STREAM_PEAK,rng=np.random):
+	"""
+	Render the song into sink (anything with writeframesraw, such as a
+	play_wav.StreamPlayer) block by block, as soon as each block is final,
+	so playback can start long before the song is rendered. The mix cannot
+	be peak-normalized before it is complete, so it is scaled as if its
+	loudest sample were peak and clipped above that.
+	"""
+	events, ex_pos, buf_len = schedule(song, bpm, transpose, boost, repeat, rng)
+	out_len = int(2. * 44100. + ex_pos+.5)
+	for data in mixer.mix_blocks(events, render_note, buf_len, out_len,
+			(pause,), len(song), silent, block):
+		sink.writeframesraw(wav_io.scale(data, peak).tostring())
+
+def make_wav(song,bpm=120,transpose=0,pause=0.,boost=1.1,repeat=0,fn="out.wav",silent=False,workers=1,rng=np.random):
+	"""
+	Render the song and write it as a WAV file. fn may be a file name or a
+	writable file-like object.
+	"""
+	data2 = render(song, bpm, transpose, pause, boost, repeat, silent, workers = workers, rng = rng)
+
 	##########################################################################
 	# Write to output file (in WAV format)
 	##########################################################################
 	if silent == False:
 		print "Writing to file", fn
 
-	data = data / (data.max() * 2.)
-	out_len = int(2. * 44100. + ex_pos+.5)
-	data2 = np.zeros(out_len, np.short)
-	data2[:] = 32000. * data[:out_len]
-	f.writeframes(data2.tostring())
-	f.close()
+	wav_io.write_wav(fn, data2)
 	print
 
 def mix_files(a, b, c, chann = 2, phase = -1.):
@@ -16,21 +16,23 @@ Some of the definitions are borrowed from PlayABC 1.1
 2012-07-17
 """
 
-import sys, urllib2
+import sys
+import engines
 
 sel = False
 try: num = int(sys.argv[2])
 except: num = 1
 song = []
 
+# The engine is only imported once the song has been parsed.
 if "--syn_b" in sys.argv:
-	import pysynth_b as pysynth
+	engine = 'b'
 elif "--syn_s" in sys.argv:
-	import pysynth_s as pysynth
+	engine = 's'
 elif "--syn_e" in sys.argv:
-	import pysynth_e as pysynth
+	engine = 'e'
 else:
-	import pysynth
+	engine = 'a'
 
 
 # flatten or sharpen notes according to key signature
@@ -258,6 +260,7 @@ def get_bpm(s, u = "1/4"):
 
 fn = sys.argv[1]
 if fn[:5] == 'http:':
+	import urllib2
 	f = urllib2.urlopen(fn)
 else:
 	f = open(fn)
@@ -323,5 +326,5 @@ else:
 	print
 	print len(song)
 
-	pysynth.make_wav(song, bpm = bpm)
+	engines.get(engine).make_wav(song, bpm = bpm)
 
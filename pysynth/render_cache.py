@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+
+"""
+Content-addressed cache of rendered PCM for songs and phrases.
+
+A rendering is stored under a hash of the engine name, the render
+parameters and the notes, so the same phrase rendered with the same
+settings is only ever synthesized once. There are two tiers: an in-memory
+LRU and, if a directory is given, one file per rendering on disk. Both are
+bounded in bytes; the least recently used renderings are evicted first.
+
+Songs built from phrases (as generate.py does) can be assembled from the
+cached audio of their phrases. That only works for engines whose notes
+neither overlap nor get normalized over the whole song, i.e. pysynth ('a')
+and pysynth_beeper. The NumPy engines are cached per song.
+"""
+
+import hashlib, os, tempfile
+from collections import OrderedDict
+import engines, wav_io
+
+# Engines whose phrases can be rendered on their own and concatenated.
+PHRASE_ENGINES = ('a', 'beeper')
+
+# Part of every key; bump it when the engines start to sound different.
+FORMAT = 1
+
+# Render parameters left out of the key: they do not change the audio, or
+# (rng) only pick the noise of pysynth_s, which a cached rendering keeps.
+_IGNORED = ('silent', 'sink', 'dtype', 'out', 'workers', 'rng')
+
+def key(engine, notes, params = {}):
+	''' Return the cache key for rendering the notes with the given engine
+	and keyword parameters.'''
+
+	params = sorted((k, v) for k, v in params.items() if k not in _IGNORED)
+	notes = [tuple(n) for n in notes]
+	return hashlib.sha1(repr((FORMAT, engine, params, notes)).encode('utf-8')).hexdigest()
+
+def _render(engine, notes, params):
+	m = engines.get(engine)
+	if hasattr(m, 'render_raw'):
+		return m.render_raw(notes, **params)
+	return wav_io.to_bytes(m.render(notes, **params))
+
+class RenderCache:
+	''' Rendered PCM (16-bit mono bytes) by key, in memory and optionally
+	in a directory.'''
+
+	def __init__(self, directory = None, max_memory = 64 << 20, max_disk = 512 << 20):
+		self.directory = directory
+		self.max_memory = max_memory
+		self.max_disk = max_disk
+		self.memory = OrderedDict()
+		self.memory_size = 0
+		self.hits = self.misses = 0
+		if directory is not None and not os.path.isdir(directory):
+			os.makedirs(directory)
+
+	def _path(self, k):
+		return os.path.join(self.directory, k + '.pcm')
+
+	def _remember(self, k, pcm):
+		if k in self.memory:
+			self.memory_size -= len(self.memory.pop(k))
+		if len(pcm) > self.max_memory:
+			return
+		self.memory[k] = pcm
+		self.memory_size += len(pcm)
+		while self.memory_size > self.max_memory:
+			self.memory_size -= len(self.memory.popitem(last = False)[1])
+
+	def get(self, k):
+		''' Return the PCM stored under k, or None.'''
+
+		if k in self.memory:
+			pcm = self.memory.pop(k)
+			self.memory[k] = pcm
+			self.hits += 1
+			return pcm
+		if self.directory is not None:
+			try:
+				with open(self._path(k), 'rb') as f:
+					pcm = f.read()
+				os.utime(self._path(k), None)
+			except (IOError, OSError):
+				pass
+			else:
+				self._remember(k, pcm)
+				self.hits += 1
+				return pcm
+		self.misses += 1
+		return None
+
+	def put(self, k, pcm):
+		''' Store PCM under k in both tiers, evicting as needed.'''
+
+		self._remember(k, pcm)
+		if self.directory is None or len(pcm) > self.max_disk:
+			return
+		fd, tmp = tempfile.mkstemp('.tmp', '', self.directory)
+		with os.fdopen(fd, 'wb') as f:
+			f.write(pcm)
+		os.rename(tmp, self._path(k))
+		self._evict_disk()
+
+	def _evict_disk(self):
+		files = []
+		for name in os.listdir(self.directory):
+			if name.endswith('.pcm'):
+				st = os.stat(os.path.join(self.directory, name))
+				files.append((st.st_mtime, st.st_size, name))
+		total = sum(size for mtime, size, name in files)
+		for mtime, size, name in sorted(files):
+			if total <= self.max_disk:
+				break
+			try:
+				os.remove(os.path.join(self.directory, name))
+			except OSError:
+				pass
+			total -= size
+
+	def clear(self):
+		''' Drop everything from both tiers.'''
+
+		self.memory.clear()
+		self.memory_size = 0
+		if self.directory is not None:
+			for name in os.listdir(self.directory):
+				if name.endswith('.pcm'):
+					os.remove(os.path.join(self.directory, name))
+
+	def render(self, engine, notes, **params):
+		''' Render the notes with the named engine and keyword parameters,
+		or fetch the rendering from the cache. Returns 16-bit PCM bytes.'''
+
+		k = key(engine, notes, params)
+		pcm = self.get(k)
+		if pcm is None:
+			pcm = _render(engine, notes, params)
+			self.put(k, pcm)
+		return pcm
+
+	def render_phrases(self, engine, phrases, **params):
+		''' Render a song made of a list of phrases (lists of notes). With
+		one of the PHRASE_ENGINES the song is put together from the cached
+		audio of each phrase, so a phrase that comes up again (such as the
+		tonic at both ends of a generated song) is only rendered once. Note
+		starts can then differ by a sample from rendering the song in one
+		go. Other engines render and cache the song as a whole.'''
+
+		notes = [n for phrase in phrases for n in phrase]
+		if engine not in PHRASE_ENGINES or params.get('repeat'):
+			return self.render(engine, notes, **params)
+		k = key(engine, notes, params)
+		pcm = self.get(k)
+		if pcm is None:
+			pcm = b''.join(self.render(engine, phrase, **params) for phrase in phrases)
+			self.put(k, pcm)
+		return pcm
+
+	def make_wav(self, engine, phrases, fn = "out.wav", **params):
+		''' Like the engines' make_wav, for a song given as a list of phrases.
+		fn may be a file name or a writable file-like object.'''
+
+		wav_io.write_wav(fn, self.render_phrases(engine, phrases, **params))
+
+_default = None
+
+def default():
+	''' The shared cache: on disk in $PYSYNTH_CACHE if that is set, else in
+	memory only.'''
+
+	global _default
+	if _default is None:
+		_default = RenderCache(os.environ.get('PYSYNTH_CACHE'))
+	return _default
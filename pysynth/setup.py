@@ -8,6 +8,6 @@ setup(name="PySynth",
         author="Martin C. Doege",
         author_email="mdoege@compuserve.com",
 	url="http://home.arcor.de/mdoege/pysynth/",
-        py_modules=["pysynth", "pysynth_b", "pysynth_s", "pysynth_e", "pysynth_beeper","play_wav"],
+        py_modules=["pysynth", "pysynth_b", "pysynth_s", "pysynth_e", "pysynth_beeper","play_wav", "wav_io", "mixer", "engines", "envelopes", "render_cache"],
 	scripts=["read_abc.py", "nokiacomposer2wav.py", "test_nokiacomposer2wav.py", "menv.py", "mixfiles.py"],
 )
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+"""
+In-memory rendering helpers shared by the PySynth engines.
+
+All engines produce 16-bit mono PCM at 44.1 kHz. These helpers write that
+PCM to a file name or to any file-like object, or hand it back as a NumPy
+array, so callers do not have to go through a temporary WAV file.
+"""
+
+import wave
+
+# NumPy is imported by the functions that need it, so that the pure-Python
+# engines (pysynth and pysynth_beeper) start without loading it.
+
+SAMPLING_RATE = 44100
+
+class BufferSink:
+	''' Collects raw frames in memory; a stand-in for a wave writer.'''
+
+	def __init__(self):
+		self.chunks = []
+
+	def writeframesraw(self, data):
+		self.chunks.append(data)
+
+	def writeframes(self, data):
+		self.chunks.append(data)
+
+	def getvalue(self):
+		return b''.join(self.chunks)
+
+def open_wav(fn, chann = 1, nframes = 0):
+	''' Open a file name or a writable file-like object as a 16-bit WAV.'''
+
+	f = wave.open(fn, 'w')
+	f.setnchannels(chann)
+	f.setsampwidth(2)
+	f.setframerate(SAMPLING_RATE)
+	f.setnframes(nframes)
+	f.setcomptype('NONE','Not Compressed')
+	return f
+
+def to_bytes(data):
+	''' Convert rendered audio (raw bytes or a NumPy array) to 16-bit PCM bytes.'''
+
+	if not isinstance(data, bytes):
+		import numpy as np
+		if data.dtype != np.int16:
+			data = np.clip(np.round(data * 32768.), -32768, 32767).astype(np.int16)
+		return data.tostring()
+	return data
+
+def write_wav(fn, data, chann = 1):
+	''' Write rendered audio to fn, a file name or a file-like object.
+
+	The frame count is set up front, so the header never has to be patched
+	and unseekable outputs such as pipes work too.'''
+
+	raw = to_bytes(data)
+	f = open_wav(fn, chann, len(raw) // (2 * chann))
+	f.writeframes(raw)
+	f.close()
+
+def _finish(pcm, dtype, out):
+	import numpy as np
+	if dtype != np.int16:
+		pcm = (pcm / 32768.).astype(dtype)
+	if out is not None:
+		out[:len(pcm)] = pcm
+		return out[:len(pcm)]
+	return pcm
+
+def from_bytes(raw, dtype = None, out = None):
+	''' Turn 16-bit PCM bytes into an int16 array, or into floats in [-1, 1).'''
+
+	import numpy as np
+	return _finish(np.frombuffer(raw, np.int16), dtype or np.int16, out)
+
+def normalize(data, out_len, dtype = None, out = None):
+	''' Scale a floating-point mix the way the NumPy engines always have
+	(peak at half of full scale) and cut it to out_len samples.'''
+
+	import numpy as np
+	dtype = dtype or np.int16
+	data = data / (data.max() * 2.)
+	if dtype == np.int16:
+		pcm = np.zeros(out_len, np.short)
+		pcm[:] = 32000. * data[:out_len]
+		return _finish(pcm, dtype, out)
+	return _finish(32000. * data[:out_len], dtype, out)
+
+def scale(data, peak):
+	''' Convert part of a floating-point mix to int16 as if the loudest
+	sample of the whole mix were peak, clipping anything louder. Used when
+	audio has to go out before the mix is complete.'''
+
+	import numpy as np
+	return np.clip(32000. * data / (peak * 2.), -32768, 32767).astype(np.short)